@@ -9,3 +9,6 @@ folder=r'E:\knowledge_base\russian_regulations'
 
 metadata_list = llm_serv.get_metadata(folder_path=folder, db_service=db_serv)
 db_serv.save_metadata(metadata_list)
+
+# Publish an index version with the new descriptions (document-level retrieval stage)
+llm_serv.reindex_knowledge_base(folder)
@@ -0,0 +1,130 @@
+import argparse
+import math
+import os
+
+from chunking import character_chunks, chunk_pages, chunking_report
+from faiss_index import MIN_POINTS_PER_CENTROID, IndexSpec, index_metric, recall_latency_report
+from index_manifest import IndexManifest, file_fingerprint
+from index_storage import IndexStorage
+from llm_service import LLMService
+from normalization import normalization_report
+from settings import knowledge_base_paths
+from text_cache import extract_pdfs_cached
+
+# Rebuild, inspect or roll back knowledge base indexes. Running bot sessions
+# switch to the published version on their next query.
+#
+#   python -m admin.index_management rebuild "Российские стандарты"
+#   python -m admin.index_management versions "Российские стандарты"
+#   python -m admin.index_management rollback "Российские стандарты"
+#   python -m admin.index_management benchmark "ISO Regulations" --queries 500 --k 10
+#     (recall, latency and memory of index types and compressed encodings)
+#   python -m admin.index_management chunking "ISO Regulations"
+#     (chunk count, token sizes, index size and search latency of the chunkers)
+#   python -m admin.index_management normalization "ISO Regulations"
+#     (tokens saved by text normalization in the published index)
+
+
+def resolve_folder(knowledge_base):
+    return knowledge_base_paths.get(knowledge_base, knowledge_base)
+
+
+def benchmark_specs(vector_count, dimension):
+    """
+    Candidate index specs for a corpus of vector_count vectors: exact search, the
+    compressed encodings with and without exact rescoring, IVF with the usual
+    ~4*sqrt(n) clusters over a range of nprobe, and HNSW over a range of efSearch.
+    """
+    nlist = max(1, min(int(4 * math.sqrt(vector_count)), vector_count // MIN_POINTS_PER_CENTROID))
+    pq_m = next(m for m in (96, 64, 48, 32, 16, 8, 4, 2, 1) if dimension % m == 0)
+    specs = [IndexSpec()]
+    for encoding in ("fp16", "sq8", "pq"):
+        specs.append(IndexSpec(encoding=encoding, pq_m=pq_m))
+        if encoding != "fp16":
+            specs.append(IndexSpec(encoding=encoding, pq_m=pq_m, rescore=True))
+    specs += [IndexSpec("ivf", nlist=nlist, nprobe=nprobe) for nprobe in (1, 4, 16, 64) if nprobe <= nlist]
+    specs += [IndexSpec("hnsw", m=32, ef_search=ef_search) for ef_search in (16, 32, 64, 128)]
+    return specs
+
+
+def print_benchmark(folder, query_count, k):
+    vector_store, _ = LLMService().load_vector_store(folder)
+    if vector_store is None:
+        print("No published index to benchmark.")
+        return
+    index = vector_store.index
+    vectors = index.reconstruct_n(0, index.ntotal)
+    rows = recall_latency_report(
+        vectors, benchmark_specs(len(vectors), vectors.shape[1]), metric=index_metric(index), query_count=query_count, k=k
+    )
+    print(f"{len(vectors)} vectors, {vectors.shape[1]} dimensions, {min(query_count, len(vectors))} queries")
+    columns = list(rows[0])
+    print("  ".join(f"{column:>48}" if column == "index" else f"{column:>13}" for column in columns))
+    for row in rows:
+        print("  ".join(f"{row[column]:>48}" if column == "index" else f"{row[column]:>13}" for column in columns))
+
+
+def print_chunking_benchmark(folder, query_count, k):
+    llm_service = LLMService()
+    # Served from the text cache for PDFs extracted before, so reruns skip PyMuPDF
+    fingerprints = {
+        filename: file_fingerprint(os.path.join(folder, filename)) for filename in llm_service._list_pdf_files(folder)
+    }
+    documents = [extraction.pages for extraction in extract_pdfs_cached(folder, fingerprints) if extraction.ok]
+    vector_store, _ = llm_service.load_vector_store(folder)
+    dimension = vector_store.index.d if vector_store is not None else len(llm_service.embed_query("dimension"))
+    rows = chunking_report(
+        documents, {"character": character_chunks, "structure": chunk_pages}, dimension, query_count=query_count, k=k
+    )
+    print(f"{len(documents)} PDFs, {sum(len(pages) for pages in documents)} pages, {dimension} dimensions")
+    columns = list(rows[0])
+    print("  ".join(f"{column:>13}" for column in columns))
+    for row in rows:
+        print("  ".join(f"{row[column]:>13}" for column in columns))
+
+
+def print_normalization_report(storage):
+    vector_store_dir = storage.current_path()
+    manifest = IndexManifest.load(vector_store_dir) if vector_store_dir else None
+    if manifest is None:
+        print("No published index to report on.")
+        return
+    report = normalization_report(manifest)
+    print(
+        f"{report['files']} PDFs: {report['raw_tokens']} tokens extracted, "
+        f"{report['tokens']} after normalization ({report['saved']} saved)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage knowledge base index versions.")
+    parser.add_argument("action", choices=["rebuild", "versions", "rollback", "benchmark", "chunking", "normalization"])
+    parser.add_argument("knowledge_base", help="Knowledge base name from settings or a folder path")
+    parser.add_argument("--queries", type=int, default=200, help="benchmark: number of sampled queries")
+    parser.add_argument("--k", type=int, default=10, help="benchmark: neighbours compared for recall")
+    args = parser.parse_args()
+
+    folder = resolve_folder(args.knowledge_base)
+    storage = IndexStorage(folder)
+
+    if args.action == "rebuild":
+        version = LLMService().reindex_knowledge_base(folder)
+        print(f"Published index version: {version}")
+    elif args.action == "versions":
+        current = storage.current_version()
+        for version in storage.versions():
+            marker = "*" if version == current else " "
+            print(f"{marker} {version}")
+    elif args.action == "rollback":
+        version = storage.rollback()
+        print(f"Rolled back to: {version}" if version else "No previous version to roll back to.")
+    elif args.action == "benchmark":
+        print_benchmark(folder, args.queries, args.k)
+    elif args.action == "chunking":
+        print_chunking_benchmark(folder, args.queries, args.k)
+    elif args.action == "normalization":
+        print_normalization_report(storage)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import argparse
+
+from db_service import DatabaseService
+from settings import knowledge_base_paths
+
+# Install the project permissions schema and assign documents and users to projects.
+# A document in a project is only retrieved for the project's members; documents
+# without a project are visible to everyone. Running bots pick up changes within
+# PERMISSIONS_CACHE_SECONDS.
+#
+#   python -m admin.project_management install
+#   python -m admin.project_management assign "Tower A" "Российские стандарты"
+#   python -m admin.project_management assign "Tower A" "E:\knowledge_base\contracts\tower_a.pdf"
+#   python -m admin.project_management unassign "E:\knowledge_base\contracts\tower_a.pdf"
+#   python -m admin.project_management add-user "Tower A" 123456789
+#   python -m admin.project_management remove-user "Tower A" 123456789
+#   python -m admin.project_management list
+
+
+def resolve_path(path):
+    return knowledge_base_paths.get(path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage project permissions of knowledge base documents.")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    subparsers.add_parser("install", help="add the project permissions schema to the database")
+    assign = subparsers.add_parser("assign", help="put a document, or every document of a folder, into a project")
+    assign.add_argument("project")
+    assign.add_argument("path", help="Knowledge base name from settings, folder or PDF path")
+    unassign = subparsers.add_parser("unassign", help="make a document or folder visible to everyone again")
+    unassign.add_argument("path", help="Knowledge base name from settings, folder or PDF path")
+    for action in ("add-user", "remove-user"):
+        members = subparsers.add_parser(action, help=f"{action.split('-')[0]} a project member")
+        members.add_argument("project")
+        members.add_argument("user_id", type=int, help="Telegram user id")
+    subparsers.add_parser("list", help="show projects with their document counts and members")
+    args = parser.parse_args()
+
+    db_service = DatabaseService()
+    if args.action != "install" and not db_service.project_schema_installed():
+        print("The project permissions schema is not installed; run the install action first.")
+        return
+
+    if args.action == "install":
+        db_service.install_project_schema()
+        print("Project permissions schema installed.")
+    elif args.action == "assign":
+        count = db_service.assign_project(resolve_path(args.path), args.project)
+        print(f"Assigned {count} documents to '{args.project}'.")
+    elif args.action == "unassign":
+        count = db_service.assign_project(resolve_path(args.path), None)
+        print(f"{count} documents are visible to everyone.")
+    elif args.action == "add-user":
+        db_service.add_project_member(args.user_id, args.project)
+        print(f"Added {args.user_id} to '{args.project}'.")
+    elif args.action == "remove-user":
+        db_service.remove_project_member(args.user_id, args.project)
+        print(f"Removed {args.user_id} from '{args.project}'.")
+    elif args.action == "list":
+        for project, details in sorted(db_service.get_projects().items()):
+            members = ", ".join(str(user_id) for user_id in details["members"]) or "no members"
+            print(f"{project}: {details['documents']} documents; {members}")
+
+
+if __name__ == "__main__":
+    main()
@@ -46,6 +46,8 @@ def main():
     if db_service:
         application.bot_data["db_service"] = db_service
         logger.info("DatabaseService initialized and stored in bot_data.")
+        # Warns when project permissions cannot apply, as every document is then visible to every user
+        db_service.project_schema_installed()
     else:
         logger.error("Failed to initialize DatabaseService.")
 
@@ -64,10 +66,11 @@ def main():
     application.add_handler(CommandHandler("language", handlers.language))
     application.add_handler(CommandHandler("clear_context", handlers.clear_context))
     application.add_handler(CommandHandler("references", handlers.references_command))
+    application.add_handler(CommandHandler("filter", handlers.filter_command))
 
     # 6. Add Callback Query Handlers
     application.add_handler(
-        CallbackQueryHandler(handlers.set_knowledge_base, pattern=r"^set_knowledge:")
+        CallbackQueryHandler(handlers.set_knowledge_base, pattern=r"^(set|add)_knowledge:")
     )
     application.add_handler(
         CallbackQueryHandler(handlers.send_file, pattern=r"^get_file:")
@@ -0,0 +1,208 @@
+# chunking.py
+
+import functools
+import logging
+import re
+import time
+
+import faiss
+import numpy as np
+import tiktoken
+from langchain.schema import Document
+from langchain.text_splitter import CharacterTextSplitter
+
+from settings import CHUNK_MAX_TOKENS, CHUNK_MIN_TOKENS, CHUNK_TOKEN_ENCODING
+
+logger = logging.getLogger(__name__)
+
+# Bump when chunk boundaries change, so indexes built with the old ones are rebuilt
+CHUNKER_VERSION = 3
+
+# Lines opening a clause: "5.2.1 Нагрузки", "5. Общие положения", "А.3 Annex clause"
+_CLAUSE_RE = re.compile(r"^\s*(?:\d+(?:\.\d+)+\.?|\d{1,2}\.|[A-ZА-Я]\.\d+(?:\.\d+)*\.?)\s+\S")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?;:])\s+|\n+")
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding():
+    return tiktoken.get_encoding(CHUNK_TOKEN_ENCODING)
+
+
+def count_tokens(text):
+    """
+    Number of tokens of text for the embedding model's tokenizer.
+    """
+    return len(_encoding().encode(text, disallowed_special=()))
+
+
+def chunker_signature():
+    """
+    Recorded in the index manifest; a different signature means the indexed chunks
+    were cut differently and the knowledge base is rebuilt.
+    """
+    return f"blocks-v{CHUNKER_VERSION}:{CHUNK_MAX_TOKENS}:{CHUNK_MIN_TOKENS}:{CHUNK_TOKEN_ENCODING}"
+
+
+def _units(pages):
+    """
+    Yield (text, page, is_heading) for the headings and clause-sized paragraphs of
+    pages, in reading order. Blocks are split further where a line opens a clause.
+    Pages extracted without blocks are treated as one block each.
+    """
+    for page in pages:
+        blocks = page.blocks if page.blocks is not None else [(page.text, False)]
+        for text, is_heading in blocks:
+            if is_heading:
+                heading = " ".join(text.split())
+                if heading:
+                    yield heading, page.page, True
+                continue
+            lines = []
+            for line in text.splitlines():
+                if _CLAUSE_RE.match(line) and lines:
+                    yield "\n".join(lines), page.page, False
+                    lines = []
+                if line.strip():
+                    lines.append(line.strip())
+            if lines:
+                yield "\n".join(lines), page.page, False
+
+
+def _pieces(text, tokens, max_tokens, count, first_max=None):
+    """
+    Split one unit that does not fit at sentence ends, and sentences that are still
+    too long at spaces. The first piece holds at most first_max tokens (the room left
+    in the current chunk), the others max_tokens. Yields (piece, tokens).
+    """
+    limit = first_max or max_tokens
+    if tokens <= limit:
+        yield text, tokens
+        return
+    for parts in (_SENTENCE_END_RE.split(text), text.split()):
+        if len(parts) > 1:
+            break
+    else:
+        # No break point at all (e.g. a long run without spaces): cut by characters
+        step = max(1, len(text) * max_tokens // tokens)
+        for start in range(0, len(text), step):
+            piece = text[start:start + step]
+            yield piece, count(piece)
+        return
+    current, current_tokens = [], 0
+    for part in parts:
+        part_tokens = count(part)
+        if current and current_tokens + part_tokens > limit:
+            piece = " ".join(current)
+            yield from _pieces(piece, count(piece), limit, count)
+            current, current_tokens, limit = [], 0, max_tokens
+        current.append(part)
+        current_tokens += part_tokens
+    if current:
+        piece = " ".join(current)
+        yield from _pieces(piece, count(piece), limit, count)
+
+
+def chunk_pages(pages, max_tokens=CHUNK_MAX_TOKENS, min_tokens=CHUNK_MIN_TOKENS, count=count_tokens):
+    """
+    Split the page records of one PDF into chunks of at most max_tokens tokens that
+    end at headings and clause boundaries. A heading closes the current chunk once
+    it holds min_tokens, so sections are not glued to their neighbours while tiny
+    sections are. A section that needs several chunks repeats its heading at the
+    start of each. Chunks carry the source filename and the 0-based page they start on.
+    """
+    chunks = []
+    parts, tokens, page = [], 0, None
+    section, section_tokens = None, 0
+    carried = False  # parts hold only the repeated section heading
+    has_body = False  # parts hold more than headings
+    previous_heading = False
+
+    def flush():
+        nonlocal parts, tokens, page, carried, has_body
+        if parts and not carried:
+            chunks.append(Document(page_content="\n".join(parts), metadata={"source": pages[0].source, "page": page}))
+        parts, tokens, page, carried, has_body = [], 0, None, False, False
+
+    for text, unit_page, is_heading in _units(pages):
+        unit_tokens = count(text)
+        if is_heading:
+            if carried or tokens >= min_tokens:
+                flush()
+            if previous_heading and section is not None:
+                section, section_tokens = f"{section}\n{text}", section_tokens + unit_tokens
+            else:
+                section, section_tokens = text, unit_tokens
+            parts.append(text)
+            tokens += unit_tokens
+            page = unit_page if page is None else page
+            previous_heading = True
+            continue
+
+        previous_heading = False
+        # A unit that fits a chunk moves to the next one whole. Pieces of a longer unit
+        # leave room for the repeated section heading, and the first one fills the
+        # current chunk unless that would make a tiny piece
+        repeat_heading = section is not None and section_tokens <= max_tokens // 2
+        budget = max_tokens - section_tokens if repeat_heading else max_tokens
+        room = max_tokens - tokens
+        fill = unit_tokens > budget and room >= 1 and (not has_body or room >= min_tokens)
+        first_max = room if fill else budget
+        for piece, piece_tokens in _pieces(text, unit_tokens, budget, count, first_max):
+            if parts and tokens + piece_tokens > max_tokens:
+                flush()
+                if repeat_heading and section_tokens + piece_tokens <= max_tokens:
+                    parts, tokens, page, carried = [section], section_tokens, unit_page, True
+            parts.append(piece)
+            tokens += piece_tokens
+            page = unit_page if page is None else page
+            carried, has_body = False, True
+    flush()
+    return chunks
+
+
+def character_chunks(pages):
+    """
+    The previous splitter: 1000-character chunks with 100 characters of overlap,
+    split per page. Kept to benchmark chunk_pages against.
+    """
+    text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+    return text_splitter.split_documents([page.to_document() for page in pages])
+
+
+def chunking_report(documents, splitters, dimension, query_count=200, k=10, seed=0, count=count_tokens):
+    """
+    Compare splitters ({name: function(pages) -> chunks}) over documents (a list of
+    page-record lists, one per PDF): chunk count, token sizes, tiny chunks, the size
+    of a float32 flat index plus chunk text, and exact-search latency over that many
+    vectors. Vectors are random, as flat-search latency depends only on their count
+    and dimension; nothing is embedded. Returns a list of dict rows.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for name, split in splitters.items():
+        started = time.monotonic()
+        chunks = [chunk for pages in documents for chunk in split(pages)]
+        split_seconds = time.monotonic() - started
+        sizes = np.array([count(chunk.page_content) for chunk in chunks] or [0])
+        text_bytes = sum(len(chunk.page_content.encode("utf-8")) for chunk in chunks)
+
+        vectors = rng.standard_normal((max(1, len(chunks)), dimension)).astype(np.float32)
+        index = faiss.IndexFlatIP(dimension)
+        index.add(vectors)
+        queries = rng.standard_normal((query_count, dimension)).astype(np.float32)
+        started = time.perf_counter()
+        index.search(queries, min(k, index.ntotal))
+        latency_ms = (time.perf_counter() - started) * 1000 / query_count
+
+        rows.append({
+            "splitter": name,
+            "chunks": len(chunks),
+            "tokens": int(sizes.sum()),
+            "mean_tokens": round(float(sizes.mean()), 1),
+            "p95_tokens": int(np.percentile(sizes, 95)),
+            f"under_{CHUNK_MIN_TOKENS}": int((sizes < CHUNK_MIN_TOKENS).sum()),
+            "index_mb": round((vectors.nbytes + text_bytes) / 1024 / 1024, 2),
+            "latency_ms": round(latency_ms, 3),
+            "split_seconds": round(split_seconds, 2),
+        })
+    return rows
@@ -18,6 +18,52 @@ db_port = os.getenv("DB_PORT")
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Project permissions: the project each document belongs to and the projects each
+# user is a member of (see get_hidden_documents). Safe to run more than once.
+PROJECT_PERMISSIONS_SCHEMA = """
+    ALTER TABLE documents_server ADD COLUMN IF NOT EXISTS project TEXT;
+    CREATE INDEX IF NOT EXISTS documents_server_project_idx ON documents_server (project);
+    CREATE TABLE IF NOT EXISTS user_projects (
+        user_id BIGINT NOT NULL,
+        project TEXT NOT NULL,
+        PRIMARY KEY (user_id, project)
+    );
+"""
+
+_PROJECT_SCHEMA_QUERY = """
+    SELECT
+        EXISTS (SELECT 1 FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = 'documents_server'
+                  AND column_name = 'project'),
+        EXISTS (SELECT 1 FROM information_schema.tables
+                WHERE table_schema = current_schema() AND table_name = 'user_projects')
+"""
+
+# Whether the missing project permissions schema was reported already
+_project_schema_warned = False
+
+
+def _warn_project_schema_missing():
+    global _project_schema_warned
+    if not _project_schema_warned:
+        _project_schema_warned = True
+        logger.warning(
+            "Project permissions schema is not installed; every document is visible to every user. "
+            "Install it with: python -m admin.project_management install"
+        )
+
+
+def _like_escape(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _like_prefix(path):
+    """
+    LIKE patterns matching path itself and everything under it.
+    """
+    return [_like_escape(path), _like_escape(os.path.join(path, "")) + "%"]
+
+
 class DatabaseService:
     def __init__(self):
         self.dbname = db_name
@@ -166,6 +212,157 @@ class DatabaseService:
             cursor.close()
             connection.close()
 
+    def get_document_descriptions(self, path_files):
+        """
+        Returns {path_file: {"document_type", "description", "language"}} for the
+        analysed, non-deleted files among path_files, or None if the query failed.
+        """
+        if not path_files:
+            return {}
+        connection = None
+        try:
+            connection = self.connect()
+            with connection.cursor() as cursor:
+                query = """
+                    SELECT path_file, document_type, description, language FROM documents_server
+                    WHERE path_file = ANY(%s) AND deleted = FALSE
+                """
+                cursor.execute(query, (list(path_files),))
+                return {
+                    row[0]: {"document_type": row[1], "description": row[2], "language": row[3]}
+                    for row in cursor.fetchall()
+                }
+        except Exception as e:
+            logger.error(f"Error retrieving document descriptions: {e}")
+            return None
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def get_hidden_documents(self, user_id, folder_path):
+        """
+        Returns the path_files under folder_path that belong to a project the user is
+        not a member of (documents_server.project, user_projects), or None if the
+        query failed. Documents without a project are visible to every user, and so
+        is everything on a database without the project permissions schema, which
+        is logged once.
+        """
+        connection = None
+        try:
+            connection = self.connect()
+            with connection.cursor() as cursor:
+                cursor.execute(_PROJECT_SCHEMA_QUERY)
+                if not all(cursor.fetchone()):
+                    _warn_project_schema_missing()
+                    return []
+                query = """
+                    SELECT d.path_file FROM documents_server d
+                    WHERE d.path_file LIKE %s AND d.deleted = FALSE AND d.project IS NOT NULL
+                      AND NOT EXISTS (
+                          SELECT 1 FROM user_projects p WHERE p.user_id = %s AND p.project = d.project
+                      )
+                """
+                cursor.execute(query, (_like_prefix(folder_path)[1], user_id))
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error retrieving hidden documents for user_id {user_id}: {e}")
+            return None
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def project_schema_installed(self):
+        """
+        Whether the project permissions schema is installed, or None if the database
+        cannot be reached. Logs a warning when it is missing.
+        """
+        connection = None
+        try:
+            connection = self.connect()
+            with connection.cursor() as cursor:
+                cursor.execute(_PROJECT_SCHEMA_QUERY)
+                installed = all(cursor.fetchone())
+            if not installed:
+                _warn_project_schema_missing()
+            return installed
+        except Exception as e:
+            logger.error(f"Error checking the project permissions schema: {e}")
+            return None
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def install_project_schema(self):
+        """
+        Add the project permissions schema (PROJECT_PERMISSIONS_SCHEMA) to the database.
+        """
+        connection = self.connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(PROJECT_PERMISSIONS_SCHEMA)
+            logger.info("Project permissions schema installed")
+        finally:
+            connection.close()
+
+    def assign_project(self, path, project):
+        """
+        Put the document at path, or every document under the folder path, into
+        project; None makes them visible to everyone again. Returns the number of
+        documents changed.
+        """
+        connection = self.connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE documents_server SET project = %s WHERE path_file LIKE %s OR path_file LIKE %s",
+                    (project, *_like_prefix(path)),
+                )
+                count = cursor.rowcount
+            logger.info(f"Assigned {count} documents under '{path}' to project {project!r}")
+            return count
+        finally:
+            connection.close()
+
+    def add_project_member(self, user_id, project):
+        connection = self.connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO user_projects (user_id, project) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                    (user_id, project),
+                )
+            logger.info(f"Added user_id {user_id} to project '{project}'")
+        finally:
+            connection.close()
+
+    def remove_project_member(self, user_id, project):
+        connection = self.connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM user_projects WHERE user_id = %s AND project = %s", (user_id, project))
+            logger.info(f"Removed user_id {user_id} from project '{project}'")
+        finally:
+            connection.close()
+
+    def get_projects(self):
+        """
+        Returns {project: {"documents": count, "members": [user_id, ...]}}.
+        """
+        connection = self.connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT project, COUNT(*) FROM documents_server
+                    WHERE project IS NOT NULL AND deleted = FALSE GROUP BY project
+                """)
+                projects = {project: {"documents": count, "members": []} for project, count in cursor.fetchall()}
+                cursor.execute("SELECT project, user_id FROM user_projects ORDER BY project, user_id")
+                for project, user_id in cursor.fetchall():
+                    projects.setdefault(project, {"documents": 0, "members": []})["members"].append(user_id)
+            return projects
+        finally:
+            connection.close()
+
     def get_download_access(self, path_file):
         """
         Retrieves the download_access status for a given file.
@@ -196,7 +196,13 @@ def initialize_services(func):
                 context.user_data["db_service"] = DatabaseService()
                 logger.debug("Initialized DatabaseService.")
             if "llm_service" not in context.user_data:
-                context.user_data["llm_service"] = LLMService()
+                # LLMService keeps no per-user state, so sessions share the
+                # process-wide instance when the application created one.
+                shared_llm_service = context.bot_data.get("llm_service")
+                if isinstance(shared_llm_service, LLMService):
+                    context.user_data["llm_service"] = shared_llm_service
+                else:
+                    context.user_data["llm_service"] = LLMService()
                 logger.debug("Initialized LLMService.")
             if "user_id" not in context.user_data:
                 context.user_data["user_id"] = update.effective_user.id
@@ -0,0 +1,225 @@
+# dedup.py
+
+import json
+import logging
+import re
+import zlib
+
+import numpy as np
+
+from settings import (
+    DEDUP_BANDS, DEDUP_MIN_SIMILARITY, DEDUP_NUM_PERM, DEDUP_SHINGLE_WORDS, RUNNING_BLOCK_PAGE_RATIO,
+)
+
+logger = logging.getLogger(__name__)
+
+# Pages a block must repeat on before it can count as a running header or footer
+RUNNING_BLOCK_MIN_PAGES = 3
+# Blocks at either end of a page that can be running headers or footers
+RUNNING_BLOCK_EDGE = 2
+# Signatures of an index version's chunks, loaded by the next update
+NEAR_DUPLICATES_FILENAME = "near_duplicates.npz"
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_WORD_RE = re.compile(r"\w+")
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+class MinHasher:
+    """
+    MinHash signatures of texts over their word shingles. Two signatures agree in
+    about the Jaccard similarity of the shingle sets of their texts.
+    """
+
+    def __init__(self, num_perm=DEDUP_NUM_PERM, shingle_words=DEDUP_SHINGLE_WORDS, seed=1):
+        rng = np.random.default_rng(seed)
+        # Below 2**31 so a * hash + b stays within uint64 for 32-bit shingle hashes
+        self._a = rng.integers(1, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+        self.num_perm = num_perm
+        self.shingle_words = shingle_words
+        self.seed = seed
+
+    @property
+    def params(self):
+        return [self.num_perm, self.shingle_words, self.seed]
+
+    def signature(self, text):
+        words = _WORD_RE.findall(text.lower())
+        n = self.shingle_words
+        shingles = {" ".join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles)
+        )
+        return ((self._a * hashes + self._b) % _MERSENNE_PRIME).min(axis=1)
+
+
+def _numbers(text):
+    return sorted(_NUMBER_RE.findall(text))
+
+
+class NearDuplicateIndex:
+    """
+    Incremental LSH index of the texts that are kept, for collapsing near-duplicates
+    as they stream in. Holds a signature and the cited numbers per text, not the text.
+    """
+
+    def __init__(self, min_similarity=DEDUP_MIN_SIMILARITY, bands=DEDUP_BANDS, hasher=None):
+        self.hasher = hasher or MinHasher()
+        self.min_similarity = min_similarity
+        self.bands = bands
+        self._rows = self.hasher.num_perm // bands
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = {}
+        self._numbers = {}
+        self._order = {}
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def _keys(self, signature):
+        rows = self._rows
+        return [signature[band * rows:(band + 1) * rows].tobytes() for band in range(self.bands)]
+
+    def add(self, key, text, signature=None, band_keys=None):
+        """
+        Index text under key as an original, without looking for a match.
+        """
+        signature = self.hasher.signature(text) if signature is None else signature
+        self._insert(key, signature, _numbers(text), band_keys)
+
+    def _insert(self, key, signature, numbers, band_keys=None):
+        self._order[key] = len(self._order)
+        self._signatures[key] = signature
+        self._numbers[key] = numbers
+        for band, band_key in enumerate(band_keys or self._keys(signature)):
+            self._buckets[band].setdefault(band_key, []).append(key)
+
+    def save_signatures(self, path, chunk_ids):
+        """
+        Write the signatures and cited numbers of the indexed keys (chunk id, owner)
+        whose chunk id is in chunk_ids to path, as .npz.
+        """
+        chunk_ids = set(chunk_ids)
+        keys = [key for key in self._order if key[0] in chunk_ids]
+        signatures = np.array([self._signatures[key] for key in keys], dtype=np.uint64)
+        np.savez(
+            path,
+            hasher=np.array(self.hasher.params, dtype=np.int64),
+            chunk_ids=np.array([key[0] for key in keys], dtype=str),
+            signatures=signatures.reshape(len(keys), self.hasher.num_perm),
+            numbers=np.array([json.dumps(self._numbers[key]) for key in keys], dtype=str),
+        )
+
+    def load_signatures(self, path, owners, chunk_ids):
+        """
+        Index the signatures saved at path (see save_signatures) of the chunks in
+        chunk_ids, keyed by (chunk id, owners[chunk id]). Returns the chunk ids
+        loaded; none when the file is missing, unreadable or from another hasher.
+        """
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if data["hasher"].tolist() != self.hasher.params:
+                    logger.info(f"Near-duplicate signatures in {path} are from another hasher; not loading them")
+                    return set()
+                saved_ids, signatures, numbers = data["chunk_ids"], data["signatures"], data["numbers"]
+        except FileNotFoundError:
+            return set()
+        except Exception as e:
+            logger.error(f"Failed to read near-duplicate signatures '{path}': {e}")
+            return set()
+        chunk_ids = set(chunk_ids)
+        loaded = set()
+        for chunk_id, signature, chunk_numbers in zip(saved_ids.tolist(), signatures, numbers.tolist()):
+            if chunk_id in chunk_ids and chunk_id not in loaded:
+                self._insert((chunk_id, owners.get(chunk_id)), signature, json.loads(chunk_numbers))
+                loaded.add(chunk_id)
+        return loaded
+
+    def match(self, key, text):
+        """
+        The key of an indexed near-duplicate of text, or None, in which case text is
+        indexed under key. Candidates come from LSH buckets of signature bands and
+        must reach min_similarity and cite exactly the same numbers, so editions
+        that differ in a value are kept apart. The earliest indexed candidate wins.
+        """
+        signature = self.hasher.signature(text)
+        band_keys = self._keys(signature)
+        candidates = {
+            candidate for band, band_key in enumerate(band_keys) for candidate in self._buckets[band].get(band_key, ())
+        }
+        if candidates:
+            numbers = _numbers(text)
+            for candidate in sorted(candidates, key=self._order.get):
+                similarity = float(np.mean(self._signatures[candidate] == signature))
+                if similarity >= self.min_similarity and self._numbers[candidate] == numbers:
+                    return candidate
+        self.add(key, text, signature, band_keys)
+        return None
+
+
+def add_reference(document, source, page):
+    """
+    Record that a collapsed copy of document's text is at (source, page).
+    """
+    references = document.metadata.setdefault("duplicates", [])
+    if [source, page] not in references and (source, page) != (document.metadata.get("source"), document.metadata.get("page")):
+        references.append([source, page])
+
+
+def chunk_references(document):
+    """
+    Every (source, page) a chunk's text was found at: its own and its collapsed copies'.
+    """
+    metadata = document.metadata
+    return [(metadata.get("source"), metadata.get("page"))] + [tuple(ref) for ref in metadata.get("duplicates", [])]
+
+
+def drop_references(document, sources):
+    """
+    Remove the references to sources from a chunk. If its own source is among them,
+    the first remaining copy takes its place. Returns False when no reference is left.
+    """
+    remaining = [ref for ref in chunk_references(document) if ref[0] not in sources]
+    if not remaining:
+        return False
+    (source, page), duplicates = remaining[0], remaining[1:]
+    document.metadata["source"], document.metadata["page"] = source, page
+    if duplicates:
+        document.metadata["duplicates"] = [list(ref) for ref in duplicates]
+    else:
+        document.metadata.pop("duplicates", None)
+    return True
+
+
+def strip_running_blocks(pages):
+    """
+    Drop the blocks at the top or bottom of a PDF's pages that repeat there on
+    RUNNING_BLOCK_PAGE_RATIO of its pages: running headers, footers, approval stamps
+    and page numbers (blocks without letters match whatever their digits). Pages
+    without blocks are returned unchanged.
+    """
+    with_blocks = [page for page in pages if page.blocks]
+    min_pages = max(RUNNING_BLOCK_MIN_PAGES, RUNNING_BLOCK_PAGE_RATIO * len(with_blocks))
+    if len(with_blocks) < min_pages:
+        return pages
+
+    def key(text):
+        text = " ".join(text.lower().split())
+        return text if re.search(r"[^\W\d_]", text) else re.sub(r"\d+", "#", text)
+
+    def edges(blocks):
+        return blocks[:RUNNING_BLOCK_EDGE] + blocks[RUNNING_BLOCK_EDGE:][-RUNNING_BLOCK_EDGE:]
+
+    counts = {}
+    for page in with_blocks:
+        for block_key in {key(text) for text, _ in edges(page.blocks)}:
+            counts[block_key] = counts.get(block_key, 0) + 1
+    running = {block_key for block_key, count in counts.items() if count >= min_pages}
+    if not running:
+        return pages
+    for page in with_blocks:
+        edge_blocks = {id(block) for block in edges(page.blocks)}
+        page.blocks = [block for block in page.blocks if id(block) not in edge_blocks or key(block[0]) not in running]
+    logger.debug(f"Left {len(running)} running headers or footers of '{pages[0].source}' out of its chunks")
+    return pages
@@ -0,0 +1,304 @@
+# docstore.py
+
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import weakref
+from collections.abc import Mapping
+from pathlib import Path
+
+from langchain.schema import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+
+logger = logging.getLogger(__name__)
+
+DOCSTORE_FILENAME = "docstore.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE sources (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE chunks (
+    position INTEGER PRIMARY KEY,
+    doc_id TEXT NOT NULL UNIQUE,
+    source_id INTEGER,
+    page INTEGER,
+    text TEXT NOT NULL,
+    extra TEXT
+);
+"""
+
+
+# Rows written or read per statement; well below SQLite's oldest default limit of
+# 999 variables, so a batch of ids can be bound in one IN (...) list
+_BATCH_ROWS = 500
+
+
+def _batches(values, size=_BATCH_ROWS):
+    values = iter(values)
+    while batch := list(itertools.islice(values, size)):
+        yield batch
+
+
+def _documents_by_position(docstore, index_to_docstore_id):
+    """
+    (position, doc_id, document) of a vector store in position order, read from
+    a BuildDocstore a batch at a time.
+    """
+    for batch in _batches(sorted(index_to_docstore_id)):
+        doc_ids = [index_to_docstore_id[position] for position in batch]
+        if isinstance(docstore, BuildDocstore):
+            documents = docstore.documents(doc_ids)
+        else:
+            documents = [docstore.search(doc_id) for doc_id in doc_ids]
+        yield from zip(batch, doc_ids, documents)
+
+
+def write_docstore(path, docstore, index_to_docstore_id):
+    """
+    Write the chunks of a vector store to a new SQLite docstore at path, one row per
+    index position, streaming them in batches inside one transaction. Source
+    filenames are interned and integer pages stored as such; any other metadata is
+    kept as JSON.
+    """
+    path = Path(path)
+    conn = sqlite3.connect(str(path))
+    source_ids = {}
+
+    def rows():
+        for position, doc_id, doc in _documents_by_position(docstore, index_to_docstore_id):
+            if not isinstance(doc, Document):
+                raise ValueError(f"Docstore has no document for id '{doc_id}'")
+            extra = dict(doc.metadata)
+            source = extra.pop("source", None)
+            page = extra.get("page")
+            if isinstance(page, int) and not isinstance(page, bool):
+                extra.pop("page")
+            else:
+                page = None
+            source_id = None
+            if source is not None:
+                source_id = source_ids.setdefault(source, len(source_ids) + 1)
+            yield position, doc_id, source_id, page, doc.page_content, json.dumps(extra, ensure_ascii=False) if extra else None
+
+    count = 0
+    try:
+        conn.executescript(_SCHEMA)
+        for batch in _batches(rows()):
+            conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?)", batch)
+            count += len(batch)
+        conn.executemany("INSERT INTO sources (id, name) VALUES (?, ?)", [(i, name) for name, i in source_ids.items()])
+        conn.commit()
+    finally:
+        conn.close()
+    logger.debug(f"Wrote {count} chunks from {len(source_ids)} sources to {path}")
+
+
+def _row_to_document(doc_id, source, page, text, extra):
+    metadata = {}
+    if source is not None:
+        metadata["source"] = source
+    if page is not None:
+        metadata["page"] = page
+    if extra:
+        metadata.update(json.loads(extra))
+    return Document(id=doc_id, page_content=text, metadata=metadata)
+
+
+_DOCUMENT_COLUMNS = "c.doc_id, s.name, c.page, c.text, c.extra"
+_DOCUMENT_FROM = "FROM chunks c LEFT JOIN sources s ON s.id = c.source_id"
+
+
+class SqliteDocstore(Docstore, AddableMixin):
+    """
+    Read-only docstore over a published docstore.sqlite3. Nothing is loaded up
+    front; documents are read on demand for the hits of each query. Index
+    versions never change once published, so the file is opened immutable.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        uri = f"{self.path.resolve().as_uri()}?mode=ro&immutable=1"
+        self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def search(self, search):
+        rows = self._query(f"SELECT {_DOCUMENT_COLUMNS} {_DOCUMENT_FROM} WHERE c.doc_id = ?", (search,))
+        if not rows:
+            return f"ID {search} not found."
+        return _row_to_document(*rows[0])
+
+    def documents_at(self, positions):
+        """
+        Return the documents at the given index positions, in order, with one query
+        per _BATCH_ROWS positions.
+        """
+        positions = [int(position) for position in positions]
+        by_position = {}
+        for batch in _batches(set(positions)):
+            placeholders = ",".join("?" * len(batch))
+            rows = self._query(f"SELECT c.position, {_DOCUMENT_COLUMNS} {_DOCUMENT_FROM} WHERE c.position IN ({placeholders})", batch)
+            by_position.update((row[0], _row_to_document(*row[1:])) for row in rows)
+        return [by_position[position] for position in positions]
+
+    def source_names(self):
+        return [row[0] for row in self._query("SELECT name FROM sources ORDER BY name")]
+
+    def positions_of_sources(self, sources):
+        """
+        Return the index positions of every chunk of the given source files.
+        """
+        positions = []
+        for batch in _batches(set(sources)):
+            placeholders = ",".join("?" * len(batch))
+            rows = self._query(f"SELECT c.position {_DOCUMENT_FROM} WHERE s.name IN ({placeholders})", batch)
+            positions.extend(row[0] for row in rows)
+        return sorted(positions)
+
+    def add(self, texts):
+        raise ValueError("Published docstore is read-only")
+
+    def delete(self, ids):
+        raise ValueError("Published docstore is read-only")
+
+    def position_map(self):
+        return PositionMap(self)
+
+    def to_build(self):
+        """
+        Copy the docstore into (BuildDocstore, index_to_docstore_id) for an index
+        build that modifies it, streaming the rows rather than loading them at once.
+        """
+        docstore = BuildDocstore()
+        index_to_docstore_id = {}
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT c.position, {_DOCUMENT_COLUMNS} {_DOCUMENT_FROM}")
+            while rows := cursor.fetchmany(_COPY_ROWS):
+                docstore.add({row[1]: _row_to_document(*row[1:]) for row in rows})
+                index_to_docstore_id.update((row[0], row[1]) for row in rows)
+        return docstore, index_to_docstore_id
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Rows copied per batch into a BuildDocstore
+_COPY_ROWS = 1000
+
+
+def _close_and_remove(conn, path):
+    conn.close()
+    for suffix in ("", "-journal"):
+        try:
+            os.remove(f"{path}{suffix}")
+        except FileNotFoundError:
+            pass
+
+
+class BuildDocstore(Docstore, AddableMixin):
+    """
+    Writable docstore of an index build, kept in a scratch SQLite file rather than
+    in memory, so the chunks of a large knowledge base are written out as they are
+    embedded. The file is removed on close, or when the docstore is collected.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="docstore-build-", suffix=".sqlite3")
+            os.close(fd)
+        self.path = Path(path)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA synchronous = OFF")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS documents (doc_id TEXT PRIMARY KEY, text TEXT NOT NULL, metadata TEXT)")
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, _close_and_remove, self._conn, str(self.path))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def __contains__(self, doc_id):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM documents WHERE doc_id = ?", (doc_id,)).fetchone() is not None
+
+    def add(self, texts):
+        rows = [(doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)) for doc_id, doc in texts.items()]
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.executemany("INSERT INTO documents VALUES (?, ?, ?)", rows)
+            except sqlite3.IntegrityError:
+                raise ValueError("Tried to add ids that already exist")
+
+    def update(self, doc_id, document):
+        """
+        Write back a document whose metadata was changed after it was added.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE documents SET text = ?, metadata = ? WHERE doc_id = ?",
+                (document.page_content, json.dumps(document.metadata, ensure_ascii=False), doc_id),
+            )
+
+    def search(self, search):
+        with self._lock:
+            row = self._conn.execute("SELECT text, metadata FROM documents WHERE doc_id = ?", (search,)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+    def documents(self, doc_ids):
+        """
+        The documents of doc_ids, in order; ids without a document give the same
+        "not found" string as search.
+        """
+        found = {}
+        for batch in _batches(doc_ids):
+            placeholders = ",".join("?" * len(batch))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT doc_id, text, metadata FROM documents WHERE doc_id IN ({placeholders})", batch
+                ).fetchall()
+            for doc_id, text, metadata in rows:
+                found[doc_id] = Document(id=doc_id, page_content=text, metadata=json.loads(metadata))
+        return [found.get(doc_id, f"ID {doc_id} not found.") for doc_id in doc_ids]
+
+    def delete(self, ids):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM documents WHERE doc_id = ?", [(doc_id,) for doc_id in ids])
+
+    def close(self):
+        with self._lock:
+            self._finalizer()
+
+
+class PositionMap(Mapping):
+    """
+    index_to_docstore_id view backed by the docstore table, so loading a
+    published store does not build a dict with an entry per chunk.
+    """
+
+    def __init__(self, docstore):
+        self._docstore = docstore
+
+    def __getitem__(self, position):
+        rows = self._docstore._query("SELECT doc_id FROM chunks WHERE position = ?", (int(position),))
+        if not rows:
+            raise KeyError(position)
+        return rows[0][0]
+
+    def __iter__(self):
+        return iter([row[0] for row in self._docstore._query("SELECT position FROM chunks ORDER BY position")])
+
+    def __len__(self):
+        return self._docstore._query("SELECT COUNT(*) FROM chunks")[0][0]
+
+    def values(self):
+        return [row[0] for row in self._docstore._query("SELECT doc_id FROM chunks ORDER BY position")]
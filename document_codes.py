@@ -0,0 +1,166 @@
+# document_codes.py
+
+import logging
+import re
+import sqlite3
+from pathlib import Path
+
+from settings import CODE_MATCH_MIN_SIMILARITY, CODE_ROUTE_MAX_DOCUMENTS, CODE_TITLE_PAGES
+
+logger = logging.getLogger(__name__)
+
+CODE_INDEX_FILENAME = "codes.sqlite3"
+
+# Where an identifier of a document was found; filenames name the document itself,
+# title pages may also cite the standards it replaces
+ORIGIN_FILENAME = 0
+ORIGIN_TITLE_PAGE = 1
+
+# ГОСТ Р 21.1101-2013, GOST_27751-2014, СНиП 2.01.07-85, СП 20.13330.2016, SNI 1726:2019, ISO/IEC 27001
+_CODE_RE = re.compile(
+    r"(?<![^\W_])(?P<family>(?:ГОСТ|GOST)(?:[\s_]*(?:Р|R)(?![^\W\d_]))?|СНиП|SNiP|СП|SP|SNI|ISO(?:/IEC)?)"
+    r"[\s_№#-]*(?P<number>\d+(?:[.\-:/_]\d+)*)(?!\d)",
+    re.IGNORECASE,
+)
+_FAMILIES = {"ГОСТ": "GOST", "ГОСТР": "GOST R", "GOSTR": "GOST R", "СНИП": "SNIP", "СП": "SP", "ISO/IEC": "ISO"}
+
+
+def _key(family, groups):
+    return f"{family} {'.'.join(groups)}"
+
+
+def extract_codes(text):
+    """
+    Find standard identifiers in text. Returns [(key, start, end)] with keys
+    normalized to Latin family names and dot-separated number groups, so
+    "ГОСТ Р 21.1101-2013" and "GOST_R_21.1101.2013" both become "GOST R 21.1101.2013".
+    """
+    codes = []
+    for match in _CODE_RE.finditer(text):
+        family = re.sub(r"[\s_]", "", match.group("family").upper())
+        family = _FAMILIES.get(family, family)
+        groups = re.split(r"[.\-:/_]", match.group("number"))
+        codes.append((_key(family, groups), match.start(), match.end()))
+    return codes
+
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def build_code_index(path, docstore_path):
+    """
+    Build the identifier table of a saved docstore at path: the codes in each
+    source filename and on its first CODE_TITLE_PAGES pages.
+    """
+    docstore = sqlite3.connect(str(docstore_path))
+    try:
+        sources = docstore.execute("SELECT name FROM sources").fetchall()
+        title_chunks = docstore.execute(
+            "SELECT s.name, c.text FROM chunks c JOIN sources s ON s.id = c.source_id WHERE c.page < ?",
+            (CODE_TITLE_PAGES,),
+        ).fetchall()
+    finally:
+        docstore.close()
+
+    rows = {}
+    for (name,) in sources:
+        for key, _, _ in extract_codes(Path(name).stem):
+            rows[(key, name)] = ORIGIN_FILENAME
+    for name, text in title_chunks:
+        for key, _, _ in extract_codes(text):
+            rows.setdefault((key, name), ORIGIN_TITLE_PAGE)
+
+    conn = sqlite3.connect(str(path))
+    try:
+        conn.execute("CREATE TABLE codes (code TEXT NOT NULL, source TEXT NOT NULL, origin INTEGER NOT NULL)")
+        conn.executemany("INSERT INTO codes VALUES (?, ?, ?)", [(key, name, origin) for (key, name), origin in rows.items()])
+        conn.commit()
+    finally:
+        conn.close()
+    logger.debug(f"Indexed {len(rows)} document identifiers in {path}")
+
+
+class CodeIndex:
+    """
+    In-memory lookup of standard identifiers to the documents they name, read from
+    a published codes.sqlite3. Query codes missing from the table are matched by
+    trigram similarity, so a mistyped number still finds its document.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        uri = f"{self.path.resolve().as_uri()}?mode=ro&immutable=1"
+        conn = sqlite3.connect(uri, uri=True)
+        try:
+            rows = conn.execute("SELECT code, source, origin FROM codes").fetchall()
+        finally:
+            conn.close()
+        self._documents = {}
+        for key, source, origin in rows:
+            self._documents.setdefault(key, {})[source] = origin
+        self._by_trigram = {}
+        for key in self._documents:
+            for trigram in _trigrams(key):
+                self._by_trigram.setdefault(trigram, set()).add(key)
+
+    def __len__(self):
+        return len(self._documents)
+
+    def _similarity(self, key, candidate):
+        """
+        1.0 when one code is a prefix of the other ("SP 20.13330" names every edition
+        of "SP 20.13330.2016"), else the trigram Jaccard similarity against the
+        candidate cut to as many number groups as the query has.
+        """
+        family, _, number = key.partition(" ")
+        candidate_family, _, candidate_number = candidate.partition(" ")
+        if family != candidate_family:
+            return 0.0
+        groups, candidate_groups = number.split("."), candidate_number.split(".")
+        shared = min(len(groups), len(candidate_groups))
+        if groups[:shared] == candidate_groups[:shared]:
+            return 1.0
+        query_trigrams = _trigrams(key)
+        candidate_trigrams = _trigrams(_key(family, candidate_groups[:len(groups)]))
+        return len(query_trigrams & candidate_trigrams) / len(query_trigrams | candidate_trigrams)
+
+    def lookup(self, key):
+        """
+        Return the sources named by one normalized code, best matches only: the
+        closest codes at or above CODE_MATCH_MIN_SIMILARITY, preferring documents
+        whose filename carries the code. Ambiguous codes naming more than
+        CODE_ROUTE_MAX_DOCUMENTS documents return [].
+        """
+        candidates = set()
+        for trigram in _trigrams(key):
+            candidates |= self._by_trigram.get(trigram, set())
+        scored = [(self._similarity(key, candidate), candidate) for candidate in candidates]
+        scored = [(similarity, candidate) for similarity, candidate in scored if similarity >= CODE_MATCH_MIN_SIMILARITY]
+        if not scored:
+            return []
+        best = max(similarity for similarity, _ in scored)
+        origins = {}
+        for similarity, candidate in scored:
+            if similarity == best:
+                for source, origin in self._documents[candidate].items():
+                    origins[source] = min(origin, origins.get(source, origin))
+        top_origin = min(origins.values())
+        sources = sorted(source for source, origin in origins.items() if origin == top_origin)
+        return sources if len(sources) <= CODE_ROUTE_MAX_DOCUMENTS else []
+
+    def route(self, query_text):
+        """
+        Resolve the standard codes cited in query_text to documents. Returns
+        (sources, remainder): the sources to search, or [] when no cited code is
+        known, and the query with the resolved codes cut out.
+        """
+        sources = []
+        remainder = query_text
+        for key, start, end in reversed(extract_codes(query_text)):
+            matched = self.lookup(key)
+            if matched:
+                sources.extend(source for source in matched if source not in sources)
+                remainder = remainder[:start] + " " + remainder[end:]
+        return sources, remainder
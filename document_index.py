@@ -0,0 +1,149 @@
+# document_index.py
+
+import hashlib
+import json
+import logging
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_INDEX_FILENAME = "documents.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE documents (
+    source TEXT PRIMARY KEY,
+    document_type TEXT,
+    language TEXT,
+    description TEXT,
+    vector BLOB NOT NULL
+);
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE bitmaps (kind TEXT NOT NULL, value TEXT NOT NULL, bitmap BLOB NOT NULL, PRIMARY KEY (kind, value));
+"""
+
+# Metadata with a precomputed chunk bitmap per value, for filtered search
+BITMAP_KINDS = ("document_type", "language")
+
+
+def description_text(source, metadata):
+    """
+    Text embedded for one document: its filename, type and description.
+    """
+    return "\n".join(part for part in (source, metadata.get("document_type"), metadata.get("description")) if part)
+
+
+def descriptions_fingerprint(descriptions):
+    """
+    Hash of {source: metadata}, stored with the index to tell when the
+    descriptions in documents_server changed since it was built.
+    """
+    payload = json.dumps(descriptions, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _value_bitmaps(descriptions, docstore_path):
+    """
+    {(kind, lowercased value): packed bitmap of the index positions of its chunks}
+    for the BITMAP_KINDS metadata, read against a saved docstore.
+    """
+    conn = sqlite3.connect(f"{Path(docstore_path).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        count = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        rows = conn.execute("SELECT s.name, c.position FROM chunks c JOIN sources s ON s.id = c.source_id").fetchall()
+    finally:
+        conn.close()
+    masks = {}
+    for source, position in rows:
+        metadata = descriptions.get(source)
+        if metadata is None:
+            continue
+        for kind in BITMAP_KINDS:
+            value = (metadata.get(kind) or "").strip().lower()
+            if value:
+                masks.setdefault((kind, value), np.zeros(count, dtype=bool))[position] = True
+    return {key: np.packbits(mask, bitorder="little") for key, mask in masks.items()}
+
+
+def write_document_index(path, descriptions, vectors, docstore_path=None):
+    """
+    Write the document-level index at path: one row per described source with its
+    metadata and the embedding of its description_text, in the order of vectors.
+    With docstore_path, the chunk bitmap of every document_type and language value
+    is precomputed as well.
+    """
+    conn = sqlite3.connect(str(path))
+    try:
+        conn.executescript(_SCHEMA)
+        conn.executemany(
+            "INSERT INTO documents VALUES (?, ?, ?, ?, ?)",
+            [
+                (source, metadata.get("document_type"), metadata.get("language"), metadata.get("description"),
+                 np.asarray(vector, dtype=np.float32).tobytes())
+                for (source, metadata), vector in zip(descriptions.items(), vectors)
+            ],
+        )
+        conn.execute("INSERT INTO meta VALUES ('fingerprint', ?)", (descriptions_fingerprint(descriptions),))
+        if docstore_path is not None:
+            conn.executemany(
+                "INSERT INTO bitmaps VALUES (?, ?, ?)",
+                [(kind, value, bitmap.tobytes()) for (kind, value), bitmap in _value_bitmaps(descriptions, docstore_path).items()],
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    logger.debug(f"Wrote {len(descriptions)} document descriptions to {path}")
+
+
+def read_fingerprint(path):
+    """
+    Fingerprint of the descriptions a document index was built from, or None.
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+    conn = sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
+class DocumentIndex:
+    """
+    In-memory index of the document descriptions of a published store, used to
+    pick the documents worth searching before any chunk is scored, and the
+    precomputed chunk bitmaps of their metadata values for filtered search.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        uri = f"{self.path.resolve().as_uri()}?mode=ro&immutable=1"
+        conn = sqlite3.connect(uri, uri=True)
+        try:
+            rows = conn.execute("SELECT source, document_type, language, vector FROM documents ORDER BY source").fetchall()
+            bitmaps = conn.execute("SELECT kind, value, bitmap FROM bitmaps").fetchall()
+        finally:
+            conn.close()
+        self.sources = [row[0] for row in rows]
+        self.metadata = {row[0]: {"document_type": row[1], "language": row[2]} for row in rows}
+        self.value_bitmaps = {(kind, value): np.frombuffer(bitmap, dtype=np.uint8) for kind, value, bitmap in bitmaps}
+        vectors = np.array([np.frombuffer(row[3], dtype=np.float32) for row in rows], dtype=np.float32, ndmin=2)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self._vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms != 0)
+
+    def __len__(self):
+        return len(self.sources)
+
+    def top_sources(self, query_embedding, n):
+        """
+        The n sources whose descriptions are most similar to the query, best first.
+        """
+        if not self.sources:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        scores = self._vectors @ (query / (np.linalg.norm(query) or 1.0))
+        return [self.sources[i] for i in np.argsort(-scores, kind="stable")[:n]]
@@ -0,0 +1,392 @@
+# embedding_service.py
+
+import hashlib
+import logging
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import openai
+from langchain_core.embeddings import Embeddings
+
+from settings import (
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MAX_CONCURRENCY,
+    EMBEDDING_TARGET_CHUNKS_PER_SECOND,
+    EMBEDDING_MAX_RETRIES,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MAX_MB,
+    QUERY_EMBEDDING_CACHE_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Errors worth retrying: rate limits, timeouts, dropped connections and 5xx responses
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+def embedding_model_name(embeddings):
+    return getattr(embeddings, "model", type(embeddings).__name__)
+
+
+class EmbeddingCache:
+    """
+    Persistent content-addressed store of embedding vectors in SQLite, keyed by
+    the embedding model, the kind of text ("document" or "query") and a hash of
+    the text. Shared by index builds and query embedding; the least recently
+    used vectors are evicted once the file grows past max_bytes.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_bytes=EMBEDDING_CACHE_MAX_MB * 1024 * 1024):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(model, kind, text):
+        return hashlib.sha256(f"{model}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model, texts, kind="document"):
+        """
+        Return a list aligned with texts holding a float32 vector for each hit and None for each miss.
+        """
+        keys = [self.make_key(model, kind, text) for text in texts]
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._conn.commit()
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return [np.frombuffer(found[key], dtype=np.float32) if key in found else None for key in keys]
+
+    def put_many(self, model, texts, vectors, kind="document"):
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((self.make_key(model, kind, text), blob, len(blob), now))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, last_access) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+            self._total_bytes += sum(row[2] for row in rows)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Evict down to 90% of the budget so eviction does not run on every insert
+        target = int(self.max_bytes * 0.9)
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        evicted = 0
+        while self._total_bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM embeddings ORDER BY last_access LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._total_bytes <= target:
+                    break
+                self._conn.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+                self._total_bytes -= size
+                evicted += 1
+        self._conn.commit()
+        logger.info(f"Evicted {evicted} embeddings from cache {self.path}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "size_bytes": self._total_bytes,
+            }
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """
+    Return the process-wide EmbeddingCache, opening it on first use.
+    """
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache()
+        return _embedding_cache
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves repeated texts from an EmbeddingCache and
+    only sends the misses to the underlying embeddings client.
+    """
+
+    def __init__(self, underlying, cache):
+        self.underlying = underlying
+        self.cache = cache
+        self.model = embedding_model_name(underlying)
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        vectors = self.cache.get_many(self.model, texts, kind="document")
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            embedded = self.underlying.embed_documents(missing_texts)
+            self.cache.put_many(self.model, missing_texts, embedded, kind="document")
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+        return [np.asarray(vector, dtype=np.float32).tolist() for vector in vectors]
+
+    def embed_query(self, text):
+        vector = self.cache.get_many(self.model, [text], kind="query")[0]
+        if vector is None:
+            vector = self.underlying.embed_query(text)
+            self.cache.put_many(self.model, [text], [vector], kind="query")
+        return np.asarray(vector, dtype=np.float32).tolist()
+
+
+class QueryEmbeddingLRU:
+    """
+    Bounded in-memory LRU of recent query embeddings, shared by all users of the
+    process. Sits in front of the persistent cache so repeated questions and
+    suggestion clicks are answered without a network or disk round trip.
+    """
+
+    def __init__(self, max_entries=QUERY_EMBEDDING_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_embed(self, embeddings, text):
+        """
+        Return the query embedding of text as a read-only float32 array,
+        calling embeddings.embed_query only on a miss.
+        """
+        key = (embedding_model_name(embeddings), text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            self.misses += 1
+
+        vector = np.asarray(embeddings.embed_query(text), dtype=np.float32)
+        vector.setflags(write=False)
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return vector
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+query_embedding_lru = QueryEmbeddingLRU()
+
+
+class RateLimiter:
+    """
+    Thread-safe pacing of embedding requests to a target number of chunks per
+    second. A rate-limit response pauses every caller, not only the one that hit it.
+    """
+
+    def __init__(self, chunks_per_second):
+        self.interval = 1.0 / chunks_per_second if chunks_per_second else 0.0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, chunks):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_slot)
+            self._next_slot = start + chunks * self.interval
+        delay = start - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+
+class BatchEmbedder:
+    """
+    Embed large numbers of chunks in batches with several requests in flight,
+    paced to a chunks-per-second target and retried with exponential backoff
+    on rate limits and transient errors.
+
+    With a checkpoint directory, every finished batch is written to disk under
+    a key derived from the embedding model and the batch texts, so an
+    interrupted build resumes from the batches it already paid for.
+
+    When given CachedEmbeddings, texts already in the embedding cache are
+    taken from it and only the misses are batched and sent to the API.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        batch_size=EMBEDDING_BATCH_SIZE,
+        max_concurrency=EMBEDDING_MAX_CONCURRENCY,
+        target_chunks_per_second=EMBEDDING_TARGET_CHUNKS_PER_SECOND,
+        max_retries=EMBEDDING_MAX_RETRIES,
+    ):
+        self.cache = getattr(embeddings, "cache", None)
+        self.embeddings = getattr(embeddings, "underlying", embeddings)
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.rate_limiter = RateLimiter(target_chunks_per_second)
+
+    def _batch_key(self, texts):
+        digest = hashlib.sha256(embedding_model_name(self.embeddings).encode("utf-8"))
+        for text in texts:
+            digest.update(b"\0")
+            digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _embed_with_retry(self, texts):
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(len(texts))
+            try:
+                return self.embeddings.embed_documents(texts)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(60.0, 2 ** attempt) + random.uniform(0, 1)
+                response = getattr(e, "response", None)
+                retry_after = response.headers.get("retry-after") if response is not None else None
+                if retry_after:
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except ValueError:
+                        pass
+                if isinstance(e, openai.RateLimitError):
+                    self.rate_limiter.pause(delay)
+                logger.warning(
+                    f"Embedding batch of {len(texts)} failed ({type(e).__name__}), "
+                    f"retry {attempt + 1}/{self.max_retries} in {delay:.1f}s"
+                )
+                time.sleep(delay)
+
+    def _embed_batch(self, texts, checkpoint_dir):
+        checkpoint_path = None
+        if checkpoint_dir is not None:
+            checkpoint_path = Path(checkpoint_dir) / f"{self._batch_key(texts)}.npy"
+            if checkpoint_path.exists():
+                try:
+                    return np.load(checkpoint_path), True
+                except Exception as e:
+                    logger.warning(f"Ignoring unreadable embedding checkpoint {checkpoint_path}: {e}")
+
+        vectors = np.asarray(self._embed_with_retry(texts), dtype=np.float32)
+        if checkpoint_path is not None:
+            tmp_path = checkpoint_path.with_suffix(".tmp.npy")
+            np.save(tmp_path, vectors)
+            tmp_path.replace(checkpoint_path)
+        return vectors, False
+
+    def embed_texts(self, texts, checkpoint_dir=None):
+        """
+        Embed texts and return a float32 array of shape (len(texts), dim), in input order.
+        """
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        if self.cache is None:
+            return self._embed_uncached(texts, checkpoint_dir)
+
+        model = embedding_model_name(self.embeddings)
+        cached = self.cache.get_many(model, texts)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        logger.info(f"Embedding cache: {len(texts) - len(missing)} of {len(texts)} chunks already embedded")
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            embedded = self._embed_uncached(missing_texts, checkpoint_dir)
+            self.cache.put_many(model, missing_texts, embedded)
+            for i, vector in zip(missing, embedded):
+                cached[i] = vector
+        return np.vstack(cached).astype(np.float32, copy=False)
+
+    def _embed_uncached(self, texts, checkpoint_dir):
+        if checkpoint_dir is not None:
+            Path(checkpoint_dir).mkdir(parents=True, exist_ok=True)
+
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = [None] * len(batches)
+        resumed = 0
+        started = time.monotonic()
+        logger.info(f"Embedding {len(texts)} chunks in {len(batches)} batches ({self.max_concurrency} in flight)")
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = {
+                executor.submit(self._embed_batch, batch, checkpoint_dir): i
+                for i, batch in enumerate(batches)
+            }
+            done = 0
+            embedded = 0
+            for future, index in futures.items():
+                try:
+                    results[index], from_checkpoint = future.result()
+                except Exception:
+                    # Finished batches are already checkpointed; stop queuing the rest
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    raise
+                resumed += from_checkpoint
+                done += 1
+                embedded += len(batches[index])
+                if done % 10 == 0 or done == len(batches):
+                    elapsed = max(time.monotonic() - started, 1e-6)
+                    logger.info(
+                        f"Embedded {done}/{len(batches)} batches "
+                        f"({embedded / elapsed:.1f} chunks/s, {resumed} resumed from checkpoints)"
+                    )
+
+        return np.vstack(results)
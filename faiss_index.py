@@ -0,0 +1,633 @@
+# faiss_index.py
+
+import logging
+import os
+import pickle
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+
+from docstore import DOCSTORE_FILENAME, BuildDocstore, SqliteDocstore, write_docstore
+from document_codes import CODE_INDEX_FILENAME, CodeIndex, build_code_index
+from document_index import DOCUMENT_INDEX_FILENAME, DocumentIndex
+from lexical_index import LEXICAL_INDEX_FILENAME, LexicalIndex, build_lexical_index
+from settings import VECTOR_STORE_METRIC, VECTOR_STORE_MMAP, DEFAULT_INDEX_SETTINGS, knowledge_base_index, \
+    knowledge_base_paths
+
+logger = logging.getLogger(__name__)
+
+METRIC_L2 = "l2"
+METRIC_COSINE = "cosine"
+
+INDEX_FLAT = "flat"
+INDEX_IVF = "ivf"
+INDEX_HNSW = "hnsw"
+
+ENCODING_FLOAT32 = "float32"
+ENCODING_SQ8 = "sq8"
+ENCODING_FP16 = "fp16"
+ENCODING_PQ = "pq"
+ENCODING_FACTORY = {ENCODING_FLOAT32: "Flat", ENCODING_SQ8: "SQ8", ENCODING_FP16: "SQfp16"}
+
+INDEX_FILENAME = "index.faiss"
+# Docstore pickle written by LangChain's save_local before the SQLite docstore
+LEGACY_DOCSTORE_FILENAME = "index.pkl"
+# Full-precision copy of the vectors of a quantized index, memory-mapped for rescoring
+EXACT_VECTORS_FILENAME = "exact_vectors.npy"
+
+# FAISS warns and clusters poorly with fewer training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+# Product quantization with 8-bit codes needs at least one point per code
+MIN_PQ_TRAINING_POINTS = 256
+
+
+class IndexSpec:
+    """
+    FAISS index type of a knowledge base and its parameters. nprobe, ef_search and
+    rescore_factor are search-time settings; everything else fixes the structure
+    of the index. encoding selects how vectors are stored (float32, sq8, fp16 or
+    pq with pq_m sub-quantizers); with rescore, a full-precision copy is kept on
+    disk and the top rescore_factor * k candidates are re-ranked exactly.
+    """
+
+    def __init__(self, type=INDEX_FLAT, nlist=1024, nprobe=16, m=32, ef_search=64, ef_construction=80,
+                 encoding=ENCODING_FLOAT32, pq_m=96, rescore=False, rescore_factor=4):
+        if type not in (INDEX_FLAT, INDEX_IVF, INDEX_HNSW):
+            raise ValueError(f"Unknown index type '{type}'")
+        if encoding not in (ENCODING_FLOAT32, ENCODING_SQ8, ENCODING_FP16, ENCODING_PQ):
+            raise ValueError(f"Unknown vector encoding '{encoding}'")
+        self.type = type
+        self.nlist = int(nlist)
+        self.nprobe = int(nprobe)
+        self.m = int(m)
+        self.ef_search = int(ef_search)
+        self.ef_construction = int(ef_construction)
+        self.encoding = encoding
+        self.pq_m = int(pq_m)
+        self.rescore = bool(rescore)
+        self.rescore_factor = max(1, int(rescore_factor))
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data or {})
+        data.pop("trained_on", None)
+        return cls(**data)
+
+    def to_dict(self):
+        data = {"type": self.type}
+        if self.type == INDEX_IVF:
+            data.update(nlist=self.nlist, nprobe=self.nprobe)
+        elif self.type == INDEX_HNSW:
+            data.update(m=self.m, ef_search=self.ef_search, ef_construction=self.ef_construction)
+        if self.encoding != ENCODING_FLOAT32:
+            data["encoding"] = self.encoding
+            if self.encoding == ENCODING_PQ:
+                data["pq_m"] = self.pq_m
+        if self.keeps_exact_vectors:
+            data.update(rescore=True, rescore_factor=self.rescore_factor)
+        return data
+
+    @property
+    def structure(self):
+        """
+        The build-time part of the spec; two specs with the same structure share an index.
+        """
+        if self.type == INDEX_IVF:
+            structure = (self.type, self.nlist)
+        elif self.type == INDEX_HNSW:
+            structure = (self.type, self.m, self.ef_construction)
+        else:
+            structure = (self.type,)
+        encoding = (self.encoding, self.pq_m) if self.encoding == ENCODING_PQ else (self.encoding,)
+        return structure + encoding + (self.keeps_exact_vectors,)
+
+    @property
+    def needs_training(self):
+        return self.type == INDEX_IVF or self.encoding in (ENCODING_SQ8, ENCODING_PQ)
+
+    @property
+    def keeps_exact_vectors(self):
+        # float32 indexes reconstruct exact vectors themselves
+        return self.rescore and self.encoding != ENCODING_FLOAT32
+
+    def __repr__(self):
+        params = ", ".join(f"{key}={value}" for key, value in self.to_dict().items() if key != "type")
+        return f"{self.type}({params})"
+
+
+def index_spec_for(folder_path):
+    """
+    Return the IndexSpec configured for the knowledge base stored at folder_path.
+    """
+    target = os.path.normcase(os.path.abspath(folder_path))
+    for name, path in knowledge_base_paths.items():
+        if os.path.normcase(os.path.abspath(path)) == target:
+            return IndexSpec.from_dict(knowledge_base_index.get(name, DEFAULT_INDEX_SETTINGS))
+    return IndexSpec.from_dict(DEFAULT_INDEX_SETTINGS)
+
+
+def index_metric(index):
+    """
+    Return METRIC_COSINE for inner-product indexes (vectors are stored normalized)
+    and METRIC_L2 otherwise. The FAISS index itself is the source of truth, so
+    stores saved before cosine mode existed are recognised without extra metadata.
+    """
+    return METRIC_COSINE if index.metric_type == faiss.METRIC_INNER_PRODUCT else METRIC_L2
+
+
+def is_cosine_store(vector_store):
+    return index_metric(vector_store.index) == METRIC_COSINE
+
+
+def index_memory_bytes(index):
+    """
+    Approximate resident size of a FAISS index: the stored codes, plus inverted
+    list ids and the direct map for IVF, or the neighbour links for HNSW.
+    """
+    if isinstance(index, faiss.IndexHNSW):
+        return index_memory_bytes(index.storage) + index.hnsw.neighbors.size() * 4
+    if isinstance(index, faiss.IndexIVF):
+        return index.ntotal * (index.code_size + 16) + index.quantizer.ntotal * index.d * 4
+    try:
+        return index.ntotal * index.sa_code_size()
+    except (AttributeError, RuntimeError):
+        return index.ntotal * index.d * 4
+
+
+def apply_search_params(index, spec):
+    """
+    Set the search-time parameters of spec (nprobe, efSearch) on a loaded index.
+    """
+    if spec.type == INDEX_IVF and isinstance(index, faiss.IndexIVF):
+        index.nprobe = spec.nprobe
+    elif spec.type == INDEX_HNSW and isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = spec.ef_search
+
+
+def filtered_search_params(index, allowed):
+    """
+    Search parameters that make the index skip every position not set in the
+    packed bitmap allowed, keeping the index's own nprobe / efSearch.
+    """
+    selector = faiss.IDSelectorBitmap(allowed)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def configure_vector_store(vector_store, spec=None):
+    """
+    LangChain does not persist the distance strategy with save_local; restore it
+    from the loaded index so added vectors and LangChain queries are normalized too.
+    With a spec, its search-time parameters are applied as well.
+    """
+    if is_cosine_store(vector_store):
+        vector_store.distance_strategy = DistanceStrategy.MAX_INNER_PRODUCT
+        vector_store._normalize_L2 = True
+    else:
+        vector_store.distance_strategy = DistanceStrategy.EUCLIDEAN_DISTANCE
+        vector_store._normalize_L2 = False
+    if not hasattr(vector_store, "exact_vectors"):
+        vector_store.exact_vectors = None
+    if not hasattr(vector_store, "memory_mapped"):
+        vector_store.memory_mapped = False
+    if not hasattr(vector_store, "tombstones"):
+        vector_store.tombstones = 0
+    if spec is not None:
+        apply_search_params(vector_store.index, spec)
+        vector_store.rescore_factor = spec.rescore_factor
+    return vector_store
+
+
+def _ensure_writable(vector_store):
+    # Writing to a memory-mapped FAISS index aborts the process instead of raising
+    if getattr(vector_store, "read_only", False):
+        raise ValueError("Vector store was loaded read-only; load a writable copy to modify it")
+
+
+def read_faiss_index(index_path, mmap=False):
+    """
+    Read a FAISS index file. With mmap the stored codes are mapped read-only instead
+    of copied into the heap, so processes loading the same file share its pages
+    through the OS page cache. Returns (index, memory_mapped).
+    """
+    if mmap:
+        try:
+            return faiss.read_index(str(index_path), faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY), True
+        except RuntimeError as e:
+            logger.warning(f"Cannot memory-map {index_path} ({e}); reading it into memory")
+    return faiss.read_index(str(index_path)), False
+
+
+def has_current_layout(vector_store_dir):
+    """
+    Whether a saved store has every file the current code writes; older versions
+    are re-published on their next build.
+    """
+    path = Path(vector_store_dir)
+    filenames = (DOCSTORE_FILENAME, LEXICAL_INDEX_FILENAME, CODE_INDEX_FILENAME, DOCUMENT_INDEX_FILENAME)
+    return all((path / filename).exists() for filename in filenames)
+
+
+def save_faiss_store(vector_store, vector_store_dir):
+    """
+    Write a vector store as index.faiss plus a SQLite docstore, its BM25 and
+    document identifier indexes (and the exact vectors of a rescoring store).
+    Unlike save_local nothing is pickled.
+    """
+    path = Path(vector_store_dir)
+    faiss.write_index(vector_store.index, str(path / INDEX_FILENAME))
+    write_docstore(path / DOCSTORE_FILENAME, vector_store.docstore, vector_store.index_to_docstore_id)
+    build_lexical_index(path / LEXICAL_INDEX_FILENAME, path / DOCSTORE_FILENAME)
+    build_code_index(path / CODE_INDEX_FILENAME, path / DOCSTORE_FILENAME)
+    save_exact_vectors(vector_store, path)
+
+
+def load_faiss_store(vector_store_dir, embeddings, read_only=False):
+    """
+    Load a saved vector store. Read-only stores are for serving: the index is
+    memory-mapped when VECTOR_STORE_MMAP is set, documents are read from the
+    SQLite docstore only for search hits, and the BM25, identifier and document
+    description indexes are attached as vector_store.lexical_index, code_index and
+    document_index, so loading takes milliseconds. Writable
+    stores get a private in-memory index and a scratch BuildDocstore for an index build.
+    Stores saved by LangChain's save_local are read from their pickle, which must
+    come from a trusted source.
+    """
+    path = Path(vector_store_dir)
+    index, memory_mapped = read_faiss_index(path / INDEX_FILENAME, mmap=read_only and VECTOR_STORE_MMAP)
+    if (path / DOCSTORE_FILENAME).exists():
+        sqlite_docstore = SqliteDocstore(path / DOCSTORE_FILENAME)
+        if read_only:
+            docstore, index_to_docstore_id = sqlite_docstore, sqlite_docstore.position_map()
+        else:
+            docstore, index_to_docstore_id = sqlite_docstore.to_build()
+            sqlite_docstore.close()
+    else:
+        with open(path / LEGACY_DOCSTORE_FILENAME, "rb") as f:
+            legacy_docstore, index_to_docstore_id = pickle.load(f)
+        docstore = BuildDocstore()
+        docstore.add(legacy_docstore._dict)
+    vector_store = FAISS(embeddings, index, docstore, index_to_docstore_id)
+    vector_store.memory_mapped = memory_mapped
+    vector_store.read_only = read_only
+    # Positions deleted from an index that cannot remove vectors have no docstore row
+    vector_store.tombstones = 0 if _removes_in_place(index) else index.ntotal - len(index_to_docstore_id)
+    lexical_path = path / LEXICAL_INDEX_FILENAME
+    vector_store.lexical_index = LexicalIndex(lexical_path) if read_only and lexical_path.exists() else None
+    code_path = path / CODE_INDEX_FILENAME
+    vector_store.code_index = CodeIndex(code_path) if read_only and code_path.exists() else None
+    document_path = path / DOCUMENT_INDEX_FILENAME
+    vector_store.document_index = DocumentIndex(document_path) if read_only and document_path.exists() else None
+    load_exact_vectors(vector_store, path)
+    return vector_store
+
+
+def close_vector_store(vector_store):
+    """
+    Release the docstore and lexical index file handles and the memory maps of a
+    read-only store, or the scratch docstore of a writable one. The store cannot be
+    searched afterwards.
+    """
+    if isinstance(vector_store.docstore, (SqliteDocstore, BuildDocstore)):
+        vector_store.docstore.close()
+    if getattr(vector_store, "lexical_index", None) is not None:
+        vector_store.lexical_index.close()
+    # Mapped files are unmapped once nothing references them
+    if isinstance(getattr(vector_store, "exact_vectors", None), np.memmap):
+        vector_store.exact_vectors = None
+    if getattr(vector_store, "memory_mapped", False):
+        vector_store.index = None
+
+
+def save_exact_vectors(vector_store, vector_store_dir):
+    if getattr(vector_store, "exact_vectors", None) is not None:
+        np.save(os.path.join(vector_store_dir, EXACT_VECTORS_FILENAME), np.asarray(vector_store.exact_vectors))
+
+
+def load_exact_vectors(vector_store, vector_store_dir):
+    """
+    Attach the full-precision vectors saved next to a quantized index, memory-mapped
+    read-only so only the rows touched by rescoring are paged in.
+    """
+    path = os.path.join(vector_store_dir, EXACT_VECTORS_FILENAME)
+    vector_store.exact_vectors = np.load(path, mmap_mode="r") if os.path.exists(path) else None
+    return vector_store
+
+
+def rescore(query, positions, exact_vectors, metric, k):
+    """
+    Re-rank candidate positions by exact similarity to query (already normalized for
+    cosine stores). Returns (scores, positions) of the best k in FAISS order:
+    inner product descending, or squared L2 distance ascending.
+    """
+    positions = np.asarray([position for position in positions if position != -1], dtype=np.int64)
+    if len(positions) == 0:
+        return np.zeros(0, dtype=np.float32), positions
+    vectors = np.asarray(exact_vectors[positions], dtype=np.float32)
+    if metric == METRIC_COSINE:
+        scores = vectors @ query
+        order = np.argsort(-scores, kind="stable")[:k]
+    else:
+        scores = np.sum((vectors - query) ** 2, axis=1)
+        order = np.argsort(scores, kind="stable")[:k]
+    return scores[order], positions[order]
+
+
+def build_index(spec, dimension, metric, training_vectors):
+    """
+    Create an empty FAISS index for spec, trained on training_vectors when the
+    index type needs it. Vectors must already be normalized for cosine indexes.
+    IVF nlist is capped so every centroid gets enough training points.
+    """
+    faiss_metric = faiss.METRIC_INNER_PRODUCT if metric == METRIC_COSINE else faiss.METRIC_L2
+    if spec.encoding == ENCODING_PQ:
+        if dimension % spec.pq_m:
+            raise ValueError(f"pq_m={spec.pq_m} does not divide the embedding dimension {dimension}")
+        if len(training_vectors) < MIN_PQ_TRAINING_POINTS:
+            logger.warning(f"Too few vectors ({len(training_vectors)}) to train PQ; storing them as fp16")
+            encoding = ENCODING_FACTORY[ENCODING_FP16]
+        else:
+            # "np": skip polysemous training, which we never search with and which dominates build time
+            encoding = f"PQ{spec.pq_m}np"
+    else:
+        encoding = ENCODING_FACTORY[spec.encoding]
+
+    if spec.type == INDEX_IVF:
+        nlist = max(1, min(spec.nlist, len(training_vectors) // MIN_POINTS_PER_CENTROID))
+        if nlist < spec.nlist:
+            logger.info(f"Reduced IVF nlist from {spec.nlist} to {nlist} for {len(training_vectors)} training vectors")
+        description = f"IVF{nlist},{encoding}"
+    elif spec.type == INDEX_HNSW:
+        description = f"HNSW{spec.m},{encoding}"
+    else:
+        description = encoding
+    index = faiss.index_factory(dimension, description, faiss_metric)
+
+    if not index.is_trained:
+        started = time.monotonic()
+        index.train(np.ascontiguousarray(training_vectors, dtype=np.float32))
+        logger.info(f"Trained {description} on {len(training_vectors)} vectors in {time.monotonic() - started:.1f}s")
+    if isinstance(index, faiss.IndexIVF):
+        # Keeps stored vectors reconstructable for relevance scoring and rebuilds
+        index.make_direct_map()
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efConstruction = spec.ef_construction
+    apply_search_params(index, spec)
+    return index
+
+
+def _is_lossless(index):
+    return isinstance(index, (faiss.IndexFlat, faiss.IndexIVFFlat, faiss.IndexHNSWFlat))
+
+
+def _stored_vectors(vector_store):
+    """
+    All vectors of the store in index order: the exact copy when one is kept,
+    otherwise whatever the index reconstructs (approximate for quantized indexes).
+    """
+    if getattr(vector_store, "exact_vectors", None) is not None:
+        return np.array(vector_store.exact_vectors, dtype=np.float32)
+    index = vector_store.index
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return np.ascontiguousarray(index.reconstruct_n(0, index.ntotal), dtype=np.float32)
+
+
+def create_vector_store(text_embeddings, embeddings, metadatas, ids, metric=VECTOR_STORE_METRIC, spec=None):
+    """
+    Build a new LangChain FAISS store from precomputed (text, vector) pairs,
+    training the index on them when spec requires it. In cosine mode vectors are
+    L2-normalized into an inner-product index, so search scores are cosine similarities.
+    """
+    spec = spec or IndexSpec()
+    text_embeddings = list(text_embeddings)
+    vectors = np.array([vector for _, vector in text_embeddings], dtype=np.float32)
+    if metric == METRIC_COSINE:
+        faiss.normalize_L2(vectors)
+    vector_store = FAISS(embeddings, build_index(spec, vectors.shape[1], metric, vectors), BuildDocstore(), {})
+    configure_vector_store(vector_store, spec)
+    vector_store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+    vector_store.exact_vectors = vectors if spec.keeps_exact_vectors else None
+    return vector_store
+
+
+def add_to_vector_store(vector_store, text_embeddings, metadatas, ids):
+    """
+    Add precomputed (text, vector) pairs, keeping the exact vector copy of a
+    rescoring store in step with the index. New vectors are numbered from the
+    index size rather than from the position map as LangChain does, which has
+    gaps where deleted positions were tombstoned.
+    """
+    _ensure_writable(vector_store)
+    text_embeddings = list(text_embeddings)
+    vectors = np.array([vector for _, vector in text_embeddings], dtype=np.float32)
+    if vector_store._normalize_L2:
+        faiss.normalize_L2(vectors)
+    start = vector_store.index.ntotal
+    vector_store.index.add(vectors)
+    vector_store.docstore.add({
+        doc_id: Document(id=doc_id, page_content=text, metadata=metadata)
+        for doc_id, (text, _), metadata in zip(ids, text_embeddings, metadatas)
+    })
+    vector_store.index_to_docstore_id.update({start + i: doc_id for i, doc_id in enumerate(ids)})
+    if getattr(vector_store, "exact_vectors", None) is not None:
+        vector_store.exact_vectors = _append_exact_vectors(vector_store, vectors)
+
+
+def _append_exact_vectors(vector_store, vectors):
+    """
+    exact_vectors with vectors appended, as a view of a buffer that grows by half
+    its size when full, so a build adding window after window does not copy every
+    stored vector on each add.
+    """
+    exact_vectors = vector_store.exact_vectors
+    count = len(exact_vectors)
+    buffer = getattr(vector_store, "_exact_buffer", None)
+    if buffer is None or exact_vectors.base is not buffer or len(buffer) < count + len(vectors):
+        capacity = max(count + len(vectors), int(count * 1.5))
+        buffer = np.empty((capacity, exact_vectors.shape[1]), dtype=np.float32)
+        buffer[:count] = exact_vectors
+        vector_store._exact_buffer = buffer
+    buffer[count:count + len(vectors)] = vectors
+    return buffer[:count + len(vectors)]
+
+
+def rebuild_index(vector_store, spec, metric=None):
+    """
+    Rebuild the index of vector_store in place as spec (and metric, default: the
+    current one) from its stored vectors, retraining if needed. Vector order is kept,
+    so docstore ids stay valid and nothing is re-embedded; tombstoned positions are
+    dropped. Returns the number of vectors the new index was trained on.
+    """
+    metric = metric or index_metric(vector_store.index)
+    if getattr(vector_store, "exact_vectors", None) is None and not _is_lossless(vector_store.index):
+        logger.warning("Rebuilding from vectors reconstructed by a quantized index; rebuild from scratch for full precision")
+    vectors = _stored_vectors(vector_store)
+    if getattr(vector_store, "tombstones", 0):
+        vectors = vectors[_drop_tombstones(vector_store)]
+    if metric == METRIC_COSINE:
+        faiss.normalize_L2(vectors)
+    index = build_index(spec, vector_store.index.d, metric, vectors)
+    index.add(vectors)
+    vector_store.index = index
+    vector_store.memory_mapped = False
+    vector_store.exact_vectors = vectors if spec.keeps_exact_vectors else None
+    configure_vector_store(vector_store, spec)
+    logger.info(f"Rebuilt vector store index as {spec} with metric '{metric}' ({index.ntotal} vectors)")
+    return len(vectors)
+
+
+def _removes_in_place(index):
+    # HNSW graphs cannot drop a node, so their deletes leave tombstones
+    return isinstance(index, (faiss.IndexFlatCodes, faiss.IndexIVF))
+
+
+def _drop_tombstones(vector_store):
+    """
+    Renumber the live positions of vector_store consecutively and return them
+    in their old order, for selecting the vectors that stay.
+    """
+    keep = sorted(vector_store.index_to_docstore_id)
+    vector_store.index_to_docstore_id = {
+        new_position: vector_store.index_to_docstore_id[old_position] for new_position, old_position in enumerate(keep)
+    }
+    vector_store.tombstones = 0
+    return keep
+
+
+def _remove_from_ivf(index, positions):
+    """
+    Remove sorted positions from an IVF index and shift the ids of the vectors
+    after them down, as flat indexes do, without re-encoding a single vector.
+    """
+    # Only the hashtable direct map supports removal; the array map is rebuilt afterwards
+    index.set_direct_map_type(faiss.DirectMap.NoMap)
+    index.remove_ids(faiss.IDSelectorBatch(positions))
+    invlists = index.invlists
+    for list_number in range(index.nlist):
+        size = invlists.list_size(list_number)
+        if size:
+            ids = faiss.rev_swig_ptr(invlists.get_ids(list_number), size)
+            ids -= np.searchsorted(positions, ids)
+    index.make_direct_map()
+
+
+def delete_from_store(vector_store, ids):
+    """
+    Delete chunks by docstore id. Flat and IVF indexes remove the vectors and
+    renumber the positions after them. HNSW cannot remove a vector, so its
+    positions are left as tombstones that searches skip through the selector
+    bitmap (see search_filter.live_bitmap) until compact_vector_store drops them.
+    """
+    _ensure_writable(vector_store)
+    remove = set(ids)
+    positions = np.array(
+        sorted(position for position, doc_id in vector_store.index_to_docstore_id.items() if doc_id in remove),
+        dtype=np.int64,
+    )
+    if len(positions) == 0:
+        return
+    index = vector_store.index
+    if not _removes_in_place(index):
+        vector_store.docstore.delete(ids)
+        for position in positions.tolist():
+            del vector_store.index_to_docstore_id[position]
+        vector_store.tombstones = getattr(vector_store, "tombstones", 0) + len(positions)
+        return
+
+    exact_vectors = getattr(vector_store, "exact_vectors", None)
+    if exact_vectors is not None:
+        vector_store.exact_vectors = np.delete(np.asarray(exact_vectors, dtype=np.float32), positions, axis=0)
+    if isinstance(index, faiss.IndexFlatCodes):
+        vector_store.delete(ids)
+        return
+    _remove_from_ivf(index, positions)
+    vector_store.docstore.delete(ids)
+    vector_store.index_to_docstore_id = {
+        position - int(np.searchsorted(positions, position)): doc_id
+        for position, doc_id in vector_store.index_to_docstore_id.items() if doc_id not in remove
+    }
+
+
+def compact_vector_store(vector_store):
+    """
+    Rewrite the index and position map into fresh containers. Deletions leave
+    over-allocated index buffers, Python dicts that never shrink and HNSW
+    tombstones; the index is refilled with the live vectors only, keeping its
+    trained structure.
+    """
+    _ensure_writable(vector_store)
+    if not getattr(vector_store, "tombstones", 0):
+        vector_store.index = faiss.clone_index(vector_store.index)
+        vector_store.index_to_docstore_id = dict(vector_store.index_to_docstore_id)
+        return
+    vectors = _stored_vectors(vector_store)[_drop_tombstones(vector_store)]
+    index = faiss.clone_index(vector_store.index)
+    index.reset()
+    index.add(vectors)
+    vector_store.index = index
+    if getattr(vector_store, "exact_vectors", None) is not None:
+        vector_store.exact_vectors = vectors
+
+
+def recall_latency_report(vectors, specs, metric=METRIC_COSINE, query_count=200, k=10, seed=0):
+    """
+    Measure recall@k, per-query latency and index memory of each spec against exact
+    search over vectors. Queries are sampled from the vectors themselves. Specs that
+    share a structure share one built index. Memory saved is relative to a float32
+    flat index; the exact copy kept on disk for rescoring is not counted.
+    Returns a list of dict rows.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if metric == METRIC_COSINE:
+        faiss.normalize_L2(vectors)
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), size=min(query_count, len(vectors)), replace=False)]
+    k = min(k, len(vectors))
+
+    exact = build_index(IndexSpec(), vectors.shape[1], metric, vectors)
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    built = {}
+    rows = []
+    for spec in specs:
+        build_seconds = 0.0
+        if spec.structure not in built:
+            started = time.monotonic()
+            index = build_index(spec, vectors.shape[1], metric, vectors)
+            index.add(vectors)
+            build_seconds = time.monotonic() - started
+            built[spec.structure] = index
+        index = built[spec.structure]
+        apply_search_params(index, spec)
+
+        started = time.perf_counter()
+        if spec.keeps_exact_vectors:
+            _, candidates = index.search(queries, k * spec.rescore_factor)
+            found = [rescore(query, row, vectors, metric, k)[1] for query, row in zip(queries, candidates)]
+        else:
+            _, found = index.search(queries, k)
+        latency_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+        hits = sum(len(set(found_row) & set(truth_row)) for found_row, truth_row in zip(found, truth))
+        recall = hits / truth.size
+        memory_bytes = index_memory_bytes(index)
+        rows.append({
+            "index": repr(spec),
+            "build_seconds": round(build_seconds, 2),
+            f"recall@{k}": round(recall, 4),
+            "recall_lost": round(1 - recall, 4),
+            "latency_ms": round(latency_ms, 3),
+            "memory_mb": round(memory_bytes / 1024 / 1024, 2),
+            "memory_saved": f"{1 - memory_bytes / vectors.nbytes:.0%}",
+        })
+    return rows
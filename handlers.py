@@ -18,12 +18,14 @@ from telegram.ext import (
 from telegram.constants import ParseMode
 
 from llm_service import LLMService
+from vector_store_registry import KnowledgeBaseGroup, vector_store_registry
+from search_filter import SearchFilter
 from settings import CHAT_HISTORY_LEVEL, knowledge_base_paths, SUPPORTED_LANGUAGES, knowledge_base_language
 from db_service import DatabaseService
 from decorators import log_errors, log_event, authorized_only, initialize_services, ensure_documents_indexed
 from helpers import messages_to_langchain_messages, get_language_code, get_language_name
 import text
-from text import KnowledgeBaseResponses, CommandDescriptions
+from text import KnowledgeBaseResponses, CommandDescriptions, FilterResponses
 
 logger = logging.getLogger(__name__)
 
@@ -49,6 +51,33 @@ class BotHandlers:
             logger.error(f"Failed to initialize LLMService: {e}")
             return None
 
+    def _attach_knowledge_base(self, context, knowledge_base, add=False):
+        """
+        Store the session's knowledge base handle, releasing the previous one
+        so the shared registry can evict indexes nobody uses anymore. With add,
+        the knowledge base is attached next to the current ones instead.
+        """
+        previous = context.user_data.pop("knowledge_base", None)
+        if add and previous is not None and knowledge_base is not None:
+            context.user_data["knowledge_base"] = KnowledgeBaseGroup(previous.handles).add(knowledge_base)
+            return
+        if previous is not None and previous is not knowledge_base:
+            previous.release()
+        if knowledge_base is not None:
+            context.user_data["knowledge_base"] = knowledge_base
+
+    @staticmethod
+    def _knowledge_base_names(knowledge_base):
+        """Names of the predefined knowledge bases attached to the session."""
+        if knowledge_base is None:
+            return []
+        return [
+            kb_name
+            for handle in knowledge_base.handles
+            for kb_name, kb_path in knowledge_base_paths.items()
+            if kb_path == handle.folder_path
+        ]
+
     async def post_init(self, application):
         """
         Initializes bot commands with multilingual support.
@@ -207,12 +236,8 @@ class BotHandlers:
         context_source = context.user_data.get("context_source", "none")
         language = context.user_data.get("language", "English")
 
-        # Find the knowledge base name from the folder_path
-        knowledge_base_name = None
-        for kb_name, kb_path in knowledge_base_paths.items():
-            if kb_path == folder_path:
-                knowledge_base_name = kb_name
-                break
+        # Find the names of the attached knowledge bases
+        knowledge_base_name = " + ".join(self._knowledge_base_names(context.user_data.get("knowledge_base"))) or None
 
         if context_source in ["folder", "upload"]:
             if knowledge_base_name and valid_files_in_folder:
@@ -260,10 +285,14 @@ class BotHandlers:
     @log_errors(default_return=None)
     async def knowledge_base(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /knowledge_base command."""
-        # Create a keyboard from the keys of the knowledge_base_paths dictionary
+        # Create a keyboard from the keys of the knowledge_base_paths dictionary;
+        # the second button attaches a knowledge base next to the current ones
         language = context.user_data.get("language", "English")
         keyboard = [
-            [InlineKeyboardButton(kb_name, callback_data=f"set_knowledge:{kb_name}")]
+            [
+                InlineKeyboardButton(kb_name, callback_data=f"set_knowledge:{kb_name}"),
+                InlineKeyboardButton("\u2795", callback_data=f"add_knowledge:{kb_name}"),
+            ]
             for kb_name in knowledge_base_paths.keys()
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -282,7 +311,8 @@ class BotHandlers:
             self, update: Update, context: ContextTypes.DEFAULT_TYPE
     ):
         """
-        Handler to set the folder path based on the user's knowledge base selection.
+        Handler to set the folder path based on the user's knowledge base selection,
+        or to attach the selected knowledge base next to the current ones.
         """
         query = update.callback_query
         language = context.user_data.get("language", "English")
@@ -290,8 +320,10 @@ class BotHandlers:
         data = query.data
         user_id = context.user_data["user_id"]
 
-        if data.startswith("set_knowledge:"):
-            selection = data[len("set_knowledge:"):]
+        if data.startswith(("set_knowledge:", "add_knowledge:")):
+            selection = data.split(":", 1)[1]
+            # Attaching to a session without a knowledge base is the same as selecting one
+            add = data.startswith("add_knowledge:") and context.user_data.get("knowledge_base") is not None
             folder_path = knowledge_base_paths.get(selection, None)
             knowledge_base_lang = knowledge_base_language.get(selection, 'English')  # Get the knowledge base language
             if folder_path is None:
@@ -301,10 +333,12 @@ class BotHandlers:
                 logger.warning(f"Unknown knowledge base selection '{selection}' by user_id={user_id}")
                 return
 
-            # Set the folder path and process the documents
-            context.user_data["folder_path"] = folder_path
-            context.user_data["context_source"] = "folder"  # Set context source as folder
-            logger.debug(f"Set folder_path='{folder_path}' for user_id={user_id}")
+            # Set the folder path and process the documents; an attached knowledge base
+            # keeps the current one as the primary
+            if not add:
+                context.user_data["folder_path"] = folder_path
+                context.user_data["context_source"] = "folder"  # Set context source as folder
+                logger.debug(f"Set folder_path='{folder_path}' for user_id={user_id}")
 
             # Index the documents in the folder
             llm_service = context.user_data["llm_service"]
@@ -314,7 +348,8 @@ class BotHandlers:
                     for f in os.listdir(folder_path)
                     if f.lower().endswith((".pdf", ".docx", ".xlsx"))
                 ]
-                context.user_data["valid_files_in_folder"] = valid_files_in_folder
+                if not add:
+                    context.user_data["valid_files_in_folder"] = valid_files_in_folder
                 logger.debug(f"Found {len(valid_files_in_folder)} valid files in folder_path='{folder_path}' for user_id={user_id}")
 
                 if not valid_files_in_folder:
@@ -326,18 +361,26 @@ class BotHandlers:
                     return
 
                 # Pass the knowledge base language to load_and_index_documents
-                index_status, index_message = llm_service.load_and_index_documents(folder_path, knowledge_base_lang)
+                index_status, index_message, kb_handle = llm_service.load_and_index_documents(
+                    folder_path, knowledge_base_lang
+                )
                 if not index_status:
                     logger.error(f"Error during load_and_index_documents: {index_message}")
                     await query.message.reply_text(KnowledgeBaseResponses.indexing_error(language=language),
                                                    parse_mode=ParseMode.HTML)
                     return
 
+                self._attach_knowledge_base(context, kb_handle, add=add)
+                if add:
+                    context.user_data["valid_files_in_folder"] = list(dict.fromkeys(
+                        context.user_data.get("valid_files_in_folder", []) + valid_files_in_folder
+                    ))
                 context.user_data["vector_store_loaded"] = True
-                system_response = KnowledgeBaseResponses.knowledge_base_set_success(selection, language=language)
+                attached = " + ".join(self._knowledge_base_names(context.user_data["knowledge_base"])) or selection
+                system_response = KnowledgeBaseResponses.knowledge_base_set_success(attached, language=language)
                 await query.message.reply_text(system_response, parse_mode=ParseMode.HTML)
                 context.user_data["system_response"] = system_response
-                logger.info(f"Knowledge base '{selection}' set successfully for user_id={user_id}")
+                logger.info(f"Knowledge base '{selection}' {'attached' if add else 'set'} successfully for user_id={user_id}")
             except Exception as e:
                 logger.exception(f"Error setting knowledge base for user_id={user_id}: {e}")
                 system_response = text.Responses.generic_error(language=language)
@@ -396,7 +439,9 @@ class BotHandlers:
             # You can set a default language or prompt the user to specify.
             # Here, we'll set the default language to 'English'.
             knowledge_base_lang = 'English'  # Default language
-            index_status, index_message = llm_service.load_and_index_documents(folder_path, knowledge_base_lang)
+            index_status, index_message, kb_handle = llm_service.load_and_index_documents(
+                folder_path, knowledge_base_lang
+            )
             if not index_status:
                 logger.error(f"Error during load_and_index_documents: {index_message}")
                 system_response = text.Responses.indexing_error(language=language)
@@ -405,6 +450,7 @@ class BotHandlers:
                 context.user_data["system_response"] = system_response
                 return ConversationHandler.END
 
+            self._attach_knowledge_base(context, kb_handle)
             context.user_data["vector_store_loaded"] = True
             logger.info(f"Documents indexed successfully for folder_path='{folder_path}' by user_id={user_id}")
 
@@ -449,16 +495,15 @@ class BotHandlers:
             "context_source",
             "file_id_map",
             "conversation_id",
+            "search_filter",
         ]
         for key in keys_to_clear:
             context.user_data.pop(key, None)
             logger.debug(f"Cleared context key '{key}' for user_id={user_id}")
 
-        # Clear the vector store
-        llm_service = context.user_data.get("llm_service")
-        if llm_service and hasattr(llm_service, "vector_store"):
-            llm_service.vector_store = None
-            logger.debug(f"Cleared vector_store for user_id={user_id}")
+        # Release the shared knowledge base index
+        self._attach_knowledge_base(context, None)
+        logger.debug(f"Released knowledge base for user_id={user_id}")
 
         # Optionally, remove any uploaded files from the user's upload folder
         user_id = context.user_data["user_id"]
@@ -470,6 +515,8 @@ class BotHandlers:
                     if os.path.isfile(file_path):
                         os.unlink(file_path)
                         logger.debug(f"Deleted file '{file_path}' for user_id={user_id}")
+                # The cached index of the deleted files must not be served for the next upload
+                vector_store_registry.discard(user_folder)
                 # Remove the user folder if empty
                 if not os.listdir(user_folder):
                     os.rmdir(user_folder)
@@ -492,6 +539,34 @@ class BotHandlers:
         context.user_data["system_response"] = system_response
         logger.info(f"Context cleared for user_id={user_id}")
 
+    @authorized_only
+    @initialize_services
+    @log_event(event_type="command")
+    @log_errors(default_return=None)
+    async def filter_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle the /filter command: /filter type=...; language=...; documents=a.pdf, b.pdf"""
+        language = context.user_data.get("language", "English")
+        user_id = context.user_data["user_id"]
+        filter_text = " ".join(context.args or [])
+
+        try:
+            search_filter = SearchFilter.parse(filter_text)
+        except ValueError as e:
+            logger.info(f"Rejected filter '{filter_text}' from user_id={user_id}: {e}")
+            system_response = FilterResponses.invalid_filter(language=language)
+        else:
+            if search_filter:
+                context.user_data["search_filter"] = search_filter
+                system_response = FilterResponses.filter_set(search_filter, language=language)
+                logger.info(f"Set {search_filter} for user_id={user_id}")
+            else:
+                context.user_data.pop("search_filter", None)
+                system_response = FilterResponses.filter_cleared(language=language)
+                logger.info(f"Cleared the search filter for user_id={user_id}")
+
+        await update.message.reply_text(system_response, parse_mode=ParseMode.HTML)
+        context.user_data["system_response"] = system_response
+
     @authorized_only
     @initialize_services
     @log_event(event_type="command")
@@ -559,7 +634,8 @@ class BotHandlers:
         try:
             # Generate response using LLM service
             response, source_files, suggestions = llm_service.generate_response(
-                user_message, chat_history=chat_history
+                user_message, context.user_data.get("knowledge_base"), chat_history=chat_history,
+                search_filter=context.user_data.get("search_filter"), user_id=user_id,
             )
             logger.info(f"Generated response for user_id={user_id}")
         except Exception as e:
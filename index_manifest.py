@@ -0,0 +1,173 @@
+# index_manifest.py
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def file_sha256(file_path, chunk_size=1024 * 1024):
+    """
+    Hash a file's content in fixed-size chunks so large PDFs are not read into memory at once.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_fingerprint(file_path, known=None):
+    """
+    {"sha256", "mtime", "size"} of a file. The hash of known, an earlier fingerprint,
+    is trusted without re-hashing when the file's mtime and size are unchanged.
+    """
+    stat = os.stat(file_path)
+    if known and known.get("mtime") == stat.st_mtime and known.get("size") == stat.st_size:
+        sha = known["sha256"]
+    else:
+        sha = file_sha256(file_path)
+    return {"sha256": sha, "mtime": stat.st_mtime, "size": stat.st_size}
+
+
+def make_chunk_ids(filename, file_hash, count):
+    """
+    Deterministic docstore ids for the chunks of one file version. The filename
+    is part of the key so identical copies of a PDF get distinct ids.
+    """
+    prefix = hashlib.sha256(f"{filename}\0{file_hash}".encode("utf-8")).hexdigest()[:16]
+    return [f"{prefix}-{i}" for i in range(count)]
+
+
+class ManifestDiff:
+    def __init__(self):
+        self.added = []      # filenames not in the index yet
+        self.changed = []    # filenames whose content hash changed
+        self.removed = []    # filenames indexed but no longer in the folder
+        self.fingerprints = {}  # filename -> {"sha256", "mtime", "size"} for files in the folder
+
+    @property
+    def has_changes(self):
+        return bool(self.added or self.changed or self.removed)
+
+    def __repr__(self):
+        return f"ManifestDiff(added={len(self.added)}, changed={len(self.changed)}, removed={len(self.removed)})"
+
+
+class IndexManifest:
+    """
+    Per-file record of what a saved vector store contains: content hash,
+    mtime, size and the docstore ids of the file's chunks, plus the embedding
+    model the vectors were produced with, the chunker signature the chunks were
+    cut with and the FAISS index spec they are stored in. Stored as manifest.json
+    next to the index.
+    """
+
+    def __init__(self, embedding_model, files=None, deleted_since_compaction=0, index=None, chunker=None):
+        self.embedding_model = embedding_model
+        self.chunker = chunker
+        self.files = files or {}
+        self.deleted_since_compaction = deleted_since_compaction
+        # IndexSpec.to_dict() of the index plus "trained_on"; None means a flat index
+        self.index = index
+
+    @classmethod
+    def load(cls, vector_store_dir):
+        """
+        Load the manifest from vector_store_dir. Returns None if it is missing or unreadable.
+        """
+        manifest_path = Path(vector_store_dir) / MANIFEST_FILENAME
+        if not manifest_path.exists():
+            return None
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return cls(
+                embedding_model=data["embedding_model"],
+                files=data.get("files", {}),
+                deleted_since_compaction=data.get("deleted_since_compaction", 0),
+                index=data.get("index"),
+                chunker=data.get("chunker"),
+            )
+        except Exception as e:
+            logger.error(f"Failed to read index manifest '{manifest_path}': {e}")
+            return None
+
+    def save(self, vector_store_dir):
+        """
+        Write the manifest atomically so a crash never leaves a half-written file.
+        """
+        manifest_path = Path(vector_store_dir) / MANIFEST_FILENAME
+        tmp_path = manifest_path.with_suffix(".json.tmp")
+        data = {
+            "version": MANIFEST_VERSION,
+            "embedding_model": self.embedding_model,
+            "chunker": self.chunker,
+            "deleted_since_compaction": self.deleted_since_compaction,
+            "index": self.index,
+            "files": self.files,
+        }
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, manifest_path)
+        logger.debug(f"Index manifest saved to {manifest_path}")
+
+    @property
+    def chunk_count(self):
+        return sum(len(entry.get("chunk_ids", [])) for entry in self.files.values())
+
+    def diff(self, folder_path, filenames):
+        """
+        Compare the manifest with the given PDF filenames in folder_path.
+        Files whose mtime and size are unchanged are trusted without re-hashing.
+        """
+        result = ManifestDiff()
+        for filename in filenames:
+            entry = self.files.get(filename)
+            result.fingerprints[filename] = file_fingerprint(os.path.join(folder_path, filename), entry)
+            sha = result.fingerprints[filename]["sha256"]
+
+            if entry is None:
+                result.added.append(filename)
+            elif entry.get("sha256") != sha:
+                result.changed.append(filename)
+
+        present = set(filenames)
+        result.removed = [filename for filename in self.files if filename not in present]
+        return result
+
+    @classmethod
+    def from_vector_store(cls, vector_store, embedding_model, folder_path, filenames):
+        """
+        Bootstrap a manifest for a vector store saved before manifests existed.
+        Chunks are grouped by their "source" metadata; the indexed files are
+        assumed to match their current content so nothing is re-embedded.
+        """
+        chunk_ids_by_source = {}
+        for doc_id in vector_store.index_to_docstore_id.values():
+            source = vector_store.docstore.search(doc_id).metadata.get("source")
+            chunk_ids_by_source.setdefault(source, []).append(doc_id)
+
+        manifest = cls(embedding_model=embedding_model)
+        present = set(filenames)
+        for source, chunk_ids in chunk_ids_by_source.items():
+            if source in present:
+                file_path = os.path.join(folder_path, source)
+                stat = os.stat(file_path)
+                manifest.files[source] = {
+                    "sha256": file_sha256(file_path),
+                    "mtime": stat.st_mtime,
+                    "size": stat.st_size,
+                    "chunk_ids": chunk_ids,
+                }
+            else:
+                # Kept with an empty hash so the next diff reports it as removed
+                manifest.files[source] = {"sha256": "", "mtime": 0, "size": 0, "chunk_ids": chunk_ids}
+        logger.info(f"Bootstrapped index manifest for {len(manifest.files)} indexed files in '{folder_path}'")
+        return manifest
@@ -0,0 +1,138 @@
+# index_storage.py
+
+import logging
+import os
+import shutil
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+VECTOR_STORE_DIRNAME = "vector_store"
+VERSIONS_DIRNAME = "versions"
+POINTER_FILENAME = "CURRENT"
+CHECKPOINTS_DIRNAME = "embedding_checkpoints"
+LEGACY_INDEX_FILENAME = "index.faiss"
+
+
+class IndexStorage:
+    """
+    Versioned on-disk layout for a knowledge base index:
+
+        <kb>/vector_store/CURRENT            name of the published version
+        <kb>/vector_store/versions/<version>/ one complete index per build
+        <kb>/vector_store/embedding_checkpoints/ batches of an unfinished build
+
+    Builds are written into a fresh version directory that readers never look
+    at; publishing flips CURRENT with an atomic rename. Older versions are kept
+    for rollback. A vector store saved directly into <kb>/vector_store before
+    versioning existed is still readable until the first versioned build.
+    """
+
+    def __init__(self, folder_path):
+        self.root = Path(folder_path) / VECTOR_STORE_DIRNAME
+        self.versions_dir = self.root / VERSIONS_DIRNAME
+        self.pointer_path = self.root / POINTER_FILENAME
+        self.checkpoint_dir = self.root / CHECKPOINTS_DIRNAME
+
+    def current_version(self):
+        """
+        Return the published version name, or None if nothing is published yet.
+        """
+        try:
+            version = self.pointer_path.read_text(encoding="utf-8").strip()
+        except FileNotFoundError:
+            return None
+        return version or None
+
+    def current_path(self):
+        """
+        Return the directory of the published index, falling back to a legacy
+        unversioned index. Returns None if there is no saved index at all.
+        """
+        version = self.current_version()
+        if version:
+            version_dir = self.versions_dir / version
+            if version_dir.is_dir():
+                return version_dir
+            logger.error(f"Published index version '{version}' is missing from {self.versions_dir}")
+        if (self.root / LEGACY_INDEX_FILENAME).exists():
+            return self.root
+        return None
+
+    def versions(self):
+        """
+        Return the names of all complete version directories, oldest first.
+        """
+        if not self.versions_dir.is_dir():
+            return []
+        return sorted(
+            entry.name for entry in self.versions_dir.iterdir()
+            if entry.is_dir() and not entry.name.startswith(".")
+        )
+
+    def create_version(self):
+        """
+        Allocate a new version directory for a build. Names sort by creation time,
+        down to the microsecond, and after the second-resolution names of older builds.
+        Returns (version, path).
+        """
+        version = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:6]}"
+        version_dir = self.versions_dir / version
+        version_dir.mkdir(parents=True, exist_ok=False)
+        return version, version_dir
+
+    def discard_version(self, version):
+        """
+        Remove an unpublished version, e.g. after it failed verification.
+        """
+        if version == self.current_version():
+            raise ValueError(f"Refusing to discard the published index version '{version}'")
+        shutil.rmtree(self.versions_dir / version, ignore_errors=True)
+        logger.info(f"Discarded index version '{version}' in {self.versions_dir}")
+
+    def publish(self, version):
+        """
+        Atomically point CURRENT at version.
+        """
+        if not (self.versions_dir / version).is_dir():
+            raise FileNotFoundError(f"Index version '{version}' does not exist in {self.versions_dir}")
+        tmp_path = self.root / f"{POINTER_FILENAME}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.pointer_path)
+        logger.info(f"Published index version '{version}' for {self.root}")
+
+    def rollback(self):
+        """
+        Re-publish the newest version older than the current one.
+        Returns the version switched to, or None if there is nothing to roll back to.
+        """
+        current = self.current_version()
+        older = [version for version in self.versions() if current is None or version < current]
+        if not older:
+            logger.warning(f"No previous index version to roll back to in {self.versions_dir}")
+            return None
+        self.publish(older[-1])
+        return older[-1]
+
+    def clear_checkpoints(self):
+        """
+        Remove embedding checkpoints once the build that wrote them is published.
+        """
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+    def prune(self, keep):
+        """
+        Delete all but the newest `keep` versions. The published version is always kept.
+        """
+        current = self.current_version()
+        versions = self.versions()
+        for version in versions[:-keep] if keep > 0 else versions:
+            if version == current:
+                continue
+            shutil.rmtree(self.versions_dir / version, ignore_errors=True)
+            logger.info(f"Pruned old index version '{version}' from {self.versions_dir}")
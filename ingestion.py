@@ -0,0 +1,145 @@
+# ingestion.py
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+from index_manifest import file_fingerprint
+from index_storage import VECTOR_STORE_DIRNAME
+from text_cache import extract_pdfs_cached
+
+logger = logging.getLogger(__name__)
+
+INGESTION_FILENAME = "ingestion.json"
+INGESTION_VERSION = 1
+# Characters of a document's text the metadata description is generated from
+METADATA_SAMPLE_CHARS = 2000
+# Version of the metadata description prompt, recorded per file once it is
+# described; bump it when the prompt changes so every file is described again
+DESCRIPTION_PROMPT_VERSION = 2
+
+# Serializes refreshes, so concurrent sessions do not parse the same files twice,
+# and writes, so indexing and a refresh do not drop each other's entries
+_lock = threading.RLock()
+
+
+def ingestion_entry(extraction, fingerprint):
+    """
+    What the ingestion pass over one PDF leaves for the consumers that do not need
+    its chunks: page count, 0-based pages without text, the metadata sample and the
+    table of contents. Call before the pages are normalized.
+    """
+    return dict(
+        fingerprint,
+        pages=len(extraction.pages),
+        empty_pages=[page.page for page in extraction.pages if not page.text.strip()],
+        sample=" ".join(page.text for page in extraction.pages)[:METADATA_SAMPLE_CHARS],
+        toc=extraction.toc,
+    )
+
+
+class IngestionArtifact:
+    """
+    Per-knowledge-base record of the ingestion pass over each PDF, stored as
+    <kb>/vector_store/ingestion.json and keyed by file fingerprint. Indexing fills
+    it as it extracts files; the empty-page scan and metadata extraction read it
+    and only parse the files that are missing or changed (see refresh).
+    """
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        self.path = Path(folder_path) / VECTOR_STORE_DIRNAME / INGESTION_FILENAME
+        self.files = self._load()
+        self._recorded = {}
+        self._forgotten = set()
+
+    def _load(self):
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data["files"] if data.get("version") == INGESTION_VERSION else {}
+        except Exception as e:
+            logger.error(f"Failed to read ingestion artifact '{self.path}': {e}")
+            return {}
+
+    def save(self):
+        """
+        Merge what was recorded or forgotten into the artifact on disk and write it
+        atomically. Does nothing if there is no change.
+        """
+        if not self._recorded and not self._forgotten:
+            return
+        with _lock:
+            files = self._load()
+            files.update(self._recorded)
+            for filename in self._forgotten:
+                files.pop(filename, None)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".json.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": INGESTION_VERSION, "files": files}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        self.files, self._recorded, self._forgotten = files, {}, set()
+        logger.debug(f"Ingestion artifact saved to {self.path}")
+
+    def record(self, extraction, fingerprint):
+        self._set(extraction.filename, ingestion_entry(extraction, fingerprint))
+
+    def forget(self, filenames):
+        for filename in filenames:
+            self.files.pop(filename, None)
+            self._recorded.pop(filename, None)
+            self._forgotten.add(filename)
+
+    def mark_described(self, filename):
+        """
+        Record that filename was described with the current DESCRIPTION_PROMPT_VERSION.
+        """
+        self._set(filename, dict(self.files[filename], described_with=DESCRIPTION_PROMPT_VERSION))
+
+    def described(self, filename):
+        return self.files.get(filename, {}).get("described_with") == DESCRIPTION_PROMPT_VERSION
+
+    def _set(self, filename, entry):
+        self.files[filename] = self._recorded[filename] = entry
+        self._forgotten.discard(filename)
+
+    def refresh(self, filenames):
+        """
+        Bring the entries of filenames up to date, parsing only the files without an
+        entry for their current content, and drop the entries of other files.
+        Files that fail to extract are left out and retried next time. Returns self.
+        """
+        with _lock:
+            self.files = self._load()
+            fingerprints = {
+                filename: file_fingerprint(os.path.join(self.folder_path, filename), self.files.get(filename))
+                for filename in filenames
+            }
+            self.forget([filename for filename in list(self.files) if filename not in fingerprints])
+            stale = [
+                filename for filename, fingerprint in fingerprints.items()
+                if self.files.get(filename, {}).get("sha256") != fingerprint["sha256"]
+            ]
+            if stale:
+                logger.info(f"Ingesting {len(stale)} PDFs of '{self.folder_path}'")
+            stale_fingerprints = {filename: fingerprints[filename] for filename in stale}
+            for extraction in extract_pdfs_cached(self.folder_path, stale_fingerprints):
+                if extraction.ok:
+                    self.record(extraction, fingerprints[extraction.filename])
+            for filename, fingerprint in fingerprints.items():
+                # Unchanged content with a new mtime
+                if filename in self.files and self.files[filename]["mtime"] != fingerprint["mtime"]:
+                    self._set(filename, dict(self.files[filename], **fingerprint))
+            self.save()
+        return self
+
+    def empty_documents(self):
+        """
+        Filenames of the PDFs with one or more pages without text.
+        """
+        return sorted(filename for filename, entry in self.files.items() if entry["empty_pages"])
@@ -0,0 +1,125 @@
+# lexical_index.py
+
+import logging
+import re
+import sqlite3
+import threading
+from pathlib import Path
+
+from search_filter import bitmap_of_positions, restrict_positions
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_FILENAME = "lexical.sqlite3"
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Standard codes and clause numbers: 20.13330, 27751-2014, 9001:2015, 5.4.1. A plain
+# number ("5 storeys") is a query term, not a code
+_CODE_RE = re.compile(r"\d+(?:[.\-:/]\d+)+")
+
+
+def _phrase(words):
+    return '"' + " ".join(word.replace('"', '""') for word in words) + '"'
+
+
+def query_phrases(text):
+    """
+    Split a query into FTS5 phrases: (term_phrases, code_phrases). Codes become
+    phrases of their digit groups, which is how the unicode61 tokenizer indexed
+    them, so "20.13330" matches "СП 20.13330.2016" but not "13330.20".
+    """
+    codes = [_phrase(_WORD_RE.findall(code)) for code in _CODE_RE.findall(text)]
+    words = [_phrase([word]) for word in _WORD_RE.findall(_CODE_RE.sub(" ", text))]
+    return list(dict.fromkeys(words)), list(dict.fromkeys(codes))
+
+
+def build_lexical_index(path, docstore_path):
+    """
+    Build the BM25 index of a saved docstore at path: a contentless FTS5 table
+    keyed by index position, so chunk text is not stored twice.
+    """
+    conn = sqlite3.connect(str(path))
+    try:
+        conn.execute(
+            "CREATE VIRTUAL TABLE lexical USING fts5(text, content='', tokenize='unicode61 remove_diacritics 2')"
+        )
+        conn.execute("ATTACH DATABASE ? AS docstore", (str(docstore_path),))
+        conn.execute("INSERT INTO lexical (rowid, text) SELECT position, text FROM docstore.chunks")
+        conn.commit()
+        conn.execute("DETACH DATABASE docstore")
+        conn.execute("INSERT INTO lexical (lexical) VALUES ('optimize')")
+        conn.commit()
+    finally:
+        conn.close()
+    logger.debug(f"Built lexical index {path}")
+
+
+class LexicalIndex:
+    """
+    Read-only BM25 search over a published lexical.sqlite3. Results are index
+    positions, the same keys the FAISS index and docstore use.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        uri = f"{self.path.resolve().as_uri()}?mode=ro&immutable=1"
+        self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        # Filter bitmap of the running query, read by the allowed() SQL function
+        self._allowed = None
+        self._conn.create_function("allowed", 1, self._is_allowed, deterministic=True)
+
+    def _is_allowed(self, position):
+        byte = position >> 3
+        return byte < len(self._allowed) and (int(self._allowed[byte]) >> (position & 7)) & 1
+
+    def _query(self, sql, params=(), allowed=None):
+        with self._lock:
+            self._allowed = allowed
+            try:
+                return self._conn.execute(sql, params).fetchall()
+            finally:
+                self._allowed = None
+
+    def _match(self, columns, match, limit, positions, allowed):
+        sql = f"SELECT {columns} FROM lexical WHERE lexical MATCH ?"
+        params = [match]
+        if positions is not None:
+            # One bitmap instead of a bound parameter per position, which would run
+            # into SQLite's limit on the number of variables
+            positions = restrict_positions([int(position) for position in positions], allowed)
+            if not positions:
+                return []
+            allowed = bitmap_of_positions(positions, max(positions) + 1)
+        if allowed is not None:
+            sql += " AND allowed(rowid)"
+        sql += " ORDER BY bm25(lexical) LIMIT ?"
+        return self._query(sql, params + [limit], allowed)
+
+    def search(self, query_text, k, positions=None, allowed=None):
+        """
+        BM25 search for any query term or code, optionally restricted to positions
+        and to the positions set in the packed bitmap allowed, both applied inside
+        the query so a full k is returned. Returns [(position, score)], best first,
+        with scores positive (higher is better).
+        """
+        terms, codes = query_phrases(query_text)
+        if not terms and not codes:
+            return []
+        rows = self._match("rowid, bm25(lexical)", " OR ".join(codes + terms), k, positions, allowed)
+        return [(position, -score) for position, score in rows]
+
+    def code_matches(self, query_text, limit, positions=None, allowed=None):
+        """
+        Positions of chunks containing every standard code or clause number of the
+        query, best BM25 match first, restricted like search. Returns [] when the
+        query has no codes.
+        """
+        _, codes = query_phrases(query_text)
+        if not codes:
+            return []
+        return [row[0] for row in self._match("rowid", " AND ".join(codes), limit, positions, allowed)]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -7,6 +7,7 @@ import asyncio
 import datetime
 import hashlib
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from langdetect import detect
 
@@ -22,8 +23,6 @@ from langchain_core.prompts import (
 )
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import PyMuPDFLoader
-from langchain.text_splitter import CharacterTextSplitter
 from langchain.schema import Document
 from langchain.chains.combine_documents import create_stuff_documents_chain
 import tiktoken
@@ -32,9 +31,34 @@ from pymupdf.mupdf import ll_pdf_lookup_substitute_font_outparams
 import text
 from db_service import DatabaseService
 from settings import OPENAI_API_KEY, MODEL_NAME, CHAT_HISTORY_LEVEL, DOCS_IN_RETRIEVER, RELEVANCE_THRESHOLD_DOCS, \
-    RELEVANCE_THRESHOLD_PROMPT
+    RELEVANCE_THRESHOLD_PROMPT, INDEX_COMPACTION_RATIO, INDEX_VERSIONS_TO_KEEP, VECTOR_STORE_METRIC, \
+    INDEX_RETRAIN_GROWTH, INDEX_BUILD_QUEUE_WINDOWS, INDEX_TRAINING_SAMPLE
 from decorators import log_errors
 from helpers import current_timestamp, parser_html, get_language_name
+from vector_store_registry import vector_store_registry
+from index_manifest import IndexManifest, make_chunk_ids
+from index_storage import IndexStorage
+from ingestion import IngestionArtifact
+from text_cache import extract_pdfs_cached
+from chunking import chunk_pages, chunker_signature
+from dedup import NEAR_DUPLICATES_FILENAME, NearDuplicateIndex, add_reference, chunk_references, drop_references
+from normalization import normalize_pages
+from pipeline import bounded_stream, windows
+from retrieval import federated_search
+from permissions import document_permissions
+from search_filter import SearchFilter, has_filter_metadata
+from faiss_index import (
+    METRIC_COSINE, IndexSpec, add_to_vector_store, configure_vector_store, create_vector_store, delete_from_store,
+    close_vector_store, compact_vector_store, has_current_layout, index_metric, index_spec_for, load_faiss_store, rebuild_index,
+    save_faiss_store,
+)
+from docstore import DOCSTORE_FILENAME
+from document_index import (
+    DOCUMENT_INDEX_FILENAME, description_text, descriptions_fingerprint, read_fingerprint, write_document_index
+)
+from embedding_service import (
+    BatchEmbedder, CachedEmbeddings, embedding_model_name, get_embedding_cache, query_embedding_lru
+)
 from pathlib import Path
 import logging
 
@@ -46,115 +70,539 @@ class LLMService:
     def __init__(self, model_name=MODEL_NAME):
         try:
             self.llm = ChatOpenAI(openai_api_key=OPENAI_API_KEY, model_name=model_name)
-            self.embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
-            self.vector_store = None
-            self.knowledge_base_language = None
+            self.embeddings = CachedEmbeddings(
+                OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY), get_embedding_cache()
+            )
             logger.info(f"LLMService initialized with model '{model_name}'.")
         except Exception as e:
             logger.exception(f"Failed to initialize LLMService: {str(e)}")
             raise
 
-    def _get_vector_store_path(self, folder_path):
+    def save_vector_store(self, vector_store, folder_path, manifest):
         """
-        Generate the vector store directory path within the knowledge base folder.
+        Save the vector store and its manifest as a new index version of the knowledge
+        base, verify it, then publish it. The previously published version stays on
+        disk for rollback. The near-duplicate signatures of an update are saved along,
+        for the next update to load. Returns the published version name.
         """
-        return Path(folder_path) / "vector_store"
-
-    def save_vector_store(self, folder_path):
-        """
-        Save the current vector store to disk within the specified knowledge base folder.
-        """
-        vector_store_dir = self._get_vector_store_path(folder_path)
+        storage = IndexStorage(folder_path)
+        version, version_dir = storage.create_version()
         try:
-            vector_store_dir.mkdir(parents=True, exist_ok=True)
-            if hasattr(self, 'vector_store') and self.vector_store:
-                self.vector_store.save_local(str(vector_store_dir))
-                logger.info(f"Vector store saved to {vector_store_dir}")
-            else:
-                logger.warning("No vector_store attribute found or it is None.")
+            save_faiss_store(vector_store, version_dir)
+            duplicates = getattr(vector_store, "near_duplicates", None)
+            if duplicates is not None:
+                duplicates.save_signatures(
+                    Path(version_dir) / NEAR_DUPLICATES_FILENAME, vector_store.index_to_docstore_id.values()
+                )
+            self._write_document_index(version_dir, folder_path)
+            manifest.save(version_dir)
+            self._verify_saved_vector_store(version_dir, manifest)
         except Exception as e:
-            logger.error(f"Failed to save vector store to {vector_store_dir}: {e}")
+            logger.error(f"Failed to save vector store version '{version}' for '{folder_path}': {e}")
+            storage.discard_version(version)
             raise
 
-    @log_errors(default_return=(False, "An error occurred while indexing documents."))
-    def load_vector_store(self, folder_path):
+        storage.publish(version)
+        storage.prune(keep=INDEX_VERSIONS_TO_KEEP)
+        logger.info(f"Vector store saved to {version_dir}")
+        return version
+
+    def _document_descriptions(self, folder_path):
         """
-        Load a saved vector store from disk within the specified knowledge base folder.
+        Return {filename: metadata} for the described PDFs of folder_path from
+        documents_server (see get_metadata), or None if the database is unavailable.
         """
-        vector_store_dir = self._get_vector_store_path(folder_path)
-        if vector_store_dir.exists() and vector_store_dir.is_dir():
-            try:
-                # ⚠️ Security Warning: Ensure the vector store is from a trusted source before enabling dangerous deserialization.
-                self.vector_store = FAISS.load_local(
-                    str(vector_store_dir),
-                    self.embeddings,
-                    allow_dangerous_deserialization=True  # Enable dangerous deserialization
-                )
-                logger.info(f"Loaded vector store from {vector_store_dir}")
-                return True
-            except Exception as e:
-                logger.error(f"Failed to load vector store from {vector_store_dir}: {str(e)}")
-                return False
-        else:
-            logger.info(f"No saved vector store found in {vector_store_dir}")
+        paths = {os.path.join(folder_path, filename): filename for filename in self._list_pdf_files(folder_path)}
+        rows = DatabaseService().get_document_descriptions(list(paths))
+        if rows is None:
+            return None
+        return {
+            paths[path]: metadata for path, metadata in sorted(rows.items())
+            if metadata.get("description") or metadata.get("document_type")
+        }
+
+    def _write_document_index(self, version_dir, folder_path):
+        """
+        Embed the document descriptions of folder_path into the document-level index
+        of an index version. Without the database the index is written empty and
+        filled on a later load (see _document_index_stale).
+        """
+        descriptions = self._document_descriptions(folder_path) or {}
+        texts = [description_text(source, metadata) for source, metadata in descriptions.items()]
+        vectors = self.embeddings.embed_documents(texts) if texts else []
+        write_document_index(
+            Path(version_dir) / DOCUMENT_INDEX_FILENAME, descriptions, vectors, Path(version_dir) / DOCSTORE_FILENAME
+        )
+        logger.info(f"Indexed {len(descriptions)} document descriptions for '{folder_path}'")
+
+    def _document_index_stale(self, folder_path, vector_store_dir):
+        """
+        Whether the descriptions in documents_server changed since the document index
+        of vector_store_dir was built. An unavailable database is not a change.
+        """
+        descriptions = self._document_descriptions(folder_path)
+        if descriptions is None:
             return False
+        return read_fingerprint(Path(vector_store_dir) / DOCUMENT_INDEX_FILENAME) != descriptions_fingerprint(descriptions)
 
-    @log_errors(default_return=(False, "An error occurred while indexing documents."))
-    def load_and_index_documents(self, folder_path, knowledge_base_language):
+    def _verify_saved_vector_store(self, vector_store_dir, manifest):
         """
-        Load and index documents from the specified folder_path.
-        If a saved vector store exists, load it. Otherwise, load documents, index them, and save the vector store.
-        Returns a tuple (success: bool, message: str).
+        Reload a freshly written index and check that the index, its docstore and the
+        manifest agree before the version is published. Raises ValueError on mismatch.
         """
+        vector_store = self._read_vector_store(vector_store_dir, read_only=True)
         try:
-            logger.debug(f"Starting load_and_index_documents for folder_path='{folder_path}'")
-            # Set knowledge_base_language
-            self.knowledge_base_language = knowledge_base_language
-            # Check if vector store already exists
-            if self.load_vector_store(folder_path):
-                logger.info(f"Vector store loaded from existing files in '{folder_path}'")
-                return (True, "Vector store loaded from existing files.")
+            ntotal = vector_store.index.ntotal
+            live = ntotal - vector_store.tombstones
+            stored_ids = set(vector_store.index_to_docstore_id.values())
+            if live != len(stored_ids) or live != manifest.chunk_count:
+                raise ValueError(
+                    f"Index verification failed in {vector_store_dir}: {ntotal} vectors "
+                    f"({vector_store.tombstones} deleted), {len(stored_ids)} docstore ids, "
+                    f"{manifest.chunk_count} manifest chunks"
+                )
+            if vector_store.exact_vectors is not None and len(vector_store.exact_vectors) != ntotal:
+                raise ValueError(
+                    f"Index verification failed in {vector_store_dir}: {len(vector_store.exact_vectors)} exact vectors "
+                    f"for {ntotal} index vectors"
+                )
+            for entry in manifest.files.values():
+                for chunk_id in entry["chunk_ids"]:
+                    if chunk_id not in stored_ids:
+                        raise ValueError(f"Index verification failed in {vector_store_dir}: missing chunk '{chunk_id}'")
+        finally:
+            close_vector_store(vector_store)
+
+    def _read_vector_store(self, vector_store_dir, index_spec=None, read_only=False):
+        # ⚠️ Security Warning: stores saved before the SQLite docstore are unpickled; ensure they come from a trusted source.
+        vector_store = load_faiss_store(vector_store_dir, self.embeddings, read_only=read_only)
+        return configure_vector_store(vector_store, index_spec)
+
+    @log_errors(default_return=(None, None))
+    def load_vector_store(self, folder_path, read_only=False):
+        """
+        Load the published vector store version of the specified knowledge base folder.
+        A read-only store is for serving: it loads in milliseconds (memory-mapped index,
+        documents read on demand) but cannot be updated.
+        Returns a tuple (vector_store, manifest); both are None if there is no usable saved store.
+        The manifest is None for stores saved before manifests existed.
+        """
+        vector_store_dir = IndexStorage(folder_path).current_path()
+        if vector_store_dir is None:
+            logger.info(f"No saved vector store found for '{folder_path}'")
+            return None, None
+        try:
+            vector_store = self._read_vector_store(vector_store_dir, index_spec_for(folder_path), read_only=read_only)
+            logger.info(f"Loaded vector store from {vector_store_dir}{' (memory-mapped)' if vector_store.memory_mapped else ''}")
+            return vector_store, IndexManifest.load(vector_store_dir)
+        except Exception as e:
+            logger.error(f"Failed to load vector store from {vector_store_dir}: {str(e)}")
+            return None, None
 
-            documents = []
-            found_valid_file = False
+    @property
+    def embedding_model(self):
+        return embedding_model_name(self.embeddings)
 
-            for filename in os.listdir(folder_path):
-                file_path = os.path.join(folder_path, filename)
+    def _list_pdf_files(self, folder_path):
+        return sorted(
+            filename for filename in os.listdir(folder_path)
+            if filename.lower().endswith(".pdf") and os.path.isfile(os.path.join(folder_path, filename))
+        )
 
-                if filename.lower().endswith(".pdf"):
-                    try:
-                        loader = PyMuPDFLoader(file_path)
-                        docs = loader.load()
-                        for doc in docs:
-                            doc.metadata["source"] = filename
-                            documents.append(doc)
-                        found_valid_file = True
-                        logger.info(f"Loaded PDF document: {filename}")
-                    except Exception as e:
-                        logger.error(f"Error loading PDF file '{filename}': {str(e)}")
+    def _split_pages(self, pages):
+        """
+        Split normalized page records into chunks tagged with source filename and page.
+        """
+        return chunk_pages(pages)
 
-                else:
-                    logger.debug(f"Skipped unsupported file type: {filename}")
+    def _duplicate_index(self, vector_store, manifest, saved_dir=None):
+        """
+        NearDuplicateIndex of the indexed chunks, keyed by (chunk id, file owning it),
+        for new chunks to be collapsed into (see _collapse_duplicates). Signatures
+        saved with the index version in saved_dir are loaded; only the chunks without
+        one (all of them for versions saved before signatures were) are MinHashed.
+        """
+        duplicates = NearDuplicateIndex()
+        if vector_store is None:
+            return duplicates
+        owners = {chunk_id: filename for filename, entry in manifest.files.items() for chunk_id in entry["chunk_ids"]}
+        chunk_ids = list(vector_store.index_to_docstore_id.values())
+        loaded = set()
+        if saved_dir is not None:
+            loaded = duplicates.load_signatures(Path(saved_dir) / NEAR_DUPLICATES_FILENAME, owners, chunk_ids)
+        missing = [chunk_id for chunk_id in chunk_ids if chunk_id not in loaded]
+        for chunk_id in missing:
+            duplicates.add((chunk_id, owners.get(chunk_id)), vector_store.docstore.search(chunk_id).page_content)
+        if missing:
+            logger.info(f"Computed near-duplicate signatures of {len(missing)} indexed chunks")
+        return duplicates
+
+    def _collapse_duplicates(self, duplicates, manifest, new_chunks, new_chunk_ids, references):
+        """
+        Drop the new chunks of a file that near-duplicate an indexed chunk or a new one
+        streamed in before (see dedup.NearDuplicateIndex), and index the rest. The
+        source and page of each dropped copy are added to references ({kept chunk id:
+        [(source, page)]}, see _add_references), and a file whose copy was kept under
+        another file's chunk lists that chunk id in its manifest "shared_ids".
+        Returns the new chunks and ids to embed.
+        """
+        kept_chunks, kept_ids = [], []
+        for chunk, chunk_id in zip(new_chunks, new_chunk_ids):
+            source = chunk.metadata["source"]
+            original = duplicates.match((chunk_id, source), chunk.page_content)
+            if original is None:
+                kept_chunks.append(chunk)
+                kept_ids.append(chunk_id)
+                continue
+            original_id, owner = original
+            references.setdefault(original_id, []).append((source, chunk.metadata.get("page")))
+            entry = manifest.files[source]
+            entry["chunk_ids"].remove(chunk_id)
+            if owner != source and original_id not in entry.setdefault("shared_ids", []):
+                entry["shared_ids"].append(original_id)
+        return kept_chunks, kept_ids
+
+    def _add_references(self, vector_store, references):
+        """
+        Record on each kept chunk the sources and pages of the copies collapsed into it.
+        """
+        for chunk_id, copies in references.items():
+            document = vector_store.docstore.search(chunk_id)
+            for source, page in copies:
+                add_reference(document, source, page)
+            vector_store.docstore.update(chunk_id, document)
 
-            if not found_valid_file:
-                logger.warning("No valid files found in the folder. Please provide PDF, Word, or Excel files.")
-                return (False, "No valid files found in the folder. Please provide PDF, Word, or Excel files.")
+    def _release_files(self, vector_store, manifest, filenames):
+        """
+        Remove filenames from the manifest and their references from the chunks they
+        share with other files. A chunk of theirs that another file still has a copy
+        of is handed over to that file. Returns the ids of the chunks left without any
+        source, to delete from the store.
+        """
+        released = {filename: manifest.files.pop(filename) for filename in filenames if filename in manifest.files}
+        docstore = vector_store.docstore if vector_store is not None else None
+
+        def document_of(chunk_id):
+            document = docstore.search(chunk_id) if docstore is not None else None
+            return document if isinstance(document, Document) else None
+
+        for entry in released.values():
+            for chunk_id in entry.get("shared_ids", []):
+                document = document_of(chunk_id)
+                if document is not None:
+                    drop_references(document, released)
+                    docstore.update(chunk_id, document)
+
+        stale_ids = []
+        for entry in released.values():
+            for chunk_id in entry["chunk_ids"]:
+                document = document_of(chunk_id)
+                if document is None or not drop_references(document, released):
+                    stale_ids.append(chunk_id)
+                    continue
+                docstore.update(chunk_id, document)
+                heir = manifest.files.get(document.metadata["source"])
+                if heir is None:
+                    stale_ids.append(chunk_id)
+                    continue
+                if chunk_id in heir.get("shared_ids", []):
+                    heir["shared_ids"].remove(chunk_id)
+                heir["chunk_ids"].append(chunk_id)
+        return stale_ids
 
-            text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-            split_docs = text_splitter.split_documents(documents)
-            logger.info(f"Split documents into {len(split_docs)} chunks.")
+    def _compact_vector_store(self, vector_store):
+        """
+        Release the memory deletions leave behind and drop the tombstones of an HNSW index.
+        """
+        tombstones = vector_store.tombstones
+        compact_vector_store(vector_store)
+        logger.info(f"Compacted vector store ({vector_store.index.ntotal} vectors, {tombstones} tombstones dropped)")
+
+    def _stream_chunks(self, folder_path, fingerprints, manifest, ingestion, duplicates, references):
+        """
+        Index build stages before embedding, one file at a time: extract (or read from
+        the text cache), record in the ingestion artifact, normalize, chunk and collapse
+        near-duplicates. Adds the files to the manifest and yields (chunks, chunk ids)
+        to embed per file.
+        """
+        raw_tokens = tokens = 0
+        chunk_count = kept_count = 0
+        try:
+            for extraction in extract_pdfs_cached(folder_path, fingerprints):
+                if not extraction.ok:
+                    # Left out of the manifest so it is retried on the next update
+                    continue
+                filename = extraction.filename
+                fingerprint = fingerprints[filename]
+                # The same pass records empty pages, metadata samples and outlines
+                ingestion.record(extraction, fingerprint)
+                language = self.detect_language(" ".join(page.text for page in extraction.pages[:3])[:2000])
+                file_raw_tokens, file_tokens = normalize_pages(extraction.pages, language)
+                raw_tokens, tokens = raw_tokens + file_raw_tokens, tokens + file_tokens
+                chunks = self._split_pages(extraction.pages)
+                logger.info(f"Loaded PDF document: {filename}")
+
+                chunk_ids = make_chunk_ids(filename, fingerprint["sha256"], len(chunks))
+                manifest.files[filename] = dict(
+                    fingerprint, chunk_ids=list(chunk_ids), tokens=[file_raw_tokens, file_tokens]
+                )
+                # Near-duplicates of indexed or earlier new chunks are not embedded at all
+                chunk_count += len(chunks)
+                chunks, chunk_ids = self._collapse_duplicates(duplicates, manifest, chunks, chunk_ids, references)
+                kept_count += len(chunks)
+                yield chunks, chunk_ids
+        finally:
+            ingestion.save()
+        if raw_tokens:
+            logger.info(
+                f"Normalization of '{folder_path}' cut {raw_tokens} tokens to {tokens} "
+                f"({1 - tokens / raw_tokens:.1%} saved)"
+            )
+        if chunk_count:
+            logger.info(f"Collapsed {chunk_count - kept_count} of {chunk_count} new chunks into near-duplicates")
 
-            self.vector_store = FAISS.from_documents(split_docs, self.embeddings)
-            logger.info("Documents successfully indexed.")
+    def _start_vector_store(self, training, index_spec, manifest):
+        """
+        Create the vector store of a new index from the first embedded windows, which
+        it is trained on when index_spec needs training.
+        """
+        ids = [chunk_id for _, _, chunk_ids in training for chunk_id in chunk_ids]
+        vector_store = create_vector_store(
+            [pair for text_embeddings, _, _ in training for pair in text_embeddings], self.embeddings,
+            metadatas=[metadata for _, metadatas, _ in training for metadata in metadatas], ids=ids, spec=index_spec,
+        )
+        manifest.index = dict(index_spec.to_dict(), trained_on=len(ids))
+        return vector_store
 
-            # Save the newly created vector store
-            self.save_vector_store(folder_path)
+    def update_vector_store(self, folder_path, vector_store=None, manifest=None, force_save=False):
+        """
+        Bring the vector store for folder_path in line with the PDFs in the folder.
+        Only new or changed files are parsed and embedded, and chunks of changed or
+        deleted files are removed. With no vector store and manifest this is a full build.
+        Any change is saved and published as a new index version; force_save publishes
+        a version even when nothing changed.
+        Returns the updated vector store, or raises ValueError if the folder has no valid files.
+        """
+        filenames = self._list_pdf_files(folder_path)
+        if not filenames:
+            raise ValueError("No valid files found in the folder. Please provide PDF, Word, or Excel files.")
 
-            return (True, "Documents successfully indexed and vector store saved.")
+        index_spec = index_spec_for(folder_path)
+        if manifest is None or manifest.embedding_model != self.embedding_model:
+            if manifest is not None:
+                logger.info(
+                    f"Embedding model changed from '{manifest.embedding_model}' to "
+                    f"'{self.embedding_model}'; rebuilding '{folder_path}'"
+                )
+            vector_store = None
+            manifest = IndexManifest(embedding_model=self.embedding_model, chunker=chunker_signature())
+        elif manifest.chunker != chunker_signature():
+            logger.info(f"Chunking changed from '{manifest.chunker}' to '{chunker_signature()}'; rebuilding '{folder_path}'")
+            vector_store = None
+            manifest = IndexManifest(embedding_model=self.embedding_model, chunker=chunker_signature())
+
+        diff = manifest.diff(folder_path, filenames)
+        logger.info(f"Index manifest diff for '{folder_path}': {diff}")
+        if vector_store is not None and not diff.has_changes and not force_save:
+            return vector_store
+
+        # Drop the vectors of files that were changed or deleted
+        storage = IndexStorage(folder_path)
+        stale_ids = self._release_files(vector_store, manifest, diff.changed + diff.removed)
+        if stale_ids and vector_store is not None:
+            delete_from_store(vector_store, stale_ids)
+            manifest.deleted_since_compaction += len(stale_ids)
+            logger.info(f"Removed {len(stale_ids)} stale chunks from '{folder_path}'")
+
+        # Stream the new or changed files through extraction, normalization, chunking
+        # and near-duplicate collapsing in a background stage, and embed and add the
+        # chunks here window by window, so memory stays flat whatever the folder size
+        ingestion = IngestionArtifact(folder_path)
+        ingestion.forget(diff.removed)
+        to_parse = {filename: diff.fingerprints[filename] for filename in diff.added + diff.changed}
+        duplicates = self._duplicate_index(vector_store, manifest, storage.current_path())
+        references = {}
+        embedder = BatchEmbedder(self.embeddings)
+        chunk_windows = windows(
+            self._stream_chunks(folder_path, to_parse, manifest, ingestion, duplicates, references),
+            embedder.batch_size * embedder.max_concurrency,
+        )
+        training = []  # windows held back to train a new index on
+        for chunks, chunk_ids in bounded_stream(chunk_windows, INDEX_BUILD_QUEUE_WINDOWS, name="index-build"):
+            # Concurrent batches, checkpointed so an interrupted build resumes
+            texts = [chunk.page_content for chunk in chunks]
+            vectors = embedder.embed_texts(texts, checkpoint_dir=storage.checkpoint_dir)
+            window = (list(zip(texts, vectors)), [chunk.metadata for chunk in chunks], chunk_ids)
+            if vector_store is not None:
+                add_to_vector_store(vector_store, *window)
+                continue
+            training.append(window)
+            if not index_spec.needs_training or sum(len(ids) for _, _, ids in training) >= INDEX_TRAINING_SAMPLE:
+                vector_store = self._start_vector_store(training, index_spec, manifest)
+                training = []
+        if training:
+            vector_store = self._start_vector_store(training, index_spec, manifest)
+        if vector_store is not None:
+            self._add_references(vector_store, references)
+            vector_store.near_duplicates = duplicates
+        cache = getattr(self.embeddings, "cache", None)
+        if cache is not None and to_parse:
+            logger.info(f"Embedding cache stats: {cache.stats()}")
+
+        # Files whose content is unchanged may still have a new mtime
+        for filename, fingerprint in diff.fingerprints.items():
+            if filename in manifest.files:
+                manifest.files[filename].update(fingerprint)
+
+        if vector_store is None or vector_store.index.ntotal == 0:
+            raise ValueError("No valid files found in the folder. Please provide PDF, Word, or Excel files.")
+
+        ntotal = vector_store.index.ntotal
+        trained_on = (manifest.index or {}).get("trained_on")
+        if (
+            index_spec.needs_training and trained_on and trained_on < INDEX_TRAINING_SAMPLE
+            and ntotal > INDEX_RETRAIN_GROWTH * trained_on
+        ):
+            # Centroids trained on a much smaller corpus no longer partition it well
+            trained_on = rebuild_index(vector_store, index_spec)
+            manifest.index = dict(index_spec.to_dict(), trained_on=trained_on)
+
+        if manifest.deleted_since_compaction > INDEX_COMPACTION_RATIO * ntotal:
+            self._compact_vector_store(vector_store)
+            manifest.deleted_since_compaction = 0
+
+        logger.info(f"Documents successfully indexed ({ntotal} chunks in {len(manifest.files)} files).")
+        self.save_vector_store(vector_store, folder_path, manifest)
+        storage.clear_checkpoints()
+        return vector_store
+
+    def _load_or_build_vector_store(self, folder_path):
+        """
+        Registry loader: load the published vector store of the folder and re-index
+        whatever changed since it was saved, or build it from scratch.
+        """
+        # Serve an up-to-date published index read-only, straight from its files
+        vector_store, manifest = self.load_vector_store(folder_path, read_only=True)
+        if vector_store is not None:
+            if not self._needs_update(folder_path, vector_store, manifest):
+                return vector_store
+            close_vector_store(vector_store)
+
+        vector_store, manifest = self.load_vector_store(folder_path)
+        force_save = False
+        if vector_store is not None:
+            logger.info(f"Vector store loaded from existing files in '{folder_path}'")
+            current_path = IndexStorage(folder_path).current_path()
+            if not has_current_layout(current_path):
+                # Re-publish with the files older versions lack (SQLite docstore, BM25, identifier and document indexes)
+                force_save = True
+            elif self._document_index_stale(folder_path, current_path):
+                # Document descriptions were (re-)analysed since the version was published
+                force_save = True
+            if manifest is None:
+                # Migrate a pre-manifest store into the versioned layout without re-embedding
+                manifest = IndexManifest.from_vector_store(
+                    vector_store, self.embedding_model, folder_path, self._list_pdf_files(folder_path)
+                )
+                force_save = True
+            # Rebuild from the stored vectors if the configured index type or metric changed
+            index_spec, metric, layout_changed = self._index_layout(folder_path, vector_store, manifest)
+            if layout_changed:
+                trained_on = rebuild_index(vector_store, index_spec, metric)
+                manifest.index = dict(index_spec.to_dict(), trained_on=trained_on)
+                force_save = True
+        vector_store = self.update_vector_store(folder_path, vector_store, manifest, force_save=force_save)
+        published_store, _ = self.load_vector_store(folder_path, read_only=True)
+        if published_store is None:
+            return vector_store
+        close_vector_store(vector_store)
+        return published_store
+
+    def _index_layout(self, folder_path, vector_store, manifest):
+        """
+        Return (index_spec, metric, changed): the configured index spec and metric
+        for folder_path, and whether the loaded store was built differently.
+        """
+        index_spec = index_spec_for(folder_path)
+        current_metric = index_metric(vector_store.index)
+        metric = METRIC_COSINE if VECTOR_STORE_METRIC == METRIC_COSINE else current_metric
+        built_spec = IndexSpec.from_dict(manifest.index if manifest else None)
+        return index_spec, metric, metric != current_metric or built_spec.structure != index_spec.structure
+
+    def _needs_update(self, folder_path, vector_store, manifest):
+        """
+        Whether the published store must be re-indexed, migrated or rebuilt before use.
+        """
+        if manifest is None or manifest.embedding_model != self.embedding_model:
+            return True
+        if manifest.chunker != chunker_signature():
+            return True
+        current_path = IndexStorage(folder_path).current_path()
+        if not has_current_layout(current_path) or self._document_index_stale(folder_path, current_path):
+            return True
+        if self._index_layout(folder_path, vector_store, manifest)[2]:
+            return True
+        return manifest.diff(folder_path, self._list_pdf_files(folder_path)).has_changes
+
+    def _load_published_vector_store(self, folder_path):
+        """
+        Registry reloader: load the published version as-is, without re-indexing,
+        so a rollback is not immediately rebuilt over.
+        """
+        vector_store, _ = self.load_vector_store(folder_path, read_only=True)
+        if vector_store is None:
+            raise ValueError(f"No published vector store for '{folder_path}'")
+        return vector_store
+
+    def _folder_changed(self, folder_path):
+        """
+        Registry change probe: whether PDFs of folder_path were added, changed or
+        removed since its published version was built. Only files with a new mtime
+        or size are hashed (see IndexManifest.diff).
+        """
+        vector_store_dir = IndexStorage(folder_path).current_path()
+        manifest = IndexManifest.load(vector_store_dir) if vector_store_dir is not None else None
+        if manifest is None:
+            return True
+        return manifest.diff(folder_path, self._list_pdf_files(folder_path)).has_changes
+
+    def reindex_knowledge_base(self, folder_path):
+        """
+        Re-index a knowledge base out of band (e.g. from the admin tools) and publish
+        the result. Running sessions pick up the new version on their next query.
+        Returns the published version name.
+        """
+        self._load_or_build_vector_store(folder_path)
+        return IndexStorage(folder_path).current_version()
+
+    @log_errors(default_return=(False, "An error occurred while indexing documents.", None))
+    def load_and_index_documents(self, folder_path, knowledge_base_language):
+        """
+        Acquire the shared index for folder_path from the vector store registry,
+        loading or building it on first use.
+        Returns a tuple (success: bool, message: str, knowledge_base: KnowledgeBaseHandle or None).
+        """
+        try:
+            logger.debug(f"Starting load_and_index_documents for folder_path='{folder_path}'")
+            knowledge_base = vector_store_registry.acquire(
+                folder_path,
+                knowledge_base_language,
+                self._load_or_build_vector_store,
+                version_probe=IndexStorage(folder_path).current_version,
+                reloader=self._load_published_vector_store,
+                change_probe=self._folder_changed,
+            )
+            return (True, "Knowledge base is ready.", knowledge_base)
 
         except Exception as e:
             logger.error(f"Error during load_and_index_documents: {str(e)}")
-            return (False, str(e))
+            return (False, str(e), None)
+
+    def embed_query(self, text):
+        """
+        Embed a query through the process-wide LRU of recent query embeddings.
+        """
+        return query_embedding_lru.get_or_embed(self.embeddings, text)
 
     def detect_language(self, text):
         try:
@@ -181,13 +629,63 @@ class LLMService:
             logger.error(f"Error translating text: {e}")
             return text  # Return the original text if translation fails
 
+    def translate_prompt(self, prompt, user_language, target_languages):
+        """
+        Return {language: prompt in that language} for each target language,
+        translating concurrently where the user's language differs.
+        """
+        pending = [language for language in target_languages if language.lower() != user_language.lower()]
+        translations = {language: prompt for language in target_languages if language not in pending}
+        if pending:
+            with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+                translated = pool.map(lambda language: self.translate_text(prompt, language), pending)
+                translations.update(zip(pending, translated))
+            logger.info(f"Translated prompt from {user_language} to {', '.join(pending)}")
+        return translations
+
+    def _visible_references(self, chunks, hidden_sources):
+        """
+        {filename: pages} the chunks cite, including the copies collapsed into them,
+        without the files hidden_sources ({vector store: filenames}) hides in the
+        knowledge base each chunk was found in. A file of the same name may be
+        visible in another knowledge base.
+        """
+        references = {}
+        for chunk in chunks:
+            hidden = hidden_sources.get(chunk.vector_store, ())
+            for filename, page in chunk_references(chunk.document):
+                if filename in hidden:
+                    continue
+                filename = filename or "Unknown"
+                if filename not in references:
+                    references[filename] = set()
+                references[filename].add(page if page is not None else "Unknown")
+        return references
+
+    def _answer_in(self, answer, knowledge_base_language, user_language):
+        """
+        Translate a fixed answer back to the user's language if necessary.
+        """
+        if user_language.lower() == knowledge_base_language.lower():
+            return answer
+        translated_answer = self.translate_text(answer, user_language)
+        logger.info(f"Translated answer from {knowledge_base_language} to {user_language}")
+        return translated_answer
+
     @log_errors(default_return=("An error occurred while generating a response.", None))
-    def generate_response(self, prompt, chat_history=None):
+    def generate_response(self, prompt, knowledge_base, chat_history=None, search_filter=None, user_id=None):
         """
-        Generate a response to the user's prompt using the LLM and the vector store.
+        Generate a response to the user's prompt using the LLM and the knowledge bases
+        referenced by the given KnowledgeBaseHandle or KnowledgeBaseGroup. Attached
+        knowledge bases are searched concurrently, each in its own language; the
+        answer is written in the language of the primary one. An optional SearchFilter
+        restricts retrieval to matching documents; with a user_id, documents of projects
+        the user is not a member of are excluded from the search as well.
         Returns a tuple (response: str, source_files: list or None, suggestions: list or None)
         """
-        if not hasattr(self, 'vector_store') or self.vector_store is None:
+        handles = knowledge_base.handles if knowledge_base else []
+        vector_stores = [handle.vector_store for handle in handles]
+        if not vector_stores or any(vector_store is None for vector_store in vector_stores):
             logger.warning("Vector store is not loaded. Prompting to set the folder path and load documents.")
             return (
                 "Please set the folder path using /folder and ensure documents are loaded.",
@@ -195,50 +693,76 @@ class LLMService:
                 None
             )
 
-        if not hasattr(self, 'knowledge_base_language') or not self.knowledge_base_language:
+        knowledge_base_language = knowledge_base.language
+        if not all(handle.language for handle in handles):
             logger.error("Knowledge base language not set.")
             return ("Knowledge base language not set.", None, None)
 
+        # Documents hidden from the user by project permissions, per knowledge base
+        search_filters = [search_filter] * len(handles)
+        hidden_sources = {}
+        if user_id is not None:
+            hidden = [document_permissions.hidden_sources(user_id, handle.folder_path) for handle in handles]
+            if any(sources is None for sources in hidden):
+                logger.error(f"Document permissions unavailable for user_id={user_id}; not searching.")
+                return ("Document permissions are temporarily unavailable. Please try again later.", None, None)
+            hidden_sources = {vector_store: set(sources) for vector_store, sources in zip(vector_stores, hidden)}
+            search_filters = [
+                (search_filter or SearchFilter()).hiding(sources) if sources else search_filter for sources in hidden
+            ]
+
         # Detect the language of the user's prompt
         user_language = self.detect_language(prompt)
         logger.info(f"Detected user language: {user_language}")
 
-        # Check if user's language is different from knowledge base language
-        if user_language.lower() != self.knowledge_base_language.lower():
-            # Translate the prompt to the knowledge base language
-            translated_prompt = self.translate_text(prompt, self.knowledge_base_language)
-            logger.info(f"Translated prompt from {user_language} to {self.knowledge_base_language}")
-        else:
-            translated_prompt = prompt
+        # Type and language filters match nothing where documents have no descriptions
+        undescribed = [
+            handle.folder_path for handle, vector_store in zip(handles, vector_stores)
+            if not has_filter_metadata(vector_store, search_filter)
+        ]
+        if len(undescribed) == len(handles):
+            logger.info(f"{search_filter} cannot be applied without document descriptions in {undescribed}")
+            answer = (
+                "The document type and language filters need document descriptions, which this knowledge base "
+                "does not have yet. Filter by documents=... instead, or send /filter without arguments to clear it."
+            )
+            return parser_html(self._answer_in(answer, knowledge_base_language, user_language)), None, None
+        if undescribed:
+            logger.warning(f"{search_filter} matches nothing in {undescribed}, which have no document descriptions")
+
+        # Translate the prompt to the language of every attached knowledge base
+        prompts = self.translate_prompt(
+            prompt, user_language, list(dict.fromkeys([knowledge_base_language] + [handle.language for handle in handles]))
+        )
+        translated_prompt = prompts[knowledge_base_language]
 
         # Ensure chat_history is a list
         if chat_history is None:
             chat_history = []
 
-        # Retrieve documents with similarity scores
-        retrieved_docs_with_scores = self.vector_store.similarity_search_with_score(
-            translated_prompt, k=DOCS_IN_RETRIEVER
-        )
-        logger.debug("Retrieved documents with similarity scores.")
-
-        retrieved_docs = [doc for doc, _ in retrieved_docs_with_scores]
-
-        # Compute embeddings similarity
-        relevance_scores = self.compute_embeddings_similarity(translated_prompt, retrieved_docs)
-
-        # Filter relevant documents based on similarity threshold
-        relevant_docs = [doc for doc, similarity in relevance_scores if similarity >= RELEVANCE_THRESHOLD_DOCS]
+        # Hybrid BM25 + vector retrieval in every attached knowledge base; the prompt is
+        # embedded at most once per language, and not at all when the standard codes it
+        # cites pin down the chunks exactly
+        targets = [
+            (vector_store, prompts[handle.language], handle_filter)
+            for vector_store, handle, handle_filter in zip(vector_stores, handles, search_filters)
+        ]
+        retrieved_chunks = federated_search(targets, self.embed_query, k=DOCS_IN_RETRIEVER)
+        logger.debug(f"Retrieved documents with hybrid search in {len(targets)} knowledge base(s).")
+
+        # Cosine similarity of each chunk to the prompt
+        relevance_scores = [
+            (chunk.document, chunk.similarity) for chunk in retrieved_chunks if chunk.similarity is not None
+        ]
+
+        # Filter relevant documents based on similarity threshold or an exact code match
+        relevant_chunks = [chunk for chunk in retrieved_chunks if chunk.is_relevant(RELEVANCE_THRESHOLD_DOCS)]
+        relevant_docs = [chunk.document for chunk in relevant_chunks]
 
         if not relevant_docs:
             logger.debug("No relevant documents found for the prompt.")
             answer = "I'm sorry, I could not find relevant information to answer your question."
-            # Translate the answer back to user's language if necessary
-            if user_language.lower() != self.knowledge_base_language.lower():
-                translated_answer = self.translate_text(answer, user_language)
-                logger.info(f"Translated answer from {self.knowledge_base_language} to {user_language}")
-            else:
-                translated_answer = answer
-            return parser_html(translated_answer), None, None
+            return parser_html(self._answer_in(answer, knowledge_base_language, user_language)), None, None
 
         # Build the context string
         context_str = "\n\n".join([doc.page_content for doc in relevant_docs])
@@ -280,24 +804,20 @@ class LLMService:
             answer = str(result)
 
         # Translate the answer back to user's language if necessary
-        if user_language.lower() != self.knowledge_base_language.lower():
+        if user_language.lower() != knowledge_base_language.lower():
             translated_answer = self.translate_text(answer, user_language)
-            logger.info(f"Translated answer from {self.knowledge_base_language} to {user_language}")
+            logger.info(f"Translated answer from {knowledge_base_language} to {user_language}")
         else:
             translated_answer = answer
             logger.info(f"No need to translate the answer")
 
-        # Build the references
-        references = {}
-        for doc in relevant_docs:
-            filename = doc.metadata.get("source", "Unknown")
-            page = doc.metadata.get("page", "Unknown")
-            if filename not in references:
-                references[filename] = set()
-            references[filename].add(page)
+        references = self._visible_references(relevant_chunks, hidden_sources)
 
-        # Implement similarity threshold
-        is_relevant = self.is_prompt_relevant_to_documents(relevance_scores)
+        # Implement similarity threshold; chunks citing the requested codes are always referenced
+        is_relevant = (
+            any(chunk.lexical_match for chunk in relevant_chunks)
+            or self.is_prompt_relevant_to_documents(relevance_scores)
+        )
 
         if is_relevant:
             # Build the answer with references
@@ -310,7 +830,7 @@ class LLMService:
                 answer_with_references += f"{doc_name}, pages: {pages_str}\n"
             logger.debug(f"References appended to the answer. RELEVANCE_THRESHOLD_DOCS: {RELEVANCE_THRESHOLD_DOCS}")
             response = parser_html(answer_with_references)
-            source_files = set([doc.metadata.get("source") for doc in relevant_docs])
+            source_files = set(references)
         else:
             logger.debug("Similarity threshold not met. Returning answer without references.")
             response = parser_html(translated_answer)
@@ -321,9 +841,9 @@ class LLMService:
 
         # Similarly, translate suggestions
         if suggestions:
-            if user_language.lower() != self.knowledge_base_language.lower():
+            if user_language.lower() != knowledge_base_language.lower():
                 translated_suggestions = [self.translate_text(s, user_language) for s in suggestions]
-                logger.info(f"Translated suggestions from {self.knowledge_base_language} to {user_language}")
+                logger.info(f"Translated suggestions from {knowledge_base_language} to {user_language}")
             else:
                 translated_suggestions = suggestions
         else:
@@ -392,37 +912,6 @@ class LLMService:
             logger.exception(f"Error generating suggestions: {str(e)}")
             return None
 
-    def compute_embeddings_similarity(self, prompt, documents):
-        """
-        Compute the cosine similarity between the prompt and each document.
-        Returns a list of tuples (document, similarity_score)
-        """
-        try:
-            # Get embedding of the prompt
-            prompt_embedding = self.embeddings.embed_query(prompt)
-            prompt_embedding = np.array(prompt_embedding)
-
-            relevance_scores = []
-            for doc in documents:
-                doc_embedding = self.embeddings.embed_query(doc.page_content)
-                doc_embedding = np.array(doc_embedding)
-
-                # Compute cosine similarity
-                dot_product = np.dot(prompt_embedding, doc_embedding)
-                norm_prompt = np.linalg.norm(prompt_embedding)
-                norm_doc = np.linalg.norm(doc_embedding)
-                if norm_prompt == 0 or norm_doc == 0:
-                    similarity = 0.0
-                else:
-                    similarity = dot_product / (norm_prompt * norm_doc)
-                relevance_scores.append((doc, similarity))
-
-            return relevance_scores
-
-        except Exception as e:
-            logger.exception(f"Error computing embeddings similarity: {str(e)}")
-            return []
-
     def is_prompt_relevant_to_documents(self, relevance_scores, relevance_threshold=RELEVANCE_THRESHOLD_PROMPT):
         """
         Determine if the prompt is relevant to the retrieved documents based on embeddings similarity.
@@ -436,41 +925,15 @@ class LLMService:
             return False
 
 
+    @log_errors(default_return=[])
     def get_empty_docs(self, folder_path):
         """
-        Scan through all PDF files in the specified folder and return a list of filenames
-        that contain one or more empty pages.
+        Return the filenames of the PDF files in the specified folder that contain one
+        or more empty pages, from the ingestion artifact of the folder.
         """
-        empty_docs = []
-        user_id = None  # You can modify this if you have user context
-
-        # Suppress warnings from PyMuPDFLoader if necessary
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-
-            for filename in os.listdir(folder_path):
-                if not filename.lower().endswith(".pdf"):
-                    continue  # Skip non-PDF files
-
-                file_path = os.path.join(folder_path, filename)
-
-                try:
-                    # Open the PDF using PyMuPDF
-                    with fitz.open(file_path) as doc:
-                        for page_num in range(len(doc)):
-                            page = doc.load_page(page_num)
-                            text = page.get_text().strip()
-
-                            if not text:
-                                # Empty page found
-                                logger.info(f"Empty content on page {page_num} of document '{filename}'")
-                                empty_docs.append(filename)
-                                break  # No need to check further pages in this document
-
-                except Exception as e:
-                    logger.error(f"Error processing '{filename}': {e}")
-                    continue  # Skip to the next file in case of an error
-
+        empty_docs = IngestionArtifact(folder_path).refresh(self._list_pdf_files(folder_path)).empty_documents()
+        if empty_docs:
+            logger.info(f"Documents with empty pages in '{folder_path}': {empty_docs}")
         return empty_docs
 
     @log_errors(default_return=[])
@@ -483,6 +946,9 @@ class LLMService:
 
         try:
             logger.debug(f"Starting metadata extraction for folder_path='{folder_path}'")
+            # Content samples come from the ingestion artifact; only files missing from it are parsed
+            ingestion = IngestionArtifact(folder_path).refresh(self._list_pdf_files(folder_path))
+            files_to_analyze = {}
             for filename in os.listdir(folder_path):
                 file_path = os.path.join(folder_path, filename)
 
@@ -501,28 +967,36 @@ class LLMService:
 
                 if date_of_analysis:
                     # Compare file's date_modified with date_of_analysis
-                    if file_date_modified <= date_of_analysis:
+                    if file_date_modified > date_of_analysis:
+                        logger.info(f"Re-analyzing '{filename}'; file has been modified.")
+                    elif not ingestion.described(filename):
+                        logger.info(f"Re-analyzing '{filename}'; it was described with an older prompt.")
+                    else:
                         # File has not been modified since last analysis; skip processing
                         logger.info(f"Skipping '{filename}'; no changes detected.")
                         continue
-                    else:
-                        logger.info(f"Re-analyzing '{filename}'; file has been modified.")
                 else:
                     logger.info(f"Analyzing new file: '{filename}'")
 
                 # Load content based on file type
                 if filename.endswith(".pdf"):
-                    loader = PyMuPDFLoader(file_path)
-                    docs = loader.load()
-                    content = " ".join([doc.page_content for doc in docs])
-                    logger.debug(f"Loaded content from PDF '{filename}'")
-
+                    files_to_analyze[filename] = date_modify_str
                 else:
                     logger.debug(f"Unsupported file type for '{filename}'. Skipping.")
                     continue  # Skip unsupported file types
 
-                # Limit content to first 2000 characters to avoid long prompts
-                content_sample = content[:2000]
+            unreadable = [filename for filename in files_to_analyze if filename not in ingestion.files]
+            if unreadable:
+                logger.warning(f"Skipping metadata of {unreadable} in '{folder_path}': text extraction failed; retried next run")
+            for filename, date_modify_str in files_to_analyze.items():
+                entry = ingestion.files.get(filename)
+                if entry is None:
+                    continue
+                file_path = os.path.join(folder_path, filename)
+                content_sample = entry["sample"]
+                outline = "\n".join(title for level, title, _ in entry["toc"] if level == 1)
+                if outline:
+                    content_sample = f"Table of contents:\n{outline[:1000]}\n\n{content_sample}"
                 logger.debug(f"Prepared content sample for '{filename}'")
 
                 # Generate AI description, document type, and language
@@ -558,6 +1032,8 @@ class LLMService:
                             language = line[len("language:"):].strip()
                 else:
                     logger.error(f"Unexpected response type for '{filename}': {type(response_text)}")
+                if description:
+                    ingestion.mark_described(filename)
 
                 # Append metadata as a dictionary to the list
                 metadata_list.append(
@@ -573,6 +1049,7 @@ class LLMService:
                 logger.info(
                     f"Extracted metadata for '{filename}': Type='{document_type}', Description='{description}', Language='{language}'")
 
+            ingestion.save()
             # After processing all files, mark files as deleted if they are not in the folder
 #            db_service.mark_files_as_deleted(existing_file_paths)
             logger.debug("Completed metadata extraction and database update.")
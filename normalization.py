@@ -0,0 +1,114 @@
+# normalization.py
+
+import logging
+import re
+
+from chunking import count_tokens
+from dedup import strip_running_blocks
+
+logger = logging.getLogger(__name__)
+
+# Characters of the same shape in Latin and Cyrillic, mixed up by OCR and copy-paste
+_LATIN_TO_CYRILLIC = str.maketrans("AaBEeKMHOoPpCcTXxyY", "АаВЕеКМНОоРрСсТХхуУ")
+_CYRILLIC_TO_LATIN = str.maketrans("АаВЕеКМНОоРрСсТХхуУ", "AaBEeKMHOoPpCcTXxyY")
+_LIGATURES = str.maketrans({"ﬀ": "ff", "ﬁ": "fi", "ﬂ": "fl", "ﬃ": "ffi", "ﬄ": "ffl"})
+
+_SPACES_RE = re.compile(r"[ \t\u00a0\u2009\u202f]+")
+_HYPHEN_BREAK_RE = re.compile(r"([^\W\d_]+)([\u00ad\-\u2010\u2011])[ \t]*\n[ \t]*([^\W\d_]+)")
+_DOT_LEADER_RE = re.compile(r"(?:[ \t]?[.…·_]){4,}")
+_SPACE_BEFORE_PUNCTUATION_RE = re.compile(r" +([,.;:!?)\]»])")
+_SPACE_AFTER_BRACKET_RE = re.compile(r"([(\[«]) +")
+_MIXED_WORD_RE = re.compile(r"\b(?=\w*[A-Za-z])(?=\w*[А-Яа-яЁё])\w+\b")
+
+
+def _russian_hyphen(left, right):
+    # кто-то, какой-либо, где-нибудь, всё-таки, из-за, по-прежнему, во-первых
+    return right.lower() in {"то", "либо", "нибудь", "таки", "ка"} or left.lower() in {"из", "по", "во", "в"}
+
+
+def _indonesian_hyphen(left, right):
+    # Reduplication: anak-anak, buku-bukunya, berlari-lari
+    return right.lower().startswith(left.lower()) or left.lower().endswith(right.lower())
+
+
+def _english_hyphen(left, right):
+    return left.lower() in {"self", "non", "well", "cross", "multi", "high", "low", "long", "short", "full"}
+
+
+# Per language: whether a hyphen at a line break belongs to the word, and the
+# script mixed-script words fall back to when neither has the majority
+LANGUAGE_RULES = {
+    "Russian": {"keeps_hyphen": _russian_hyphen, "script": "cyrillic"},
+    "Indonesian": {"keeps_hyphen": _indonesian_hyphen, "script": "latin"},
+    "English": {"keeps_hyphen": _english_hyphen, "script": "latin"},
+}
+
+
+def _unmix(word, script):
+    cyrillic = sum(1 for char in word if "А" <= char <= "я" or char in "Ёё")
+    latin = sum(1 for char in word if char.isascii() and char.isalpha())
+    if cyrillic > latin or (cyrillic == latin and script == "cyrillic"):
+        return word.translate(_LATIN_TO_CYRILLIC)
+    return word.translate(_CYRILLIC_TO_LATIN)
+
+
+def normalize_text(text, language="English"):
+    """
+    Strip extraction noise from the text of one block: soft hyphens, hyphenated line
+    breaks, dot leaders, ligatures, runs of whitespace, blank lines and spaces inside
+    punctuation, and words mixing Latin and Cyrillic look-alike letters. Which
+    hyphens at line breaks are kept depends on language.
+    """
+    rules = LANGUAGE_RULES.get(language, LANGUAGE_RULES["English"])
+    text = text.translate(_LIGATURES)
+    text = _SPACES_RE.sub(" ", text)
+
+    def join(match):
+        left, hyphen, right = match.groups()
+        if hyphen != "\u00ad" and (right[0].isupper() or rules["keeps_hyphen"](left, right)):
+            return f"{left}-{right}"
+        return left + right
+
+    text = _HYPHEN_BREAK_RE.sub(join, text)
+    text = text.replace("\u00ad", "")
+    text = _DOT_LEADER_RE.sub(" ", text)
+    text = _MIXED_WORD_RE.sub(lambda match: _unmix(match.group(0), rules["script"]), text)
+    text = _SPACE_BEFORE_PUNCTUATION_RE.sub(r"\1", text)
+    text = _SPACE_AFTER_BRACKET_RE.sub(r"\1", text)
+    text = _SPACES_RE.sub(" ", text)
+    return "\n".join(line.strip() for line in text.splitlines() if line.strip())
+
+
+def normalize_pages(pages, language="English", count=count_tokens):
+    """
+    Normalization stage of indexing, in place: leave running headers and footers out
+    (see strip_running_blocks) and normalize the text of every block, or of the page
+    when it has no blocks. Returns the tokens of the pages before and after.
+    """
+    raw_tokens = sum(count(page.text) for page in pages)
+    strip_running_blocks(pages)
+    for page in pages:
+        if page.blocks is None:
+            page.text = normalize_text(page.text, language)
+            continue
+        blocks = [(normalize_text(text, language), is_heading) for text, is_heading in page.blocks]
+        page.blocks = [(text, is_heading) for text, is_heading in blocks if text]
+        page.text = "".join(f"{text}\n" for text, _ in page.blocks)
+    tokens = sum(count(page.text) for page in pages)
+    return raw_tokens, tokens
+
+
+def normalization_report(manifest):
+    """
+    Token savings of the normalization stage over the files of one index manifest,
+    from the counts recorded when each file was indexed.
+    """
+    counted = [entry["tokens"] for entry in manifest.files.values() if entry.get("tokens")]
+    raw_tokens = sum(raw for raw, _ in counted)
+    tokens = sum(normalized for _, normalized in counted)
+    return {
+        "files": len(counted),
+        "raw_tokens": raw_tokens,
+        "tokens": tokens,
+        "saved": f"{1 - tokens / raw_tokens:.1%}" if raw_tokens else "n/a",
+    }
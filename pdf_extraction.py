@@ -0,0 +1,197 @@
+# pdf_extraction.py
+
+import itertools
+import logging
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import fitz
+from langchain.schema import Document
+
+from settings import PDF_EXTRACTION_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Pools are started from background threads (the index build's bounded_stream), and
+# forking a process that runs other threads can copy a lock held by one of them into
+# the worker; forkserver and spawn start workers from a clean, single-threaded process
+_POOL_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+# Bump when extracted text or blocks change, so cached extractions are not reused
+EXTRACTOR_VERSION = 1
+
+# A block counts as a heading when its font is this much larger than the page's body text
+HEADING_SIZE_RATIO = 1.15
+# Longer blocks are body text whatever their font
+HEADING_MAX_CHARS = 200
+
+
+class PageRecord:
+    """
+    Text of one PDF page. page is 0-based, as in PyMuPDFLoader metadata.
+    blocks, when extracted, are the page's text blocks as (text, is_heading).
+    """
+    __slots__ = ("source", "page", "text", "blocks")
+
+    def __init__(self, source, page, text, blocks=None):
+        self.source = source
+        self.page = page
+        self.text = text
+        self.blocks = blocks
+
+    def to_document(self):
+        return Document(page_content=self.text, metadata={"source": self.source, "page": self.page})
+
+
+class ExtractionResult:
+    """
+    Outcome of extracting one file: its page records and outline, or the error that
+    stopped it. toc holds the PDF's bookmarks as [level, title, 1-based page].
+    """
+    __slots__ = ("filename", "pages", "toc", "error")
+
+    def __init__(self, filename, pages=None, error=None, toc=None):
+        self.filename = filename
+        self.pages = pages or []
+        self.toc = toc or []
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def page_blocks(page):
+    """
+    Text blocks of a PyMuPDF page as (text, is_heading). A short block is a heading
+    when its font is HEADING_SIZE_RATIO larger than the most common font size on the
+    page, or when the page's body text is regular and the block is entirely bold.
+    """
+    blocks = []
+    body_chars = {}
+    for block in page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]:
+        lines, sizes, bold = [], [], True
+        for line in block.get("lines", []):
+            spans = [span for span in line["spans"] if span["text"].strip()]
+            lines.append("".join(span["text"] for span in line["spans"]))
+            for span in spans:
+                sizes.append((span["size"], len(span["text"])))
+                bold = bold and bool(span["flags"] & fitz.TEXT_FONT_BOLD)
+                size = round(span["size"], 1)
+                body_chars[size] = body_chars.get(size, 0) + len(span["text"])
+        text = "\n".join(lines).strip()
+        if text and sizes:
+            size = sum(size * chars for size, chars in sizes) / sum(chars for _, chars in sizes)
+            blocks.append((text, size, bold))
+    if not blocks:
+        return []
+    body_size = max(body_chars, key=body_chars.get)
+    body_bold = all(bold for _, _, bold in blocks)
+    return [
+        (text, len(text) <= HEADING_MAX_CHARS and (size >= body_size * HEADING_SIZE_RATIO or (bold and not body_bold)))
+        for text, size, bold in blocks
+    ]
+
+
+def extract_pdf(folder_path, filename, max_chars=None, with_blocks=False):
+    """
+    Extract the text of every page of one PDF. With max_chars, stop reading pages
+    once that many characters were collected. with_blocks also keeps each page's
+    text blocks and headings (see page_blocks), for chunking. Never raises: failures
+    are returned in the result so one bad file cannot abort a batch.
+    Runs inside pool workers, so it must stay a module-level function.
+    """
+    file_path = os.path.join(folder_path, filename)
+    pages = []
+    collected = 0
+    try:
+        with fitz.open(file_path) as doc:
+            for page_num in range(len(doc)):
+                page = doc.load_page(page_num)
+                if with_blocks:
+                    blocks = page_blocks(page)
+                    text = "".join(f"{block}\n" for block, _ in blocks)
+                    pages.append(PageRecord(filename, page_num, text, blocks))
+                else:
+                    text = page.get_text()
+                    pages.append(PageRecord(filename, page_num, text))
+                collected += len(text)
+                if max_chars is not None and collected >= max_chars:
+                    break
+            toc = doc.get_toc()
+        return ExtractionResult(filename, pages, toc=toc)
+    except Exception as e:
+        return ExtractionResult(filename, error=f"{type(e).__name__}: {e}")
+
+
+def _extract_isolated(folder_path, filename, max_chars, with_blocks):
+    """
+    Re-run one file in its own single-use process after a worker crash, so a PDF
+    that kills the interpreter only fails itself.
+    """
+    try:
+        with ProcessPoolExecutor(max_workers=1, mp_context=_POOL_CONTEXT) as executor:
+            return executor.submit(extract_pdf, folder_path, filename, max_chars, with_blocks).result()
+    except BrokenProcessPool:
+        return ExtractionResult(filename, error="Extraction process crashed")
+
+
+def extract_pdfs(folder_path, filenames, workers=PDF_EXTRACTION_WORKERS, max_chars=None, with_blocks=False):
+    """
+    Extract many PDFs in parallel with a process pool, keeping at most two files per
+    worker in flight so extracted pages do not pile up ahead of a slow consumer.
+    Yields one ExtractionResult per filename, in the order of filenames.
+    """
+    filenames = list(filenames)
+    if not filenames:
+        return
+    workers = max(1, min(workers, len(filenames)))
+
+    if workers == 1:
+        for filename in filenames:
+            result = extract_pdf(folder_path, filename, max_chars, with_blocks)
+            _log_result(result)
+            yield result
+        return
+
+    logger.info(f"Extracting {len(filenames)} PDFs from '{folder_path}' with {workers} workers")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_POOL_CONTEXT) as executor:
+        remaining = iter(filenames)
+        broken = False
+
+        def submit(filename):
+            if broken:
+                return None
+            return executor.submit(extract_pdf, folder_path, filename, max_chars, with_blocks)
+
+        pending = deque((filename, submit(filename)) for filename in itertools.islice(remaining, 2 * workers))
+        while pending:
+            filename, future = pending.popleft()
+            try:
+                if future is None:
+                    raise BrokenProcessPool()
+                result = future.result()
+            except BrokenProcessPool:
+                # A worker died (e.g. a crash inside MuPDF) and took the pool with it.
+                # Finish the remaining files one by one in isolated processes.
+                if not broken:
+                    logger.error(f"PDF extraction pool broke while processing '{filename}'; isolating remaining files")
+                broken = True
+                result = _extract_isolated(folder_path, filename, max_chars, with_blocks)
+            _log_result(result)
+            next_filename = next(remaining, None)
+            if next_filename is not None:
+                pending.append((next_filename, submit(next_filename)))
+            yield result
+
+
+def _log_result(result):
+    if result.ok:
+        logger.debug(f"Extracted {len(result.pages)} pages from '{result.filename}'")
+    else:
+        logger.error(f"Error extracting PDF file '{result.filename}': {result.error}")
@@ -0,0 +1,72 @@
+# permissions.py
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from db_service import DatabaseService
+from settings import PERMISSIONS_CACHE_SECONDS, PERMISSIONS_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def _hidden_documents_from_database(user_id, folder_path):
+    return DatabaseService().get_hidden_documents(user_id, folder_path)
+
+
+class DocumentPermissions:
+    """
+    Bounded cache of the documents each user may not see in a knowledge base, by
+    project membership, shared by all users of the process. The hidden filenames
+    become SearchFilter.hidden_sources, so restricted chunks are excluded inside
+    the search itself and never reach the LLM context.
+    """
+
+    def __init__(self, fetch=_hidden_documents_from_database, ttl=PERMISSIONS_CACHE_SECONDS,
+                 max_entries=PERMISSIONS_CACHE_SIZE):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hidden_sources(self, user_id, folder_path):
+        """
+        Return the filenames in folder_path hidden from user_id as a frozenset, or
+        None when the permissions cannot be read; callers must then not search.
+        """
+        key = (user_id, os.path.normpath(folder_path))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        path_files = self._fetch(user_id, folder_path)
+        if path_files is None:
+            return None
+        hidden = frozenset(os.path.relpath(path_file, folder_path) for path_file in path_files)
+        logger.debug(f"{len(hidden)} documents in '{folder_path}' are hidden from user_id={user_id}")
+        with self._lock:
+            self._entries[key] = (now + self.ttl, hidden)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return hidden
+
+    def invalidate(self, user_id=None):
+        """
+        Forget the cached permissions of one user, or of everyone.
+        """
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == user_id]:
+                    del self._entries[key]
+
+
+document_permissions = DocumentPermissions()
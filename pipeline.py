@@ -0,0 +1,84 @@
+# pipeline.py
+
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# How often a blocked stage checks whether its consumer went away, in seconds
+_POLL_SECONDS = 0.1
+
+
+class _Failure:
+    __slots__ = ("error",)
+
+    def __init__(self, error):
+        self.error = error
+
+
+_DONE = object()
+
+
+def bounded_stream(iterable, maxsize, name="pipeline-stage"):
+    """
+    Run iterable in a background thread and yield its items, with at most maxsize
+    of them waiting in between, so the producer works ahead of the consumer without
+    running away from it. An exception in the producer is re-raised in the consumer.
+    When the consumer stops early, the producer stops at its next item.
+    """
+    items = queue.Queue(maxsize)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(_Failure(e))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def windows(batches, size):
+    """
+    Regroup a stream of (items, ids) pairs of any length into pairs of size items,
+    the last one shorter.
+    """
+    items, ids = [], []
+    for batch_items, batch_ids in batches:
+        items.extend(batch_items)
+        ids.extend(batch_ids)
+        while len(items) >= size:
+            yield items[:size], ids[:size]
+            items, ids = items[size:], ids[size:]
+    if items:
+        yield items, ids
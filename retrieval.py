@@ -0,0 +1,360 @@
+# retrieval.py
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from faiss_index import filtered_search_params, index_metric, is_cosine_store, rescore
+from search_filter import bitmap_of_positions, bitmap_positions, filter_bitmap, live_bitmap, restrict_positions
+from settings import RRF_K, HYBRID_CANDIDATES, LEXICAL_SKIP_MAX_MATCHES, HIERARCHICAL_MIN_DOCUMENTS, \
+    HIERARCHICAL_TOP_DOCUMENTS, HIERARCHICAL_MAX_CANDIDATE_SHARE
+
+logger = logging.getLogger(__name__)
+
+# Position sets up to this size are scored exactly from their stored vectors;
+# larger ones are searched through the index with a selector bitmap
+EXACT_SEARCH_MAX_POSITIONS = 4096
+
+# Runs lexical searches alongside the embedding call and vector search
+_search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
+# Fans a query out to several knowledge bases; kept apart from _search_executor,
+# whose lexical searches the fanned-out searches wait on
+_fanout_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="federated")
+
+
+class RetrievedChunk:
+    """
+    One search hit: the chunk, its stored index vector and the raw index score.
+    similarity is the cosine similarity to the query (None when the query was not
+    embedded); lexical_match marks chunks containing every code the query cites.
+    vector_store is the store the chunk was found in.
+    """
+    __slots__ = ("document", "vector", "score", "position", "similarity", "lexical_match", "vector_store")
+
+    def __init__(self, document, vector, score, position, similarity=None, lexical_match=False, vector_store=None):
+        self.document = document
+        self.vector = vector
+        self.score = score
+        self.position = position
+        self.similarity = similarity
+        self.lexical_match = lexical_match
+        self.vector_store = vector_store
+
+    def is_relevant(self, threshold):
+        return self.lexical_match or (self.similarity is not None and self.similarity >= threshold)
+
+
+def _documents_at(vector_store, positions):
+    if hasattr(vector_store.docstore, "documents_at"):
+        return vector_store.docstore.documents_at(positions)
+    return [vector_store.docstore.search(vector_store.index_to_docstore_id[position]) for position in positions]
+
+
+def _reconstruct_vectors(vector_store, positions, documents=None):
+    """
+    Read the stored vectors for the hit positions: from the exact copy kept for
+    rescoring, else back from the index. Index types that cannot reconstruct fall
+    back to re-embedding the hits (served from the embedding cache when the chunks
+    were indexed through it).
+    """
+    exact_vectors = getattr(vector_store, "exact_vectors", None)
+    if exact_vectors is not None:
+        return np.asarray(exact_vectors[np.asarray(positions, dtype=np.int64)], dtype=np.float32)
+    try:
+        return vector_store.index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+    except RuntimeError as e:
+        logger.warning(f"Index cannot reconstruct stored vectors ({e}); re-embedding retrieved chunks")
+        if documents is None:
+            documents = _documents_at(vector_store, positions)
+        vectors = vector_store.embedding_function.embed_documents([doc.page_content for doc in documents])
+        return np.asarray(vectors, dtype=np.float32)
+
+
+def search_with_vectors(vector_store, query_embedding, k, allowed=None):
+    """
+    Search a LangChain FAISS vector store by vector and return a list of
+    RetrievedChunk carrying each hit's stored vector, best hit first.
+    On cosine stores the hit score is the cosine similarity. Stores that keep exact
+    vectors next to a quantized index fetch extra candidates and re-rank them exactly,
+    so scores do not carry quantization error.
+    With a packed bitmap allowed, the index itself skips every other position. If an
+    approximate index still comes back short (or cannot filter), the allowed
+    positions are scanned exactly, so a filtered search returns a full k as well.
+    Tombstoned positions of an HNSW store are always filtered out.
+    """
+    index = vector_store.index
+    if allowed is None:
+        allowed = live_bitmap(vector_store)
+    query = np.asarray([query_embedding], dtype=np.float32)
+    if is_cosine_store(vector_store):
+        query = normalized(query)
+    try:
+        params = filtered_search_params(index, allowed) if allowed is not None else None
+        exact_vectors = getattr(vector_store, "exact_vectors", None)
+        if exact_vectors is not None:
+            _, candidates = index.search(query, k * getattr(vector_store, "rescore_factor", 1), params=params)
+            scores, positions = rescore(query[0], candidates[0], exact_vectors, index_metric(index), k)
+            scores, positions = scores[None, :], positions[None, :]
+        else:
+            scores, positions = index.search(query, k, params=params)
+    except RuntimeError as e:
+        if allowed is None:
+            raise
+        logger.debug(f"Index cannot filter inside the search ({e})")
+        scores, positions = np.zeros((1, 0), dtype=np.float32), np.zeros((1, 0), dtype=np.int64)
+
+    hits = [(int(position), float(score)) for position, score in zip(positions[0], scores[0]) if position != -1]
+    if allowed is not None and len(hits) < k:
+        allowed_positions = bitmap_positions(allowed, index.ntotal)
+        if len(hits) < len(allowed_positions):
+            return search_positions(vector_store, query_embedding, allowed_positions.tolist(), k)
+    return chunks_at(vector_store, [position for position, _ in hits], [score for _, score in hits])
+
+
+def search_positions(vector_store, query_embedding, positions, k):
+    """
+    Exact search over the given index positions only, e.g. the chunks of one
+    document: their stored vectors are scored directly, so no candidate is lost to
+    the approximate index. Scores are on the same scale as search_with_vectors.
+    """
+    if not positions:
+        return []
+    query = np.asarray([query_embedding], dtype=np.float32)
+    if is_cosine_store(vector_store):
+        query = normalized(query)
+    vectors = _reconstruct_vectors(vector_store, positions)
+    scores, order = rescore(query[0], np.arange(len(positions)), vectors, index_metric(vector_store.index), k)
+    return chunks_at(vector_store, [positions[i] for i in order], [float(score) for score in scores])
+
+
+def search_within(vector_store, query_embedding, positions, k):
+    """
+    Search only the given index positions: exactly when there are few of them (see
+    search_positions), otherwise through the index with the positions as a filter.
+    """
+    if len(positions) <= EXACT_SEARCH_MAX_POSITIONS:
+        return search_positions(vector_store, query_embedding, positions, k)
+    allowed = bitmap_of_positions(positions, vector_store.index.ntotal)
+    return search_with_vectors(vector_store, query_embedding, k, allowed)
+
+
+def route_query(vector_store, query_text):
+    """
+    Resolve the standard codes cited in the query to their documents. Returns
+    (positions, lexical_query): the index positions of those documents' chunks, or
+    None to search the whole store, and the query text to match lexically, with the
+    resolved codes cut out since every routed chunk belongs to them.
+    """
+    code_index = getattr(vector_store, "code_index", None)
+    if code_index is None:
+        return None, query_text
+    sources, remainder = code_index.route(query_text)
+    positions = vector_store.docstore.positions_of_sources(sources) if sources else []
+    if not positions:
+        return None, query_text
+    logger.info(f"Query cites {', '.join(sources)}; searching their {len(positions)} chunks only")
+    return positions, remainder
+
+
+def _ranked_document_index(vector_store):
+    document_index = getattr(vector_store, "document_index", None)
+    if document_index is None or len(document_index) < HIERARCHICAL_MIN_DOCUMENTS:
+        return None
+    return document_index
+
+
+def candidate_positions(vector_store, query_embedding):
+    """
+    First stage of two-stage retrieval: the index positions of the chunks of the
+    HIERARCHICAL_TOP_DOCUMENTS documents whose descriptions best match the query,
+    plus those of documents without a description, which cannot be ranked.
+    Returns None to search the whole store: when it has too few described documents
+    to bother, or when the candidates would cover more than
+    HIERARCHICAL_MAX_CANDIDATE_SHARE of its chunks anyway.
+    """
+    document_index = _ranked_document_index(vector_store)
+    if document_index is None:
+        return None
+    sources = document_index.top_sources(query_embedding, HIERARCHICAL_TOP_DOCUMENTS)
+    described = set(document_index.sources)
+    sources += [source for source in vector_store.docstore.source_names() if source not in described]
+    positions = vector_store.docstore.positions_of_sources(sources)
+    if len(positions) > HIERARCHICAL_MAX_CANDIDATE_SHARE * vector_store.index.ntotal:
+        logger.debug(f"Document stage would keep {len(positions)} chunks; searching the whole store")
+        return None
+    logger.debug(f"Document stage kept {len(positions)} chunks of {len(sources)} documents")
+    return positions or None
+
+
+def chunks_at(vector_store, positions, scores=None):
+    """
+    Build RetrievedChunk objects for index positions, reading their documents and
+    stored vectors. scores defaults to None for hits that did not come from the index.
+    """
+    if not positions:
+        return []
+    documents = _documents_at(vector_store, positions)
+    vectors = _reconstruct_vectors(vector_store, positions, documents)
+    scores = scores or [None] * len(positions)
+    return [
+        RetrievedChunk(document, vector, score, position, vector_store=vector_store)
+        for document, vector, score, position in zip(documents, vectors, scores, positions)
+    ]
+
+
+def rrf_fuse(rankings, k, rrf_k=RRF_K):
+    """
+    Reciprocal-rank fusion: score every item by the sum of 1 / (rrf_k + rank) over
+    the rankings it appears in and return the top k items, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores, key=lambda item: -scores[item])[:k]
+
+
+def hybrid_search(vector_store, query_text, embed_query, k, search_filter=None):
+    """
+    Retrieve k chunks for query_text with BM25 and vector search. A query citing a
+    known standard is routed to that document's chunks (see route_query); other
+    queries are narrowed to the documents whose descriptions match best when the
+    store has a document index (see candidate_positions). The lexical search runs
+    alongside the vector search, and the two rankings are merged by reciprocal-rank
+    fusion. If the standard codes and clause numbers in the query pin down at most
+    LEXICAL_SKIP_MAX_MATCHES chunks, those are returned without embedding the query.
+    A SearchFilter is applied inside both searches as a bitmap of allowed positions.
+    Returns (chunks, query_embedding); query_embedding is None when it was skipped.
+    Stores without a lexical index fall back to vector search.
+    """
+    allowed = filter_bitmap(vector_store, search_filter)
+    lexical_index = getattr(vector_store, "lexical_index", None)
+    if lexical_index is None:
+        query_embedding = embed_query(query_text)
+        chunks = search_with_vectors(vector_store, query_embedding, k, allowed)
+        _fill_similarities(vector_store, query_embedding, chunks, chunks)
+        return chunks, query_embedding
+
+    positions, lexical_query = route_query(vector_store, query_text)
+    # A routed document the filter excludes leaves the rest of the allowed store
+    positions = restrict_positions(positions, allowed) or None
+    code_matches = lexical_index.code_matches(
+        lexical_query, limit=LEXICAL_SKIP_MAX_MATCHES + 1, positions=positions, allowed=allowed
+    )
+    if 0 < len(code_matches) <= LEXICAL_SKIP_MAX_MATCHES:
+        logger.info(f"Query codes match {len(code_matches)} chunks exactly; skipping the embedding call")
+        chunks = chunks_at(vector_store, code_matches[:k])
+        for chunk in chunks:
+            chunk.lexical_match = True
+        return chunks, None
+
+    # The document stage needs the query embedding; otherwise BM25 overlaps the embedding call
+    rank_documents = positions is None and _ranked_document_index(vector_store) is not None
+    if not rank_documents:
+        lexical_future = _search_executor.submit(
+            lexical_index.search, lexical_query, HYBRID_CANDIDATES, positions, allowed
+        )
+    query_embedding = embed_query(query_text)
+    if rank_documents:
+        positions = restrict_positions(candidate_positions(vector_store, query_embedding), allowed) or None
+        lexical_future = _search_executor.submit(
+            lexical_index.search, lexical_query, HYBRID_CANDIDATES, positions, allowed
+        )
+    if positions is None:
+        vector_chunks = search_with_vectors(vector_store, query_embedding, HYBRID_CANDIDATES, allowed)
+    else:
+        vector_chunks = search_within(vector_store, query_embedding, positions, HYBRID_CANDIDATES)
+    lexical_hits = lexical_future.result()
+
+    fused = rrf_fuse([[chunk.position for chunk in vector_chunks], [position for position, _ in lexical_hits]], k)
+    by_position = {chunk.position: chunk for chunk in vector_chunks}
+    lexical_only = chunks_at(vector_store, [position for position in fused if position not in by_position])
+    by_position.update((chunk.position, chunk) for chunk in lexical_only)
+    chunks = [by_position[position] for position in fused]
+
+    _fill_similarities(vector_store, query_embedding, [chunk for chunk in chunks if chunk.score is not None], chunks)
+    exact = set(lexical_index.code_matches(lexical_query, limit=len(chunks), positions=fused))
+    for chunk in chunks:
+        chunk.lexical_match = chunk.position in exact
+    return chunks, query_embedding
+
+
+def federated_search(targets, embed_query, k):
+    """
+    Run hybrid_search on several vector stores concurrently and merge their hits
+    into one top-k list, so a query costs about as much as its slowest store.
+    targets is [(vector_store, query_text, search_filter)], each query in its store's
+    language and each filter (or None) holding that store's hidden documents.
+    All stores share one embedding model, so cosine similarity ranks hits across
+    stores; chunks matching the cited codes exactly come first. A store whose
+    search fails is logged and skipped.
+    """
+    if len(targets) == 1:
+        vector_store, query_text, search_filter = targets[0]
+        return hybrid_search(vector_store, query_text, embed_query, k, search_filter)[0]
+
+    futures = [
+        _fanout_executor.submit(hybrid_search, vector_store, query_text, embed_query, k, search_filter)
+        for vector_store, query_text, search_filter in targets
+    ]
+    chunks = []
+    for future in futures:
+        try:
+            chunks.extend(future.result()[0])
+        except Exception as e:
+            logger.exception(f"Knowledge base search failed; answering from the others: {e}")
+    chunks.sort(key=_calibrated_score, reverse=True)
+    return chunks[:k]
+
+
+def _calibrated_score(chunk):
+    # Exact code matches skipped the embedding call and carry no similarity
+    return chunk.lexical_match, chunk.similarity if chunk.similarity is not None else 1.0
+
+
+def _fill_similarities(vector_store, query_embedding, vector_hits, chunks):
+    """
+    Set chunk.similarity for every chunk: vector hits through relevance_similarities
+    (the search score on cosine stores), other chunks from their stored vectors.
+    """
+    for chunk, similarity in zip(vector_hits, relevance_similarities(vector_store, query_embedding, vector_hits)):
+        chunk.similarity = float(similarity)
+    others = [chunk for chunk in chunks if chunk.similarity is None]
+    if others:
+        similarities = cosine_similarities(query_embedding, np.vstack([chunk.vector for chunk in others]))
+        for chunk, similarity in zip(others, similarities):
+            chunk.similarity = float(similarity)
+
+
+def normalized(vectors):
+    """
+    Return a row-wise L2-normalized float32 copy of vectors. Zero rows stay zero.
+    """
+    matrix = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms != 0)
+
+
+def relevance_similarities(vector_store, query_embedding, retrieved_chunks):
+    """
+    Cosine similarity of the query to each retrieved chunk. Cosine stores already
+    return it as the search score; L2 stores need a pass over the stored vectors.
+    """
+    if not retrieved_chunks:
+        return np.zeros(0, dtype=np.float32)
+    if is_cosine_store(vector_store):
+        return np.array([chunk.score for chunk in retrieved_chunks], dtype=np.float32)
+    return cosine_similarities(query_embedding, np.vstack([chunk.vector for chunk in retrieved_chunks]))
+
+
+def cosine_similarities(query_embedding, vectors):
+    """
+    Cosine similarity of one query vector against every row of vectors. Zero-norm rows score 0.
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.size == 0:
+        return np.zeros(0, dtype=np.float32)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    return np.divide(matrix @ query, norms, out=np.zeros(len(matrix), dtype=np.float32), where=norms != 0)
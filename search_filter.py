@@ -0,0 +1,207 @@
+# search_filter.py
+
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Metadata kinds with precomputed bitmaps in the document index
+KIND_DOCUMENT_TYPE = "document_type"
+KIND_LANGUAGE = "language"
+
+# Combined bitmaps kept per loaded store, keyed by filter
+FILTER_CACHE_SIZE = 64
+
+_cache_lock = threading.Lock()
+
+
+class SearchFilter:
+    """
+    Restriction of a search to some documents: by document_type (case-insensitive
+    substring, so "fire" matches "Fire safety code"), by language, or to an explicit
+    set of source filenames. Empty fields do not restrict; set fields are combined
+    with AND. hidden_sources are never searched; they carry the documents the user
+    may not see (see permissions.py) and are not settable through parse.
+    """
+    __slots__ = ("document_types", "languages", "sources", "hidden_sources")
+
+    def __init__(self, document_types=(), languages=(), sources=(), hidden_sources=()):
+        self.document_types = tuple(sorted({value.strip().lower() for value in document_types if value.strip()}))
+        self.languages = tuple(sorted({value.strip().lower() for value in languages if value.strip()}))
+        self.sources = tuple(sorted({value.strip() for value in sources if value.strip()}))
+        self.hidden_sources = tuple(sorted(set(hidden_sources)))
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Parse "type=fire safety, evacuation; language=Russian; documents=a.pdf, b.pdf".
+        Raises ValueError on an unknown field.
+        """
+        fields = {"type": [], "language": [], "documents": []}
+        for part in text.split(";"):
+            if not part.strip():
+                continue
+            name, _, values = part.partition("=")
+            name = name.strip().lower()
+            if name not in fields:
+                raise ValueError(f"Unknown filter field '{name}'")
+            fields[name].extend(values.split(","))
+        return cls(fields["type"], fields["language"], fields["documents"])
+
+    def hiding(self, hidden_sources):
+        """
+        The same filter with hidden_sources excluded from the search as well.
+        """
+        return SearchFilter(self.document_types, self.languages, self.sources, self.hidden_sources + tuple(hidden_sources))
+
+    def key(self):
+        return self.document_types, self.languages, self.sources, self.hidden_sources
+
+    def __bool__(self):
+        return bool(self.document_types or self.languages or self.sources or self.hidden_sources)
+
+    def __eq__(self, other):
+        return isinstance(other, SearchFilter) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        return (
+            f"SearchFilter(document_types={self.document_types}, languages={self.languages}, sources={self.sources}, "
+            f"hidden_sources={len(self.hidden_sources)})"
+        )
+
+
+def bitmap_of_positions(positions, count):
+    """
+    Packed bitmap (little bit order, as FAISS IDSelectorBitmap reads it) with the
+    bits of positions set, over count index positions.
+    """
+    mask = np.zeros(count, dtype=bool)
+    mask[np.asarray(positions, dtype=np.int64)] = True
+    return np.packbits(mask, bitorder="little")
+
+
+def bitmap_positions(bitmap, count):
+    """
+    Index positions whose bits are set in a packed bitmap.
+    """
+    return np.flatnonzero(np.unpackbits(bitmap, count=count, bitorder="little"))
+
+
+def live_bitmap(vector_store):
+    """
+    Packed bitmap of the positions that hold a chunk, or None when the index has
+    no tombstones. Cached until the index or its tombstones change.
+    """
+    tombstones = getattr(vector_store, "tombstones", 0)
+    if not tombstones:
+        return None
+    key = (vector_store.index.ntotal, tombstones)
+    cached = getattr(vector_store, "_live_bitmap", None)
+    if cached is None or cached[0] != key:
+        cached = key, bitmap_of_positions(list(vector_store.index_to_docstore_id), vector_store.index.ntotal)
+        vector_store._live_bitmap = cached
+    return cached[1]
+
+
+def is_allowed(bitmap, position):
+    return bool((bitmap[position >> 3] >> (position & 7)) & 1)
+
+
+def restrict_positions(positions, bitmap):
+    """
+    Keep the positions allowed by bitmap; None (no restriction) passes through.
+    """
+    if positions is None or bitmap is None:
+        return positions
+    return [position for position in positions if is_allowed(bitmap, position)]
+
+
+def _metadata_bitmap(document_index, kind, matches, size):
+    bitmap = np.zeros(size, dtype=np.uint8)
+    if document_index is not None:
+        for (value_kind, value), value_bitmap in document_index.value_bitmaps.items():
+            if value_kind == kind and matches(value):
+                bitmap |= value_bitmap[:size]
+    return bitmap
+
+
+def _positions_of_sources(vector_store, sources):
+    """
+    Index positions of the chunks of sources: from the published docstore's source
+    table, or by scanning the documents of an in-memory or legacy store.
+    """
+    docstore = vector_store.docstore
+    if hasattr(docstore, "positions_of_sources"):
+        return docstore.positions_of_sources(sources)
+    sources = set(sources)
+    return [
+        position for position, doc_id in vector_store.index_to_docstore_id.items()
+        if docstore.search(doc_id).metadata.get("source") in sources
+    ]
+
+
+def has_filter_metadata(vector_store, search_filter):
+    """
+    Whether vector_store has the document metadata the type and language terms of
+    search_filter are matched against. Without a document index, or with one built
+    while no document description was available, those terms match no chunk at all.
+    """
+    if not search_filter:
+        return True
+    document_index = getattr(vector_store, "document_index", None)
+    kinds = {kind for kind, _ in document_index.value_bitmaps} if document_index is not None else set()
+    return (
+        (not search_filter.document_types or KIND_DOCUMENT_TYPE in kinds)
+        and (not search_filter.languages or KIND_LANGUAGE in kinds)
+    )
+
+
+def filter_bitmap(vector_store, search_filter):
+    """
+    Packed bitmap of the index positions search_filter allows in vector_store,
+    combined from the per-value bitmaps precomputed in its document index and
+    cached per filter, so users with the same permissions share one bitmap.
+    Returns None for an empty filter.
+    """
+    if not search_filter:
+        return None
+    with _cache_lock:
+        cache = getattr(vector_store, "filter_bitmaps", None)
+        if cache is None:
+            cache = vector_store.filter_bitmaps = OrderedDict()
+        if search_filter in cache:
+            cache.move_to_end(search_filter)
+            return cache[search_filter]
+
+    count = vector_store.index.ntotal
+    size = (count + 7) // 8
+    document_index = getattr(vector_store, "document_index", None)
+    live = live_bitmap(vector_store)
+    bitmap = np.full(size, 0xFF, dtype=np.uint8) if live is None else live.copy()
+    if search_filter.document_types:
+        bitmap &= _metadata_bitmap(
+            document_index, KIND_DOCUMENT_TYPE, lambda value: any(term in value for term in search_filter.document_types), size
+        )
+    if search_filter.languages:
+        bitmap &= _metadata_bitmap(document_index, KIND_LANGUAGE, lambda value: value in search_filter.languages, size)
+    if search_filter.sources:
+        bitmap &= bitmap_of_positions(_positions_of_sources(vector_store, search_filter.sources), count)
+    if search_filter.hidden_sources:
+        bitmap &= ~bitmap_of_positions(_positions_of_sources(vector_store, search_filter.hidden_sources), count)
+    # Clear the padding bits past the last position
+    if count % 8:
+        bitmap[-1] &= (1 << (count % 8)) - 1
+    bitmap.flags.writeable = False
+    logger.debug(f"Built the bitmap of {search_filter} over {count} chunks")
+
+    with _cache_lock:
+        cache[search_filter] = bitmap
+        while len(cache) > FILTER_CACHE_SIZE:
+            cache.popitem(last=False)
+    return bitmap
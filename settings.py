@@ -32,3 +32,129 @@ CHAT_HISTORY_LEVEL = 5
 DOCS_IN_RETRIEVER = 4
 RELEVANCE_THRESHOLD_DOCS = 0.7
 RELEVANCE_THRESHOLD_PROMPT = 0.8
+
+# Similarity metric of newly built indexes. "cosine" stores normalized vectors
+# in an inner-product index so search scores compare directly with the
+# relevance thresholds; existing "l2" indexes are converted on next load.
+VECTOR_STORE_METRIC = "cosine"
+
+# FAISS index type per knowledge base (DEFAULT_INDEX_SETTINGS for the rest):
+#   {"type": "flat"}                                  exact search
+#   {"type": "ivf", "nlist": 4096, "nprobe": 32}      nlist clusters, nprobe searched per query
+#   {"type": "hnsw", "m": 32, "ef_search": 64}        graph with m links per node
+# Any type can store vectors compressed: "encoding": "sq8" (int8, 4x smaller),
+# "fp16" (2x) or "pq" with "pq_m" sub-quantizers (pq_m must divide the embedding
+# size; 96 gives 64x for 1536-d). With "rescore": True a full-precision copy is
+# memory-mapped from disk and the top "rescore_factor" * k candidates are
+# re-ranked exactly, so scores stay comparable with RELEVANCE_THRESHOLD_DOCS.
+# nprobe and ef_search take effect on the next load; other changes rebuild the
+# index from its stored vectors. Compare options with
+#   python -m admin.index_management benchmark <knowledge base>
+DEFAULT_INDEX_SETTINGS = {"type": "flat"}
+knowledge_base_index = {
+    "Российские стандарты": {"type": "flat"},
+    "Indonesian Regulations": {"type": "flat"},
+    "ISO Regulations": {"type": "flat"},
+}
+# Retrain IVF centroids once an index has grown to this multiple of the
+# vector count it was trained on, unless that was a full training sample.
+INDEX_RETRAIN_GROWTH = 4
+# Index builds stream chunks through extraction, chunking, embedding and the
+# index in windows of EMBEDDING_BATCH_SIZE * EMBEDDING_MAX_CONCURRENCY chunks,
+# with at most INDEX_BUILD_QUEUE_WINDOWS windows waiting to be embedded. A new
+# IVF or PQ index is trained on its first INDEX_TRAINING_SAMPLE vectors, which
+# are the only ones held in memory before the index exists.
+INDEX_BUILD_QUEUE_WINDOWS = 2
+INDEX_TRAINING_SAMPLE = 65536
+
+# Serve published indexes memory-mapped read-only, so bot worker processes on
+# one host share their pages through the OS page cache and loads are near
+# instant. Index builds still load a private writable copy.
+VECTOR_STORE_MMAP = True
+
+# Hybrid retrieval: candidates taken from each of BM25 and vector search,
+# the reciprocal-rank fusion constant, and the most chunks a query's standard
+# codes / clause numbers may match for them to be answered without an
+# embedding call.
+HYBRID_CANDIDATES = 20
+RRF_K = 60
+LEXICAL_SKIP_MAX_MATCHES = 8
+
+# Routing of queries citing a standard (GOST, SNiP, SP, SNI, ISO) to its document:
+# identifiers are read from filenames and the first CODE_TITLE_PAGES pages,
+# mistyped codes match down to CODE_MATCH_MIN_SIMILARITY (trigram Jaccard), and
+# codes naming more than CODE_ROUTE_MAX_DOCUMENTS documents are not routed.
+CODE_TITLE_PAGES = 2
+CODE_MATCH_MIN_SIMILARITY = 0.65
+CODE_ROUTE_MAX_DOCUMENTS = 3
+
+# Two-stage retrieval: in knowledge bases with at least HIERARCHICAL_MIN_DOCUMENTS
+# described documents (documents_server), chunks are searched only within the
+# HIERARCHICAL_TOP_DOCUMENTS documents whose descriptions best match the query.
+HIERARCHICAL_MIN_DOCUMENTS = 20
+HIERARCHICAL_TOP_DOCUMENTS = 5
+# Documents without a description cannot be ranked and stay candidates; when the
+# candidates would exceed this share of the chunks, the whole store is searched.
+HIERARCHICAL_MAX_CANDIDATE_SHARE = 0.5
+
+# Memory budget for knowledge base indexes kept warm in the shared registry.
+# Idle indexes are evicted least-recently-used first once it is exceeded.
+VECTOR_STORE_MEMORY_BUDGET_MB = 4096
+
+# Compact a vector store once chunks deleted by incremental re-indexing
+# exceed this fraction of the vectors still in the index. HNSW indexes keep
+# deleted vectors as tombstones that every search filters out until then.
+INDEX_COMPACTION_RATIO = 0.2
+
+# Number of index versions kept on disk per knowledge base (the published
+# one plus older builds available for rollback).
+INDEX_VERSIONS_TO_KEEP = 3
+# How often a shared index checks whether a newer version was published.
+INDEX_VERSION_CHECK_SECONDS = 5
+
+# Worker processes used to extract text from PDFs while indexing.
+PDF_EXTRACTION_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+# Compressed cache of extracted page text and blocks shared by all knowledge
+# bases, keyed by PDF content hash, so re-chunking does not re-parse the PDFs.
+TEXT_CACHE_PATH = "cache/extracted_text"
+TEXT_CACHE_MAX_MB = 4096
+
+# Chunking of extracted PDF text: chunks end at headings and clause boundaries
+# and are sized in tokens of the embedding model's tokenizer. A heading starts a
+# new chunk once the current one holds CHUNK_MIN_TOKENS.
+CHUNK_MAX_TOKENS = 400
+CHUNK_MIN_TOKENS = 80
+CHUNK_TOKEN_ENCODING = "cl100k_base"
+
+# Near-duplicate chunks (MinHash over word shingles, LSH banding) are embedded and
+# stored once; the kept chunk lists the source and page of every copy. Chunks
+# citing different numbers are never collapsed.
+DEDUP_NUM_PERM = 64
+DEDUP_BANDS = 16
+DEDUP_SHINGLE_WORDS = 5
+DEDUP_MIN_SIMILARITY = 0.9
+# Blocks repeated on this share of a PDF's pages (and on at least 3) are running
+# headers, footers or stamps and are left out of the chunks.
+RUNNING_BLOCK_PAGE_RATIO = 0.5
+
+# Embedding stage of index builds: chunks per request, requests in flight,
+# throughput target (chunks per second, 0 = unlimited) and retries on
+# rate limits or transient API errors.
+EMBEDDING_BATCH_SIZE = 256
+EMBEDDING_MAX_CONCURRENCY = 4
+EMBEDDING_TARGET_CHUNKS_PER_SECOND = 200
+EMBEDDING_MAX_RETRIES = 6
+
+# Persistent embedding cache shared by index builds and query embedding,
+# keyed by embedding model and chunk text hash.
+EMBEDDING_CACHE_PATH = "cache/embeddings.sqlite3"
+EMBEDDING_CACHE_MAX_MB = 2048
+
+# Recent query embeddings kept in memory and shared across users.
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+
+# How long the documents hidden from a user by project permissions are cached,
+# and for how many (user, knowledge base) pairs.
+PERMISSIONS_CACHE_SECONDS = 300
+PERMISSIONS_CACHE_SIZE = 4096
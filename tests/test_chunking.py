@@ -0,0 +1,77 @@
+import fitz
+
+from chunking import character_chunks, chunk_pages, chunking_report
+from pdf_extraction import PageRecord, extract_pdf
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def clause(number, words):
+    return f"{number} " + " ".join(f"w{number}.{i}" for i in range(words))
+
+
+def test_headings_and_clauses_bound_chunks():
+    pages = [
+        PageRecord("sp.pdf", 0, "", [("1 Scope", True), (clause("1.1", 20), False)]),
+        PageRecord("sp.pdf", 1, "", [
+            ("5 Loads", True), (f"{clause('5.1', 30)}\n{clause('5.2', 30)}\n{clause('5.3', 30)}", False),
+        ]),
+    ]
+
+    chunks = chunk_pages(pages, max_tokens=70, min_tokens=10, count=count_words)
+
+    assert [chunk.page_content.split("\n")[0] for chunk in chunks] == ["1 Scope", "5 Loads", "5 Loads"]
+    assert [chunk.metadata["page"] for chunk in chunks] == [0, 1, 1]
+    # Clause 5.3 moves to the next chunk whole, under its section heading
+    assert chunks[2].page_content.split("\n")[1].startswith("5.3 ")
+    assert all(count_words(chunk.page_content) <= 70 for chunk in chunks)
+
+
+def test_tiny_sections_are_merged_and_long_clauses_split():
+    pages = [PageRecord("sp.pdf", 0, "", [
+        ("Foreword", True), ("Short note.", False), ("2 Terms", True), (clause("2.1", 150), False),
+    ])]
+
+    chunks = chunk_pages(pages, max_tokens=60, min_tokens=10, count=count_words)
+
+    assert chunks[0].page_content.startswith("Foreword\nShort note.\n2 Terms")
+    assert len(chunks) == 3
+    assert all(count_words(chunk.page_content) <= 60 for chunk in chunks)
+
+
+def test_pages_without_blocks_are_chunked_by_clause():
+    pages = [PageRecord("scan.pdf", 3, f"{clause('4.1', 5)}\n{clause('4.2', 5)}\n")]
+
+    chunks = chunk_pages(pages, max_tokens=8, min_tokens=1, count=count_words)
+
+    assert [chunk.page_content[:3] for chunk in chunks] == ["4.1", "4.2"]
+    assert {chunk.metadata["page"] for chunk in chunks} == {3}
+
+
+def test_extracted_blocks_mark_headings(tmp_path):
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), "5 Loads and actions", fontsize=16)
+    page.insert_text((72, 120), "5.1 Snow loads are determined per clause 10.", fontsize=10)
+    page.insert_text((72, 140), "5.2 Wind loads are determined per clause 11.", fontsize=10)
+    doc.save(tmp_path / "sp.pdf")
+
+    result = extract_pdf(tmp_path, "sp.pdf", with_blocks=True)
+
+    headings = [text for text, is_heading in result.pages[0].blocks if is_heading]
+    assert headings == ["5 Loads and actions"]
+    assert "5.2 Wind loads" in result.pages[0].text
+
+
+def test_chunking_report_compares_splitters():
+    documents = [[PageRecord("sp.pdf", 0, clause("1.1", 400), [(clause("1.1", 400), False)])]]
+
+    rows = chunking_report(
+        documents, {"character": character_chunks, "structure": lambda pages: chunk_pages(pages, count=count_words)},
+        dimension=8, query_count=5, k=2, count=count_words,
+    )
+
+    assert [row["splitter"] for row in rows] == ["character", "structure"]
+    assert all(row["chunks"] > 0 for row in rows)
@@ -0,0 +1,100 @@
+from langchain.schema import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from dedup import NEAR_DUPLICATES_FILENAME, MinHasher, NearDuplicateIndex, chunk_references, strip_running_blocks
+from faiss_index import create_vector_store
+from index_manifest import IndexManifest
+from llm_service import LLMService
+from pdf_extraction import PageRecord
+
+BOILERPLATE = (
+    "Настоящий свод правил разработан с учетом требований федеральных законов и устанавливает "
+    "требования к проектированию зданий и сооружений, включая нагрузки, воздействия и их сочетания"
+)
+
+
+def test_near_duplicates_collapse_but_changed_values_do_not():
+    texts = [
+        f"4.1 {BOILERPLATE}. Коэффициент надежности 1,4.",
+        f"4.1  {BOILERPLATE.upper()} коэффициент надежности 1,4",
+        f"4.1 {BOILERPLATE}. Коэффициент надежности 1,6.",
+        "Снеговые нагрузки на покрытия определяют по приложению Б",
+    ]
+
+    index = NearDuplicateIndex()
+    assert [index.match(i, text) for i, text in enumerate(texts)] == [None, 0, None, None]
+
+    index = NearDuplicateIndex()
+    index.add(0, texts[0])
+    assert [index.match(i, text) for i, text in enumerate(texts[1:], 1)] == [0, None, None]
+    assert len(index) == 3
+
+
+def test_running_headers_and_page_numbers_are_stripped():
+    pages = [
+        PageRecord("sp.pdf", i, "", [
+            ("СП 20.13330.2016", False), (f"Таблица {i}", False), (f"Текст страницы {i}", False),
+            ("Стр. 2", False), (f"- {i + 1} -", False),
+        ])
+        for i in range(4)
+    ]
+
+    strip_running_blocks(pages)
+
+    assert pages[1].blocks == [("Таблица 1", False), ("Текст страницы 1", False)]
+
+
+def test_collapsed_chunks_keep_every_reference_and_survive_their_owner():
+    embeddings = DeterministicFakeEmbedding(size=8)
+    texts = [f"5.1 {BOILERPLATE}", "Ветровые нагрузки"]
+    store = create_vector_store(
+        list(zip(texts, embeddings.embed_documents(texts))), embeddings,
+        metadatas=[{"source": "old.pdf", "page": 2}, {"source": "old.pdf", "page": 3}], ids=["a-0", "a-1"],
+    )
+    manifest = IndexManifest("fake", files={
+        "old.pdf": {"sha256": "1", "chunk_ids": ["a-0", "a-1"]},
+        "new.pdf": {"sha256": "2", "chunk_ids": ["b-0", "b-1"]},
+    })
+    new_chunks = [
+        Document(page_content=f"5.1 {BOILERPLATE}.", metadata={"source": "new.pdf", "page": 4}),
+        Document(page_content="Сейсмические воздействия", metadata={"source": "new.pdf", "page": 5}),
+    ]
+    llm_service = LLMService.__new__(LLMService)
+
+    duplicates = llm_service._duplicate_index(store, manifest)
+    references = {}
+    kept, kept_ids = llm_service._collapse_duplicates(duplicates, manifest, new_chunks, ["b-0", "b-1"], references)
+    llm_service._add_references(store, references)
+
+    assert kept_ids == ["b-1"]
+    assert chunk_references(store.docstore.search("a-0")) == [("old.pdf", 2), ("new.pdf", 4)]
+    assert manifest.files["new.pdf"] == {"sha256": "2", "chunk_ids": ["b-1"], "shared_ids": ["a-0"]}
+
+    stale_ids = llm_service._release_files(store, manifest, ["old.pdf"])
+
+    assert stale_ids == ["a-1"]
+    assert chunk_references(store.docstore.search("a-0")) == [("new.pdf", 4)]
+    assert manifest.files["new.pdf"]["chunk_ids"] == ["b-1", "a-0"]
+
+
+def test_saved_signatures_are_loaded_instead_of_recomputed(tmp_path, monkeypatch):
+    embeddings = DeterministicFakeEmbedding(size=8)
+    texts = [f"5.1 {BOILERPLATE}", "Ветровые нагрузки", "Снеговые нагрузки"]
+    store = create_vector_store(
+        list(zip(texts, embeddings.embed_documents(texts))), embeddings,
+        metadatas=[{"source": "old.pdf", "page": page} for page in range(3)], ids=["a-0", "a-1", "a-2"],
+    )
+    manifest = IndexManifest("fake", files={"old.pdf": {"sha256": "1", "chunk_ids": ["a-0", "a-1", "a-2"]}})
+    llm_service = LLMService.__new__(LLMService)
+    llm_service._duplicate_index(store, manifest).save_signatures(tmp_path / NEAR_DUPLICATES_FILENAME, ["a-0", "a-1"])
+
+    hashed = []
+    signature = MinHasher.signature
+    monkeypatch.setattr(MinHasher, "signature", lambda self, text: hashed.append(text) or signature(self, text))
+    duplicates = llm_service._duplicate_index(store, manifest, tmp_path)
+
+    # Only the chunk saved without a signature is MinHashed again
+    assert hashed == ["Снеговые нагрузки"]
+    assert len(duplicates) == 3
+    assert duplicates.match(("b-0", "new.pdf"), f"5.1 {BOILERPLATE}.") == ("a-0", "old.pdf")
+    assert duplicates.match(("b-1", "new.pdf"), "5.2 Сейсмические воздействия") is None
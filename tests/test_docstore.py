@@ -0,0 +1,106 @@
+import pytest
+from langchain.schema import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+
+from docstore import BuildDocstore, SqliteDocstore, write_docstore
+
+
+@pytest.fixture
+def docstore(tmp_path):
+    documents = {
+        "a-0": Document(page_content="first", metadata={"source": "a.pdf", "page": 0}),
+        "a-1": Document(page_content="second", metadata={"source": "a.pdf", "page": 1, "document_type": "SP"}),
+        "b-0": Document(page_content="third", metadata={"source": "b.pdf", "page": "iv"}),
+    }
+    path = tmp_path / "docstore.sqlite3"
+    write_docstore(path, InMemoryDocstore(documents), {0: "a-0", 1: "b-0", 2: "a-1"})
+    store = SqliteDocstore(path)
+    yield store
+    store.close()
+
+
+def test_documents_round_trip_with_their_metadata(docstore):
+    assert docstore.search("a-1").metadata == {"source": "a.pdf", "page": 1, "document_type": "SP"}
+    assert docstore.search("b-0").metadata == {"source": "b.pdf", "page": "iv"}
+    assert docstore.search("a-1").page_content == "second"
+    assert docstore.search("missing") == "ID missing not found."
+
+
+def test_sources_are_interned(docstore):
+    assert docstore._query("SELECT COUNT(*) FROM sources")[0][0] == 2
+
+
+def test_positions_map_to_documents(docstore):
+    assert [doc.page_content for doc in docstore.documents_at([2, 0])] == ["second", "first"]
+    positions = docstore.position_map()
+    assert len(positions) == 3
+    assert positions[1] == "b-0"
+    assert list(positions.values()) == ["a-0", "b-0", "a-1"]
+
+
+def test_published_docstore_is_read_only_until_copied(docstore):
+    with pytest.raises(ValueError):
+        docstore.delete(["a-0"])
+
+    build_docstore, index_to_docstore_id = docstore.to_build()
+    build_docstore.delete(["a-0"])
+    assert index_to_docstore_id == {0: "a-0", 1: "b-0", 2: "a-1"}
+    assert "a-0" not in build_docstore and len(build_docstore) == 2
+    assert build_docstore.search("a-1").metadata == {"source": "a.pdf", "page": 1, "document_type": "SP"}
+    build_docstore.close()
+
+
+def test_build_docstore_keeps_chunks_on_disk_until_closed():
+    docstore = BuildDocstore()
+    docstore.add({"a-0": Document(page_content="first", metadata={"source": "a.pdf", "page": 0})})
+    with pytest.raises(ValueError):
+        docstore.add({"a-0": Document(page_content="again")})
+
+    document = docstore.search("a-0")
+    document.metadata["duplicates"] = [["b.pdf", 3]]
+    docstore.update("a-0", document)
+
+    assert docstore.search("a-0").metadata == {"source": "a.pdf", "page": 0, "duplicates": [["b.pdf", 3]]}
+    assert docstore.search("missing") == "ID missing not found."
+    assert docstore.path.exists()
+    docstore.close()
+    assert not docstore.path.exists()
+
+
+def test_build_docstore_is_written_in_batches(tmp_path, monkeypatch):
+    build_docstore = BuildDocstore()
+    count = 1234
+    build_docstore.add({
+        f"id-{i}": Document(page_content=f"chunk {i}", metadata={"source": f"{i % 3}.pdf", "page": i}) for i in range(count)
+    })
+    # Positions in reverse insertion order, as after deletions and re-adds
+    index_to_docstore_id = {count - 1 - i: f"id-{i}" for i in range(count)}
+    monkeypatch.setattr(BuildDocstore, "search", lambda self, doc_id: pytest.fail("read one by one"))
+
+    write_docstore(tmp_path / "docstore.sqlite3", build_docstore, index_to_docstore_id)
+    build_docstore.close()
+
+    docstore = SqliteDocstore(tmp_path / "docstore.sqlite3")
+    assert len(docstore.position_map()) == count
+    assert docstore.documents_at([0, count - 1])[0].page_content == f"chunk {count - 1}"
+    assert docstore.documents_at([0, count - 1])[1].metadata == {"source": "0.pdf", "page": 0}
+    assert docstore.source_names() == ["0.pdf", "1.pdf", "2.pdf"]
+    docstore.close()
+
+
+def test_lookups_bind_a_bounded_number_of_parameters(tmp_path, monkeypatch):
+    count = 1234
+    documents = {f"id-{i}": Document(page_content=f"chunk {i}", metadata={"source": f"{i}.pdf"}) for i in range(count)}
+    write_docstore(tmp_path / "docstore.sqlite3", InMemoryDocstore(documents), {i: f"id-{i}" for i in range(count)})
+    docstore = SqliteDocstore(tmp_path / "docstore.sqlite3")
+    bound = []
+    query = docstore._query
+    monkeypatch.setattr(docstore, "_query", lambda sql, params=(): bound.append(len(params)) or query(sql, params))
+
+    positions = list(range(count - 1, -1, -1))
+    assert [doc.page_content for doc in docstore.documents_at(positions)] == [f"chunk {i}" for i in positions]
+    assert docstore.positions_of_sources([f"{i}.pdf" for i in range(0, count, 2)] + ["missing.pdf"]) == list(
+        range(0, count, 2)
+    )
+    assert len(bound) == 5 and max(bound) <= 500
+    docstore.close()
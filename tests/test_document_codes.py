@@ -0,0 +1,83 @@
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from document_codes import extract_codes
+from faiss_index import METRIC_COSINE, close_vector_store, create_vector_store, load_faiss_store, save_faiss_store
+from retrieval import hybrid_search
+
+CHUNKS = [
+    ("SP_20.13330.2016.pdf", 0, "СП 20.13330.2016 Нагрузки и воздействия. Актуализированная редакция СНиП 2.01.07-85*"),
+    ("SP_20.13330.2016.pdf", 5, "Снеговые нагрузки определяют по пункту 10.1"),
+    ("SP_20.13330.2016.pdf", 6, "Ветровые нагрузки на здания"),
+    ("GOST_27751-2014.pdf", 0, "ГОСТ 27751-2014 Надежность строительных конструкций и оснований"),
+    ("GOST_27751-2014.pdf", 3, "Нагрузки учитывают по СП 20.13330"),
+    ("SNI 1726-2019.pdf", 0, "Tata cara perencanaan ketahanan gempa"),
+]
+
+
+@pytest.fixture
+def published_store(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    texts = [text for _, _, text in CHUNKS]
+    store = create_vector_store(
+        list(zip(texts, embeddings.embed_documents(texts))), embeddings,
+        metadatas=[{"source": source, "page": page} for source, page, _ in CHUNKS],
+        ids=[f"id-{i}" for i in range(len(CHUNKS))], metric=METRIC_COSINE,
+    )
+    save_faiss_store(store, tmp_path)
+    published = load_faiss_store(tmp_path, embeddings, read_only=True)
+    yield published
+    close_vector_store(published)
+
+
+@pytest.mark.parametrize("text, key", [
+    ("ГОСТ Р 21.1101-2013", "GOST R 21.1101.2013"),
+    ("GOST_R_21.1101.2013.pdf", "GOST R 21.1101.2013"),
+    ("по СНиП 2.01.07-85*", "SNIP 2.01.07.85"),
+    ("СП20.13330", "SP 20.13330"),
+    ("SNI 03-1726-2002", "SNI 03.1726.2002"),
+    ("ISO/IEC 27001:2013", "ISO 27001.2013"),
+])
+def test_codes_are_normalized(text, key):
+    assert [code for code, _, _ in extract_codes(text)] == [key]
+
+
+def test_words_containing_a_family_name_are_not_codes():
+    assert extract_codes("ISP 20 and GOSTINY 5") == []
+
+
+def test_lookup_prefers_the_document_named_by_the_code(published_store):
+    code_index = published_store.code_index
+
+    assert code_index.lookup("SP 20.13330") == ["SP_20.13330.2016.pdf"]
+    assert code_index.lookup("SNIP 2.01.07.85") == ["SP_20.13330.2016.pdf"]
+    assert code_index.lookup("GOST 27751.2014") == ["GOST_27751-2014.pdf"]
+    assert code_index.lookup("SNI 1726") == ["SNI 1726-2019.pdf"]
+
+
+def test_lookup_tolerates_typos_but_not_other_codes(published_store):
+    code_index = published_store.code_index
+
+    assert code_index.lookup("SP 20.13303") == ["SP_20.13330.2016.pdf"]
+    assert code_index.lookup("GOST 27751.2041") == ["GOST_27751-2014.pdf"]
+    assert code_index.lookup("SP 2.13130") == []
+
+
+def test_coded_queries_search_only_the_cited_document(published_store):
+    def embed_query(text):
+        return published_store.embedding_function.embed_query(text)
+
+    chunks, _ = hybrid_search(published_store, "Что говорит СП 20.13330 о нагрузках?", embed_query, k=5)
+
+    assert {chunk.document.metadata["source"] for chunk in chunks} == {"SP_20.13330.2016.pdf"}
+    assert len(chunks) == 3
+
+
+def test_clause_numbers_are_matched_within_the_cited_document(published_store):
+    def embed_query(text):
+        raise AssertionError("query should not be embedded")
+
+    chunks, query_embedding = hybrid_search(published_store, "СП 20.13330 п. 10.1", embed_query, k=5)
+
+    assert query_embedding is None
+    assert [chunk.position for chunk in chunks] == [1]
@@ -0,0 +1,100 @@
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from document_index import (
+    DOCUMENT_INDEX_FILENAME, DocumentIndex, description_text, descriptions_fingerprint, read_fingerprint,
+    write_document_index,
+)
+from faiss_index import METRIC_COSINE, close_vector_store, create_vector_store, load_faiss_store, save_faiss_store
+from retrieval import candidate_positions, hybrid_search, search_within
+
+DESCRIPTIONS = {
+    "loads.pdf": {"document_type": "Code of practice", "description": "Snow and wind loads", "language": "English"},
+    "fire.pdf": {"document_type": "Code of practice", "description": "Fire safety of buildings", "language": "English"},
+    "quality.pdf": {"document_type": "Standard", "description": "Quality management", "language": "English"},
+}
+
+
+def write_descriptions(path, embeddings, descriptions=DESCRIPTIONS):
+    texts = [description_text(source, metadata) for source, metadata in descriptions.items()]
+    write_document_index(path / DOCUMENT_INDEX_FILENAME, descriptions, embeddings.embed_documents(texts))
+
+
+@pytest.fixture
+def published_store(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    chunks = [(source, f"{source} chunk {i}") for source in [*DESCRIPTIONS, "scan.pdf"] for i in range(3)]
+    texts = [text for _, text in chunks]
+    store = create_vector_store(
+        list(zip(texts, embeddings.embed_documents(texts))), embeddings,
+        metadatas=[{"source": source, "page": 0} for source, _ in chunks],
+        ids=[f"id-{i}" for i in range(len(chunks))], metric=METRIC_COSINE,
+    )
+    save_faiss_store(store, tmp_path)
+    write_descriptions(tmp_path, embeddings)
+    published = load_faiss_store(tmp_path, embeddings, read_only=True)
+    yield published
+    close_vector_store(published)
+
+
+def test_top_sources_rank_documents_by_description(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    write_descriptions(tmp_path, embeddings)
+    document_index = DocumentIndex(tmp_path / DOCUMENT_INDEX_FILENAME)
+    query = embeddings.embed_query(description_text("fire.pdf", DESCRIPTIONS["fire.pdf"]))
+
+    assert len(document_index) == 3
+    assert document_index.top_sources(query, 2)[0] == "fire.pdf"
+    assert document_index.metadata["quality.pdf"] == {"document_type": "Standard", "language": "English"}
+
+
+def test_fingerprint_tracks_description_changes(tmp_path):
+    write_descriptions(tmp_path, DeterministicFakeEmbedding(size=16))
+    changed = dict(DESCRIPTIONS, **{"fire.pdf": dict(DESCRIPTIONS["fire.pdf"], description="Evacuation routes")})
+
+    assert read_fingerprint(tmp_path / DOCUMENT_INDEX_FILENAME) == descriptions_fingerprint(DESCRIPTIONS)
+    assert descriptions_fingerprint(changed) != descriptions_fingerprint(DESCRIPTIONS)
+    assert read_fingerprint(tmp_path / "missing.sqlite3") is None
+
+
+def test_chunks_are_searched_in_the_best_described_documents_only(published_store, monkeypatch):
+    monkeypatch.setattr("retrieval.HIERARCHICAL_MIN_DOCUMENTS", 3)
+    monkeypatch.setattr("retrieval.HIERARCHICAL_TOP_DOCUMENTS", 1)
+    embeddings = published_store.embedding_function
+    query = description_text("fire.pdf", DESCRIPTIONS["fire.pdf"])
+
+    chunks, _ = hybrid_search(published_store, query, embeddings.embed_query, k=10)
+
+    # scan.pdf has no description and stays searchable
+    assert {chunk.document.metadata["source"] for chunk in chunks} == {"fire.pdf", "scan.pdf"}
+
+
+def test_small_knowledge_bases_are_searched_whole(published_store):
+    embeddings = published_store.embedding_function
+
+    chunks, _ = hybrid_search(published_store, "chunk", embeddings.embed_query, k=12)
+
+    assert len({chunk.document.metadata["source"] for chunk in chunks}) == 4
+
+
+def test_candidates_covering_most_of_the_store_search_it_whole(published_store, monkeypatch):
+    monkeypatch.setattr("retrieval.HIERARCHICAL_MIN_DOCUMENTS", 3)
+    monkeypatch.setattr("retrieval.HIERARCHICAL_TOP_DOCUMENTS", 1)
+    query = published_store.embedding_function.embed_query("fire")
+
+    assert len(candidate_positions(published_store, query)) == 6
+    monkeypatch.setattr("retrieval.HIERARCHICAL_MAX_CANDIDATE_SHARE", 0.25)
+    assert candidate_positions(published_store, query) is None
+
+
+def test_large_candidate_sets_are_searched_through_the_index(published_store, monkeypatch):
+    query = published_store.embedding_function.embed_query("fire")
+    positions = [0, 2, 4, 6, 8]
+    exact = search_within(published_store, query, positions, 3)
+    monkeypatch.setattr("retrieval.EXACT_SEARCH_MAX_POSITIONS", 0)
+    filtered = search_within(published_store, query, positions, 3)
+
+    assert [chunk.document.page_content for chunk in filtered] == [chunk.document.page_content for chunk in exact]
+    allowed = {document.page_content for document in published_store.docstore.documents_at(positions)}
+    assert len(filtered) == 3
+    assert {chunk.document.page_content for chunk in filtered} <= allowed
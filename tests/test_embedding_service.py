@@ -0,0 +1,109 @@
+import httpx
+import numpy as np
+import openai
+import pytest
+
+from embedding_service import BatchEmbedder, CachedEmbeddings, EmbeddingCache, QueryEmbeddingLRU
+
+
+class CountingEmbeddings:
+    model = "test-embedding"
+
+    def __init__(self, fail_on_call=None, rate_limited_calls=0):
+        self.calls = []
+        self.fail_on_call = fail_on_call
+        self.rate_limited_calls = rate_limited_calls
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        if self.rate_limited_calls:
+            self.rate_limited_calls -= 1
+            request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+            response = httpx.Response(429, request=request, headers={"retry-after": "0"})
+            raise openai.RateLimitError("rate limited", response=response, body=None)
+        if self.fail_on_call is not None and len(self.calls) == self.fail_on_call:
+            raise RuntimeError("connection lost")
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+def make_embedder(embeddings):
+    return BatchEmbedder(
+        embeddings, batch_size=2, max_concurrency=1, target_chunks_per_second=0, max_retries=2
+    )
+
+
+def test_vectors_returned_in_input_order():
+    texts = ["a", "bbb", "cc", "dddd", "e"]
+    vectors = make_embedder(CountingEmbeddings()).embed_texts(texts)
+
+    assert vectors.dtype == np.float32
+    assert vectors[:, 0].tolist() == [1.0, 3.0, 2.0, 4.0, 1.0]
+
+
+def test_interrupted_build_resumes_from_checkpoints(tmp_path):
+    texts = ["a", "bb", "ccc", "dddd", "eeeee", "ffffff"]
+
+    failing = CountingEmbeddings(fail_on_call=3)
+    with pytest.raises(RuntimeError):
+        make_embedder(failing).embed_texts(texts, checkpoint_dir=tmp_path)
+
+    resumed = CountingEmbeddings()
+    vectors = make_embedder(resumed).embed_texts(texts, checkpoint_dir=tmp_path)
+
+    assert resumed.calls == [["eeeee", "ffffff"]]
+    assert vectors[:, 0].tolist() == [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]
+
+
+def test_rate_limited_batches_are_retried(monkeypatch):
+    monkeypatch.setattr("embedding_service.time.sleep", lambda seconds: None)
+    embeddings = CountingEmbeddings(rate_limited_calls=1)
+    embedder = make_embedder(embeddings)
+
+    vectors = embedder.embed_texts(["a", "b"])
+
+    assert len(embeddings.calls) == 2
+    assert vectors.shape == (2, 2)
+
+
+def test_cache_serves_repeated_texts(tmp_path):
+    cache = EmbeddingCache(path=tmp_path / "embeddings.sqlite3", max_bytes=1024 * 1024)
+    underlying = CountingEmbeddings()
+    embeddings = CachedEmbeddings(underlying, cache)
+
+    make_embedder(embeddings).embed_texts(["a", "bb", "ccc"])
+    vectors = make_embedder(embeddings).embed_texts(["bb", "ccc", "dddd"])
+
+    assert underlying.calls == [["a", "bb"], ["ccc"], ["dddd"]]
+    assert vectors[:, 0].tolist() == [2.0, 3.0, 4.0]
+    assert cache.stats()["hits"] == 2
+    assert embeddings.embed_documents(["a"]) == [[1.0, 1.0]]
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    # Each 2-dim float32 vector takes 8 bytes
+    cache = EmbeddingCache(path=tmp_path / "embeddings.sqlite3", max_bytes=20)
+    cache.put_many("m", ["old"], [[1.0, 1.0]])
+    cache.put_many("m", ["new"], [[2.0, 2.0]])
+    cache.get_many("m", ["old"])
+    cache.put_many("m", ["newest"], [[3.0, 3.0]])
+
+    assert cache.get_many("m", ["new"]) == [None]
+    assert cache.get_many("m", ["old"])[0].tolist() == [1.0, 1.0]
+
+
+def test_query_lru_embeds_each_text_once():
+    class QueryEmbeddings(CountingEmbeddings):
+        def embed_query(self, text):
+            return self.embed_documents([text])[0]
+
+    embeddings = QueryEmbeddings()
+    lru = QueryEmbeddingLRU(max_entries=2)
+
+    lru.get_or_embed(embeddings, "a")
+    lru.get_or_embed(embeddings, "a")
+    lru.get_or_embed(embeddings, "bb")
+    lru.get_or_embed(embeddings, "ccc")  # evicts "a"
+    lru.get_or_embed(embeddings, "a")
+
+    assert embeddings.calls == [["a"], ["bb"], ["ccc"], ["a"]]
+    assert lru.stats() == {"entries": 2, "hits": 1, "misses": 4}
@@ -0,0 +1,168 @@
+import numpy as np
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import faiss_index
+from faiss_index import (
+    METRIC_COSINE, IndexSpec, add_to_vector_store, compact_vector_store, create_vector_store, delete_from_store,
+    load_exact_vectors, load_faiss_store, rebuild_index, recall_latency_report, save_exact_vectors, save_faiss_store,
+)
+from retrieval import search_with_vectors
+from search_filter import SearchFilter, bitmap_positions, filter_bitmap
+
+SPECS = [
+    IndexSpec(),
+    IndexSpec("ivf", nlist=8, nprobe=8),
+    IndexSpec("hnsw", m=8, ef_search=64),
+    IndexSpec(encoding="sq8", rescore=True),
+    IndexSpec("ivf", nlist=8, nprobe=8, encoding="pq", pq_m=4, rescore=True),
+    IndexSpec("hnsw", m=8, encoding="fp16"),
+]
+
+
+def make_store(spec, count=400):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    texts = [f"chunk {i}" for i in range(count)]
+    vectors = embeddings.embed_documents(texts)
+    return create_vector_store(
+        list(zip(texts, vectors)), embeddings, metadatas=[{"source": text} for text in texts],
+        ids=[f"id-{i}" for i in range(count)], metric=METRIC_COSINE, spec=spec,
+    )
+
+
+@pytest.mark.parametrize("spec", SPECS, ids=repr)
+def test_index_types_find_exact_matches(spec):
+    store = make_store(spec)
+    query = store.embedding_function.embed_query("chunk 123")
+
+    hits = search_with_vectors(store, query, k=3)
+
+    assert hits[0].document.page_content == "chunk 123"
+    # fp16 without rescoring carries a small quantization error
+    assert hits[0].score == pytest.approx(1.0, abs=1e-3)
+
+
+@pytest.mark.parametrize("spec", SPECS, ids=repr)
+def test_delete_keeps_positions_and_ids_aligned(spec):
+    store = make_store(spec)
+    delete_from_store(store, [f"id-{i}" for i in range(0, 400, 2)])
+
+    assert store.index.ntotal - store.tombstones == len(store.index_to_docstore_id) == 200
+    query = store.embedding_function.embed_query("chunk 123")
+    hits = search_with_vectors(store, query, k=1)
+    assert hits[0].document.page_content == "chunk 123"
+    np.testing.assert_allclose(np.linalg.norm(hits[0].vector), 1.0, atol=1e-3)
+
+
+def test_rebuild_switches_index_type_without_reembedding():
+    store = make_store(IndexSpec())
+    rebuild_index(store, IndexSpec("hnsw", m=8))
+
+    query = store.embedding_function.embed_query("chunk 7")
+    assert search_with_vectors(store, query, k=1)[0].document.page_content == "chunk 7"
+
+
+def test_rescoring_returns_exact_scores_from_a_quantized_index(tmp_path):
+    store = make_store(IndexSpec(encoding="pq", pq_m=4, rescore=True, rescore_factor=8))
+    query = store.embedding_function.embed_query("chunk 42")
+
+    hits = search_with_vectors(store, query, k=3)
+
+    assert hits[0].document.page_content == "chunk 42"
+    assert hits[0].score == pytest.approx(1.0, abs=1e-6)
+
+    save_exact_vectors(store, tmp_path)
+    store.exact_vectors = None
+    load_exact_vectors(store, tmp_path)
+    assert isinstance(store.exact_vectors, np.memmap)
+    assert search_with_vectors(store, query, k=1)[0].score == pytest.approx(1.0, abs=1e-6)
+
+
+@pytest.mark.parametrize("spec", SPECS[:3], ids=repr)
+def test_memory_mapped_store_searches_like_the_original(tmp_path, spec):
+    store = make_store(spec)
+    save_faiss_store(store, tmp_path)
+    query = store.embedding_function.embed_query("chunk 5")
+
+    mapped = load_faiss_store(tmp_path, store.embedding_function, read_only=True)
+
+    assert mapped.memory_mapped
+    assert [hit.position for hit in search_with_vectors(mapped, query, k=5)] == [
+        hit.position for hit in search_with_vectors(store, query, k=5)
+    ]
+    with pytest.raises(ValueError):
+        add_to_vector_store(mapped, [("new", query)], metadatas=[{}], ids=["new"])
+
+
+def test_report_has_full_recall_for_exact_search():
+    vectors = np.random.default_rng(0).normal(size=(500, 16)).astype(np.float32)
+
+    specs = [IndexSpec(), IndexSpec("ivf", nlist=8, nprobe=1), IndexSpec(encoding="sq8")]
+    rows = recall_latency_report(vectors, specs, query_count=50, k=5)
+
+    assert rows[0]["recall@5"] == 1.0
+    assert rows[0]["memory_saved"] == "0%"
+    assert 0 < rows[1]["recall@5"] <= 1.0
+    assert rows[2]["memory_saved"] == "75%"
+
+
+def test_streamed_adds_keep_exact_vectors_in_step():
+    store = make_store(IndexSpec(encoding="sq8", rescore=True), count=10)
+    embeddings = store.embedding_function
+    for window in range(5):
+        texts = [f"streamed {window}.{i}" for i in range(7)]
+        add_to_vector_store(
+            store, list(zip(texts, embeddings.embed_documents(texts))), metadatas=[{}] * 7,
+            ids=[f"s-{window}-{i}" for i in range(7)],
+        )
+
+    assert len(store.exact_vectors) == store.index.ntotal == 45
+    hits = search_with_vectors(store, embeddings.embed_query("streamed 3.4"), k=1)
+    assert hits[0].document.page_content == "streamed 3.4"
+    assert hits[0].score == pytest.approx(1.0, abs=1e-5)
+
+
+def test_deletes_from_a_large_ivf_index_do_not_refill_it(monkeypatch):
+    store = make_store(IndexSpec("ivf", nlist=64, nprobe=64, encoding="sq8", rescore=True), count=20000)
+    index = store.index
+    monkeypatch.setattr(faiss_index, "_stored_vectors", None)  # Nothing is reconstructed
+
+    delete_from_store(store, [f"id-{i}" for i in range(0, 20000, 7)])
+    delete_from_store(store, ["id-19997", "id-1"])
+
+    assert store.index is index
+    assert index.ntotal == len(store.index_to_docstore_id) == len(store.exact_vectors) == 20000 - 2858 - 2
+    assert sorted(store.index_to_docstore_id) == list(range(index.ntotal))
+    for text in ("chunk 2", "chunk 12345", "chunk 19998"):
+        hit = search_with_vectors(store, store.embedding_function.embed_query(text), k=1)[0]
+        assert hit.document.page_content == text
+        assert hit.score == pytest.approx(1.0, abs=1e-5)
+        np.testing.assert_allclose(index.reconstruct(hit.position), hit.vector, atol=1e-2)
+
+
+def test_hnsw_deletes_leave_tombstones_until_compaction(tmp_path):
+    store = make_store(IndexSpec("hnsw", m=8), count=2000)
+    index = store.index
+    deleted = [f"id-{i}" for i in range(0, 2000, 2)]
+    query = store.embedding_function.embed_query("chunk 100")
+
+    delete_from_store(store, deleted)
+
+    assert store.index is index and index.ntotal == 2000 and store.tombstones == 1000
+    hits = search_with_vectors(store, query, k=10)
+    assert len(hits) == 10 and all(hit.position % 2 for hit in hits)
+
+    add_to_vector_store(store, [("chunk 100", query)], metadatas=[{}], ids=["again"])
+    assert store.index_to_docstore_id[2000] == "again"
+    save_faiss_store(store, tmp_path)
+    loaded = load_faiss_store(tmp_path, store.embedding_function, read_only=True)
+    assert loaded.tombstones == 1000
+    assert search_with_vectors(loaded, query, k=1)[0].document.metadata == {}
+    allowed = filter_bitmap(loaded, SearchFilter(hidden_sources=["chunk 1"]))
+    assert bitmap_positions(allowed, 2001).tolist() == list(range(3, 2000, 2)) + [2000]
+
+    compact_vector_store(store)
+
+    assert store.tombstones == 0 and store.index.ntotal == len(store.index_to_docstore_id) == 1001
+    assert search_with_vectors(store, query, k=1)[0].document.id == "again"
+    assert search_with_vectors(store, store.embedding_function.embed_query("chunk 7"), k=1)[0].position == 3
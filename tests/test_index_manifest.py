@@ -0,0 +1,98 @@
+import os
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from faiss_index import create_vector_store
+from index_manifest import IndexManifest, file_fingerprint, file_sha256
+from index_storage import IndexStorage
+from llm_service import LLMService
+
+
+def write_pdf(folder, filename, content):
+    path = folder / filename
+    path.write_bytes(content)
+    return path
+
+
+def manifest_of(folder, filenames):
+    return IndexManifest("fake", files={
+        filename: dict(file_fingerprint(folder / filename), chunk_ids=[f"{filename}-0"]) for filename in filenames
+    })
+
+
+def test_diff_reports_added_changed_removed_and_unchanged_files(tmp_path):
+    for filename in ("same.pdf", "edited.pdf", "grown.pdf", "gone.pdf"):
+        write_pdf(tmp_path, filename, b"%PDF original")
+    manifest = manifest_of(tmp_path, ["same.pdf", "edited.pdf", "grown.pdf", "gone.pdf"])
+    # Same size, new content and mtime
+    write_pdf(tmp_path, "edited.pdf", b"%PDF modified")
+    os.utime(tmp_path / "edited.pdf", (1, 1))
+    write_pdf(tmp_path, "grown.pdf", b"%PDF original, then some")
+    os.remove(tmp_path / "gone.pdf")
+    write_pdf(tmp_path, "new.pdf", b"%PDF new")
+
+    diff = manifest.diff(tmp_path, ["edited.pdf", "grown.pdf", "new.pdf", "same.pdf"])
+
+    assert diff.added == ["new.pdf"]
+    assert diff.changed == ["edited.pdf", "grown.pdf"]
+    assert diff.removed == ["gone.pdf"]
+    assert diff.has_changes
+    assert diff.fingerprints["grown.pdf"]["sha256"] == file_sha256(tmp_path / "grown.pdf")
+
+
+def test_touched_file_with_the_same_content_is_unchanged(tmp_path):
+    write_pdf(tmp_path, "a.pdf", b"%PDF content")
+    manifest = manifest_of(tmp_path, ["a.pdf"])
+    os.utime(tmp_path / "a.pdf", (1, 1))
+
+    diff = manifest.diff(tmp_path, ["a.pdf"])
+
+    assert not diff.has_changes
+    assert diff.fingerprints["a.pdf"]["mtime"] == 1
+
+
+def test_hash_is_trusted_while_mtime_and_size_are_unchanged(tmp_path):
+    write_pdf(tmp_path, "a.pdf", b"%PDF content")
+    manifest = manifest_of(tmp_path, ["a.pdf"])
+    manifest.files["a.pdf"]["sha256"] = "recorded"
+
+    diff = manifest.diff(tmp_path, ["a.pdf"])
+
+    assert not diff.has_changes
+    assert diff.fingerprints["a.pdf"]["sha256"] == "recorded"
+
+
+def test_manifest_is_rebuilt_from_a_legacy_store(tmp_path):
+    write_pdf(tmp_path, "a.pdf", b"%PDF a")
+    embeddings = DeterministicFakeEmbedding(size=8)
+    texts = ["a first", "gone", "a second"]
+    store = create_vector_store(
+        list(zip(texts, embeddings.embed_documents(texts))), embeddings,
+        metadatas=[{"source": "a.pdf"}, {"source": "gone.pdf"}, {"source": "a.pdf"}], ids=["a-0", "g-0", "a-1"],
+    )
+
+    manifest = IndexManifest.from_vector_store(store, "fake", tmp_path, ["a.pdf"])
+
+    assert manifest.files["a.pdf"]["chunk_ids"] == ["a-0", "a-1"]
+    assert manifest.files["a.pdf"]["sha256"] == file_sha256(tmp_path / "a.pdf")
+    assert manifest.chunk_count == 3
+    diff = manifest.diff(tmp_path, ["a.pdf"])
+    assert diff.removed == ["gone.pdf"] and not diff.added and not diff.changed
+
+
+def test_folder_change_probe_compares_files_with_the_published_manifest(tmp_path):
+    llm_service = LLMService.__new__(LLMService)
+    write_pdf(tmp_path, "a.pdf", b"%PDF a")
+    assert llm_service._folder_changed(tmp_path)  # Nothing published yet
+
+    storage = IndexStorage(tmp_path)
+    version, version_dir = storage.create_version()
+    manifest_of(tmp_path, ["a.pdf"]).save(version_dir)
+    storage.publish(version)
+    assert not llm_service._folder_changed(tmp_path)
+
+    write_pdf(tmp_path, "b.pdf", b"%PDF b")
+    assert llm_service._folder_changed(tmp_path)
+    (tmp_path / "b.pdf").unlink()
+    (tmp_path / "a.pdf").unlink()
+    assert llm_service._folder_changed(tmp_path)
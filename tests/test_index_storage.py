@@ -0,0 +1,78 @@
+import pytest
+
+import index_storage
+from index_storage import IndexStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return IndexStorage(tmp_path)
+
+
+def build(storage):
+    version, version_dir = storage.create_version()
+    (version_dir / "index.faiss").write_bytes(version.encode())
+    return version
+
+
+def test_failed_publish_leaves_current_unchanged(storage, monkeypatch):
+    live = build(storage)
+    storage.publish(live)
+    candidate = build(storage)
+
+    with pytest.raises(FileNotFoundError):
+        storage.publish("missing")
+
+    def fail_replace(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(index_storage.os, "replace", fail_replace)
+    with pytest.raises(OSError):
+        storage.publish(candidate)
+
+    assert storage.current_version() == live
+    assert storage.current_path() == storage.versions_dir / live
+
+
+def test_discarded_build_is_never_published(storage):
+    live = build(storage)
+    storage.publish(live)
+    failed = build(storage)
+
+    storage.discard_version(failed)
+
+    assert storage.versions() == [live]
+    assert storage.current_version() == live
+    with pytest.raises(ValueError):
+        storage.discard_version(live)
+
+
+def test_rollback_returns_to_the_previous_version(storage):
+    first, second, third = build(storage), build(storage), build(storage)
+    storage.publish(third)
+
+    assert storage.rollback() == second
+    assert storage.current_version() == second
+    assert storage.rollback() == first
+    assert storage.rollback() is None
+    assert storage.current_version() == first
+
+
+def test_prune_keeps_the_live_version(storage):
+    versions = [build(storage) for _ in range(4)]
+    storage.publish(versions[0])
+
+    storage.prune(keep=2)
+
+    assert storage.versions() == [versions[0], *versions[2:]]
+    storage.prune(keep=0)
+    assert storage.versions() == [versions[0]]
+    assert storage.current_path() == storage.versions_dir / versions[0]
+
+
+def test_versions_sort_after_second_resolution_names_of_older_builds(storage):
+    version = build(storage)
+    older = f"{version[:15]}-abcdef"
+    (storage.versions_dir / older).mkdir()
+
+    assert storage.versions() == [older, version]
@@ -0,0 +1,84 @@
+import datetime
+import logging
+from types import SimpleNamespace
+
+import fitz
+import pytest
+
+import ingestion
+import text_cache
+from ingestion import IngestionArtifact
+from llm_service import LLMService
+from text_cache import TextCache
+
+
+@pytest.fixture(autouse=True)
+def isolated_text_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(text_cache, "_text_cache", TextCache(tmp_path / "cache"))
+
+
+def write_pdf(path, texts):
+    doc = fitz.open()
+    for text in texts:
+        page = doc.new_page()
+        if text:
+            page.insert_text((72, 72), text)
+    doc.set_toc([[1, "1 Scope", 1], [2, "1.1 Terms", 1], [1, "2 Loads", 3]][:len(texts)])
+    doc.save(path)
+
+
+def test_one_pass_records_empty_pages_sample_and_outline(tmp_path):
+    write_pdf(tmp_path / "sp.pdf", ["1 Scope of the code", "", "2 Loads"])
+    write_pdf(tmp_path / "full.pdf", ["Text"])
+
+    artifact = IngestionArtifact(tmp_path).refresh(["sp.pdf", "full.pdf"])
+
+    entry = artifact.files["sp.pdf"]
+    assert (entry["pages"], entry["empty_pages"]) == (3, [1])
+    assert entry["sample"].startswith("1 Scope of the code")
+    assert [title for level, title, _ in entry["toc"] if level == 1] == ["1 Scope", "2 Loads"]
+    assert artifact.empty_documents() == ["sp.pdf"]
+    assert IngestionArtifact(tmp_path).files == artifact.files
+
+
+def test_only_new_or_changed_files_are_parsed_again(tmp_path, monkeypatch):
+    write_pdf(tmp_path / "a.pdf", ["A"])
+    write_pdf(tmp_path / "b.pdf", ["B"])
+    IngestionArtifact(tmp_path).refresh(["a.pdf", "b.pdf"])
+    parsed = []
+    extract_pdfs_cached = ingestion.extract_pdfs_cached
+
+    def counting_extract_pdfs(folder_path, fingerprints):
+        parsed.extend(fingerprints)
+        return extract_pdfs_cached(folder_path, fingerprints)
+
+    monkeypatch.setattr(ingestion, "extract_pdfs_cached", counting_extract_pdfs)
+    write_pdf(tmp_path / "b.pdf", ["B", ""])
+
+    artifact = IngestionArtifact(tmp_path).refresh(["b.pdf"])
+
+    assert parsed == ["b.pdf"]
+    assert list(artifact.files) == ["b.pdf"]
+    assert artifact.empty_documents() == ["b.pdf"]
+
+
+def test_metadata_is_described_again_after_a_prompt_change(tmp_path, caplog):
+    write_pdf(tmp_path / "sp.pdf", ["1 Scope of the code", "", "2 Loads"])
+    (tmp_path / "broken.pdf").write_bytes(b"%PDF-1.7 truncated")
+    prompts = []
+    llm_service = LLMService.__new__(LLMService)
+    llm_service.llm = SimpleNamespace(invoke=lambda prompt: prompts.append(prompt) or SimpleNamespace(
+        content="Document Type: Code\nDescription: Loads\nLanguage: English"
+    ))
+    # Both files were analyzed after their last change, with the previous prompt
+    analyzed = datetime.datetime.now() + datetime.timedelta(minutes=1)
+    db_service = SimpleNamespace(get_file_dates=lambda path: (None, analyzed))
+
+    with caplog.at_level(logging.WARNING, logger="llm_service"):
+        metadata = llm_service.get_metadata(str(tmp_path), db_service)
+
+    assert [entry["filename"] for entry in metadata] == ["sp.pdf"]
+    assert prompts[0].count("Table of contents:\n1 Scope\n2 Loads") == 1
+    assert "broken.pdf" in caplog.text
+    assert IngestionArtifact(tmp_path).described("sp.pdf")
+    assert llm_service.get_metadata(str(tmp_path), db_service) == [] and len(prompts) == 1
@@ -0,0 +1,108 @@
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from faiss_index import METRIC_COSINE, close_vector_store, create_vector_store, load_faiss_store, save_faiss_store
+from lexical_index import query_phrases
+from retrieval import hybrid_search, rrf_fuse
+
+TEXTS = [
+    "Нагрузки и воздействия приведены в СП 20.13330.2016",
+    "Пожарная безопасность зданий по СП 2.13130.2020",
+    "Foundations are designed to ISO 9001:2015 quality rules",
+    "Snow loads depend on the climate region",
+    "Wind loads on tall buildings",
+]
+
+
+@pytest.fixture
+def published_store(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    store = create_vector_store(
+        list(zip(TEXTS, embeddings.embed_documents(TEXTS))), embeddings,
+        metadatas=[{"source": f"doc{i}.pdf"} for i in range(len(TEXTS))],
+        ids=[f"id-{i}" for i in range(len(TEXTS))], metric=METRIC_COSINE,
+    )
+    save_faiss_store(store, tmp_path)
+    published = load_faiss_store(tmp_path, embeddings, read_only=True)
+    yield published
+    close_vector_store(published)
+
+
+def test_query_phrases_split_codes_like_the_tokenizer():
+    terms, codes = query_phrases('What does SP 20.13330 say about "loads"?')
+
+    assert codes == ['"20 13330"']
+    assert '"SP"' in terms and '"loads"' in terms and '""""' not in terms
+
+
+def test_code_matches_require_the_digit_groups_in_order(published_store):
+    lexical_index = published_store.lexical_index
+
+    assert lexical_index.code_matches("СП 20.13330", limit=5) == [0]
+    assert lexical_index.code_matches("13330.20", limit=5) == []
+    assert lexical_index.code_matches("snow loads", limit=5) == []
+
+
+def test_plain_numbers_are_terms_not_codes(published_store):
+    terms, codes = query_phrases("how many floors for 5 storeys")
+
+    assert codes == []
+    assert '"5"' in terms
+    assert published_store.lexical_index.code_matches("rules of 2016", limit=5) == []
+
+
+def test_plain_number_does_not_skip_the_embedding_call(published_store):
+    embedded = []
+
+    def embed_query(text):
+        embedded.append(text)
+        return published_store.embedding_function.embed_query(text)
+
+    chunks, query_embedding = hybrid_search(published_store, "loads of 2016", embed_query, k=3)
+
+    assert query_embedding is not None and embedded == ["loads of 2016"]
+    assert not any(chunk.lexical_match for chunk in chunks)
+
+
+def test_bm25_ranks_chunks_with_more_query_terms_first(published_store):
+    hits = published_store.lexical_index.search("snow loads", k=5)
+
+    assert hits[0][0] == 3
+    assert {position for position, _ in hits} == {3, 4}
+    assert all(score > 0 for _, score in hits)
+
+
+def test_rrf_prefers_items_ranked_well_by_both():
+    assert rrf_fuse([["a", "b", "c"], ["b", "d", "a"]], k=3) == ["b", "a", "d"]
+
+
+def test_exact_code_match_skips_the_embedding_call(published_store):
+    def embed_query(text):
+        raise AssertionError("query should not be embedded")
+
+    chunks, query_embedding = hybrid_search(published_store, "Что говорит ISO 9001:2015?", embed_query, k=4)
+
+    assert query_embedding is None
+    assert [chunk.position for chunk in chunks] == [2]
+    assert chunks[0].is_relevant(threshold=1.0)
+
+
+def test_hybrid_search_fuses_lexical_and_vector_hits(published_store):
+    embed_query = published_store.embedding_function.embed_query
+
+    chunks, query_embedding = hybrid_search(published_store, TEXTS[4], embed_query, k=3)
+
+    assert query_embedding is not None
+    assert chunks[0].position == 4
+    assert chunks[0].similarity == pytest.approx(1.0, abs=1e-5)
+    assert all(chunk.similarity is not None and not chunk.lexical_match for chunk in chunks)
+
+
+def test_restriction_to_many_positions_stays_within_sqlite_limits(published_store):
+    lexical_index = published_store.lexical_index
+    positions = [3, 4, *range(len(TEXTS), 300_000)]
+
+    hits = lexical_index.search("loads", 10, positions=positions)
+
+    assert sorted(position for position, _ in hits) == [3, 4]
+    assert lexical_index.code_matches("СП 20.13330", 10, positions=positions) == []
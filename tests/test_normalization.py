@@ -0,0 +1,33 @@
+from index_manifest import IndexManifest
+from normalization import normalization_report, normalize_pages, normalize_text
+from pdf_extraction import PageRecord
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_hyphenated_line_breaks_follow_language_rules():
+    assert normalize_text("требования конструк-\nции и кто-\nто", "Russian") == "требования конструкции и кто-то"
+    assert normalize_text("anak-\nanak membaca bu-\nku", "Indonesian") == "anak-anak membaca buku"
+    assert normalize_text("self-\ncontained rein-\nforcement", "English") == "self-contained reinforcement"
+    assert normalize_text("Санкт-\nПетербург, de­sign", "Russian") == "Санкт-Петербург, design"
+
+
+def test_leaders_spacing_and_mixed_scripts_are_cleaned():
+    text = "5 Нагрузки . . . . . . 12\n\n\nсм.  CП 20.13330 ( раздел 4 ) ,\tтабл. 1"
+
+    assert normalize_text(text, "Russian") == "5 Нагрузки 12\nсм. СП 20.13330 (раздел 4), табл. 1"
+    assert normalize_text("Eﬀective lоad", "English") == "Effective load"
+
+
+def test_normalized_pages_report_token_savings():
+    blocks = [("Раздел 1 . . . . . . . . 7", False), ("нагруз-\nки  и  воздействия", False)]
+    pages = [PageRecord("sp.pdf", i, "".join(f"{text}\n" for text, _ in blocks), list(blocks)) for i in range(2)]
+
+    raw_tokens, tokens = normalize_pages(pages, "Russian", count=count_words)
+
+    assert (raw_tokens, tokens) == (30, 12)
+    assert pages[0].text == "Раздел 1 7\nнагрузки и воздействия\n"
+    manifest = IndexManifest("fake", files={"sp.pdf": {"sha256": "1", "tokens": [raw_tokens, tokens]}, "old.pdf": {}})
+    assert normalization_report(manifest) == {"files": 1, "raw_tokens": 30, "tokens": 12, "saved": "60.0%"}
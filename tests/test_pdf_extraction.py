@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz
+import pytest
+
+import pdf_extraction
+from pdf_extraction import extract_pdfs
+
+
+def write_pdf(path, page_count):
+    doc = fitz.open()
+    for page_number in range(page_count):
+        page = doc.new_page()
+        page.insert_text((72, 100), f"{path.stem} page {page_number}", fontsize=11)
+    doc.save(str(path))
+    doc.close()
+
+
+@pytest.fixture
+def folder(tmp_path):
+    # Larger files first, so workers finish them out of order
+    for i, page_count in enumerate([40, 20, 1, 10, 1, 5]):
+        write_pdf(tmp_path / f"doc{i}.pdf", page_count)
+    return tmp_path
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_results_follow_the_input_order(folder, workers):
+    filenames = [f"doc{i}.pdf" for i in (2, 0, 5, 1, 4, 3)]
+
+    results = list(extract_pdfs(folder, filenames, workers=workers))
+
+    assert [result.filename for result in results] == filenames
+    assert all(result.ok for result in results)
+    assert [len(result.pages) for result in results] == [1, 40, 5, 20, 1, 10]
+    assert results[1].pages[3].text.strip() == "doc0 page 3"
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_truncated_pdf_does_not_fail_the_batch(folder, workers):
+    data = (folder / "doc3.pdf").read_bytes()
+    (folder / "truncated.pdf").write_bytes(data[:len(data) // 8])
+    filenames = ["doc1.pdf", "truncated.pdf", "doc2.pdf", "doc3.pdf"]
+
+    results = list(extract_pdfs(folder, filenames, workers=workers))
+
+    assert [result.filename for result in results] == filenames
+    assert [result.ok for result in results] == [True, False, True, True]
+    assert results[1].error
+    assert len(results[3].pages) == 10
+
+
+def test_pool_started_from_a_background_thread_does_not_fork(folder, monkeypatch):
+    start_methods = []
+    process_pool = pdf_extraction.ProcessPoolExecutor
+
+    def recording_pool(*args, mp_context=None, **kwargs):
+        start_methods.append(mp_context.get_start_method() if mp_context else "fork")
+        return process_pool(*args, mp_context=mp_context, **kwargs)
+
+    monkeypatch.setattr(pdf_extraction, "ProcessPoolExecutor", recording_pool)
+    filenames = ["doc2.pdf", "doc5.pdf", "doc4.pdf"]
+
+    with ThreadPoolExecutor(max_workers=1) as background:
+        results = background.submit(lambda: list(extract_pdfs(folder, filenames, workers=2))).result()
+
+    assert [len(result.pages) for result in results] == [1, 5, 1]
+    assert start_methods and "fork" not in start_methods
@@ -0,0 +1,134 @@
+import logging
+import os
+
+from langchain.schema import Document
+
+import db_service
+from db_service import PROJECT_PERMISSIONS_SCHEMA, DatabaseService
+from llm_service import LLMService
+from permissions import DocumentPermissions
+from retrieval import RetrievedChunk
+
+
+def test_hidden_sources_are_cached_per_user_and_folder():
+    calls = []
+
+    def fetch(user_id, folder_path):
+        calls.append((user_id, folder_path))
+        return [os.path.join(folder_path, "secret.pdf")] if user_id == 1 else []
+
+    permissions = DocumentPermissions(fetch=fetch, ttl=60)
+
+    assert permissions.hidden_sources(1, "kb") == {"secret.pdf"}
+    assert permissions.hidden_sources(1, "kb/") == {"secret.pdf"}
+    assert permissions.hidden_sources(2, "kb") == frozenset()
+    assert len(calls) == 2
+
+    permissions.invalidate(1)
+    permissions.hidden_sources(1, "kb")
+    assert len(calls) == 3
+
+
+def test_references_are_hidden_only_in_their_own_knowledge_base():
+    contracts, standards = object(), object()
+    chunks = [
+        RetrievedChunk(Document(page_content="a", metadata={
+            "source": "terms.pdf", "page": 1, "duplicates": [["secret.pdf", 4], ["public.pdf", 2]],
+        }), None, 1.0, 0, vector_store=contracts),
+        RetrievedChunk(Document(page_content="b", metadata={"source": "secret.pdf", "page": 7}), None, 1.0, 0,
+                       vector_store=standards),
+    ]
+    llm_service = LLMService.__new__(LLMService)
+
+    references = llm_service._visible_references(chunks, {contracts: {"secret.pdf"}, standards: set()})
+
+    assert references == {"terms.pdf": {1}, "public.pdf": {2}, "secret.pdf": {7}}
+    assert "secret.pdf" not in llm_service._visible_references(chunks, {standards: {"secret.pdf"}, contracts: {"secret.pdf"}})
+
+
+def test_unreadable_permissions_are_not_cached():
+    results = [None, ["kb/secret.pdf"]]
+    permissions = DocumentPermissions(fetch=lambda user_id, folder_path: results.pop(0), ttl=60)
+
+    assert permissions.hidden_sources(1, "kb") is None
+    assert permissions.hidden_sources(1, "kb") == {"secret.pdf"}
+
+
+class FakeCursor:
+    def __init__(self, schema_installed, rows=None, error=None):
+        self.schema_installed = schema_installed
+        self.rows = rows or []
+        self.error = error
+        self.queries = []
+        self.rowcount = len(self.rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.queries.append((query, params) if params else query)
+        if "information_schema" not in query and self.error is not None:
+            raise self.error
+
+    def fetchone(self):
+        return (self.schema_installed, self.schema_installed)
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+    def close(self):
+        pass
+
+
+def database(cursor, monkeypatch):
+    service = DatabaseService()
+    monkeypatch.setattr(service, "connect", lambda: FakeConnection(cursor))
+    return service
+
+
+def test_database_without_project_schema_hides_nothing(monkeypatch, caplog):
+    monkeypatch.setattr(db_service, "_project_schema_warned", False)
+    cursor = FakeCursor(schema_installed=False)
+    service = database(cursor, monkeypatch)
+
+    with caplog.at_level(logging.WARNING, logger="db_service"):
+        assert service.get_hidden_documents(1, "kb") == []
+        assert service.get_hidden_documents(2, "kb") == []
+        assert service.project_schema_installed() is False
+
+    # Only the schema probes ran; the permissions query would fail on this schema
+    assert len(cursor.queries) == 3
+    # Reported once per process, not on every question
+    assert len([record for record in caplog.records if "not installed" in record.message]) == 1
+
+
+def test_project_schema_and_assignments(monkeypatch):
+    cursor = FakeCursor(True, rows=[("kb/a_1.pdf",), ("kb/sub/b.pdf",)])
+    service = database(cursor, monkeypatch)
+
+    service.install_project_schema()
+    assert service.assign_project("kb/a_1", "Tower A") == 2
+
+    assert cursor.queries[0] == PROJECT_PERMISSIONS_SCHEMA
+    _, params = cursor.queries[1]
+    # Underscores are LIKE wildcards and must not match other files
+    assert params == ("Tower A", "kb/a\\_1", os.path.join("kb/a\\_1", "") + "%")
+
+
+def test_permission_query_errors_fail_closed(monkeypatch):
+    hidden = database(FakeCursor(True, rows=[("kb/secret.pdf",)]), monkeypatch).get_hidden_documents(1, "kb")
+    failed = database(FakeCursor(True, error=RuntimeError("connection lost")), monkeypatch).get_hidden_documents(1, "kb")
+
+    assert hidden == ["kb/secret.pdf"]
+    assert failed is None
@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+from pipeline import bounded_stream, windows
+
+
+def test_producer_stays_within_the_queue_bound():
+    produced = []
+    ahead = []
+
+    def source():
+        for i in range(50):
+            produced.append(i)
+            yield i
+
+    for consumed, item in enumerate(bounded_stream(source(), maxsize=2)):
+        ahead.append(len(produced) - consumed)
+        threading.Event().wait(0.001)
+
+    # The queued items, the one being put and the one being consumed
+    assert max(ahead) <= 4
+    assert len(produced) == 50
+
+
+def test_errors_reach_the_consumer_and_stopping_stops_the_producer():
+    def failing():
+        yield 1
+        raise ValueError("bad page")
+
+    with pytest.raises(ValueError, match="bad page"):
+        list(bounded_stream(failing(), maxsize=1))
+
+    closed = threading.Event()
+
+    def endless():
+        try:
+            while True:
+                yield 0
+        finally:
+            closed.set()
+
+    stream = bounded_stream(endless(), maxsize=1)
+    next(stream)
+    stream.close()
+    assert closed.is_set()
+
+
+def test_windows_regroup_batches():
+    batches = [(["a", "b", "c"], [1, 2, 3]), ([], []), (["d", "e"], [4, 5])]
+
+    assert list(windows(batches, 2)) == [(["a", "b"], [1, 2]), (["c", "d"], [3, 4]), (["e"], [5])]
@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+from langchain.schema import Document
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from faiss_index import METRIC_COSINE, IndexSpec, create_vector_store, is_cosine_store, rebuild_index
+from retrieval import cosine_similarities, federated_search, relevance_similarities, search_with_vectors
+
+
+@pytest.fixture
+def vector_store():
+    texts = [
+        "СП 20.13330.2016 Нагрузки и воздействия",
+        "ГОСТ 27751-2014 Надежность строительных конструкций",
+        "ISO 9001:2015 Quality management systems",
+        "Clause 7.5 Documented information shall be controlled",
+    ]
+    documents = [Document(page_content=text, metadata={"source": f"doc{i}.pdf", "page": i}) for i, text in enumerate(texts)]
+    return FAISS.from_documents(documents, DeterministicFakeEmbedding(size=16))
+
+
+def make_cosine_store(texts):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    # Scale the vectors so normalization actually matters
+    vectors = [np.array(vector) * (i + 2) for i, vector in enumerate(embeddings.embed_documents(texts))]
+    return create_vector_store(
+        list(zip(texts, vectors)), embeddings, metadatas=[{"source": text} for text in texts],
+        ids=[f"id-{i}" for i in range(len(texts))], metric=METRIC_COSINE,
+    )
+
+
+def test_hits_carry_their_stored_vectors(vector_store):
+    embeddings = vector_store.embedding_function
+    query = embeddings.embed_query("ISO 9001:2015 Quality management systems")
+
+    hits = search_with_vectors(vector_store, query, k=2)
+
+    assert len(hits) == 2
+    assert hits[0].document.metadata["source"] == "doc2.pdf"
+    expected = embeddings.embed_documents([hits[0].document.page_content])[0]
+    np.testing.assert_allclose(hits[0].vector, expected, rtol=1e-6)
+
+
+def test_k_larger_than_index_returns_all_hits(vector_store):
+    query = vector_store.embedding_function.embed_query("anything")
+    assert len(search_with_vectors(vector_store, query, k=10)) == 4
+
+
+def test_cosine_similarities_match_pairwise_formula():
+    query = np.array([1.0, 2.0, 0.0])
+    vectors = np.array([[1.0, 2.0, 0.0], [0.0, 0.0, 3.0], [0.0, 0.0, 0.0], [-1.0, -2.0, 0.0]])
+
+    similarities = cosine_similarities(query, vectors)
+
+    np.testing.assert_allclose(similarities, [1.0, 0.0, 0.0, -1.0], atol=1e-6)
+
+
+def test_cosine_store_scores_are_cosine_similarities():
+    texts = ["alpha", "beta", "gamma", "delta"]
+    store = make_cosine_store(texts)
+    query = np.array(store.embedding_function.embed_query("beta")) * 5
+
+    hits = search_with_vectors(store, query, k=4)
+    raw = np.array(store.embedding_function.embed_documents([hit.document.page_content for hit in hits]))
+
+    assert hits[0].document.page_content == "beta"
+    np.testing.assert_allclose(relevance_similarities(store, query, hits), cosine_similarities(query, raw), atol=1e-5)
+
+
+def test_l2_store_converts_to_cosine_without_reembedding(vector_store):
+    query = vector_store.embedding_function.embed_query("ISO 9001:2015 Quality management systems")
+    before = search_with_vectors(vector_store, query, k=4)
+    expected = relevance_similarities(vector_store, query, before)
+
+    rebuild_index(vector_store, IndexSpec(), METRIC_COSINE)
+    after = search_with_vectors(vector_store, query, k=4)
+
+    assert is_cosine_store(vector_store)
+    assert [hit.document.metadata["source"] for hit in after][0] == "doc2.pdf"
+    np.testing.assert_allclose(
+        sorted(relevance_similarities(vector_store, query, after)), sorted(expected), atol=1e-5
+    )
+
+
+def test_federated_search_merges_stores_by_similarity():
+    russian = make_cosine_store(["Нагрузки и воздействия", "Снеговые нагрузки"])
+    english = make_cosine_store(["Quality management systems", "Documented information"])
+    embed_query = russian.embedding_function.embed_query
+
+    chunks = federated_search(
+        [(russian, "Снеговые нагрузки", None), (english, "Documented information", None)], embed_query, k=3
+    )
+
+    assert {chunk.document.page_content for chunk in chunks[:2]} == {"Снеговые нагрузки", "Documented information"}
+    assert len(chunks) == 3
+    assert chunks[0].similarity >= chunks[1].similarity >= chunks[2].similarity
+
+
+def test_federated_search_skips_a_failing_store():
+    english = make_cosine_store(["Quality management systems", "Documented information"])
+
+    class BrokenStore:
+        pass
+
+    chunks = federated_search(
+        [(BrokenStore(), "query", None), (english, "Documented information", None)], english.embedding_function.embed_query,
+        k=2,
+    )
+
+    assert chunks[0].document.page_content == "Documented information"
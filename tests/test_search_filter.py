@@ -0,0 +1,153 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from docstore import DOCSTORE_FILENAME
+from document_index import DOCUMENT_INDEX_FILENAME, description_text, write_document_index
+from faiss_index import (
+    METRIC_COSINE, IndexSpec, close_vector_store, create_vector_store, load_faiss_store, save_faiss_store,
+)
+from llm_service import LLMService
+from retrieval import hybrid_search, search_with_vectors
+from search_filter import SearchFilter, bitmap_of_positions, bitmap_positions, filter_bitmap, has_filter_metadata
+from text import FilterResponses
+
+DESCRIPTIONS = {
+    "fire.pdf": {"document_type": "Fire safety code", "description": "Evacuation", "language": "Russian"},
+    "loads.pdf": {"document_type": "Code of practice", "description": "Snow loads", "language": "Russian"},
+    "sni.pdf": {"document_type": "Code of practice", "description": "Earthquakes", "language": "Indonesian"},
+}
+
+
+@pytest.fixture
+def published_store(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    chunks = [(source, f"{source} chunk {i}") for source in DESCRIPTIONS for i in range(6)]
+    texts = [text for _, text in chunks]
+    store = create_vector_store(
+        list(zip(texts, embeddings.embed_documents(texts))), embeddings,
+        metadatas=[{"source": source, "page": 0} for source, _ in chunks],
+        ids=[f"id-{i}" for i in range(len(chunks))], metric=METRIC_COSINE,
+    )
+    save_faiss_store(store, tmp_path)
+    write_document_index(
+        tmp_path / DOCUMENT_INDEX_FILENAME, DESCRIPTIONS,
+        embeddings.embed_documents([description_text(source, metadata) for source, metadata in DESCRIPTIONS.items()]),
+        docstore_path=tmp_path / DOCSTORE_FILENAME,
+    )
+    published = load_faiss_store(tmp_path, embeddings, read_only=True)
+    yield published
+    close_vector_store(published)
+
+
+def test_parse_filter():
+    search_filter = SearchFilter.parse("type=Fire ; language=russian, ; documents=b.pdf, a.pdf")
+
+    assert search_filter == SearchFilter(["fire"], ["Russian"], ["a.pdf", "b.pdf"])
+    assert not SearchFilter.parse("")
+    with pytest.raises(ValueError):
+        SearchFilter.parse("author=Ivanov")
+
+
+def test_filter_confirmation_escapes_user_values():
+    search_filter = SearchFilter.parse("type=<b>fire</b>; documents=a&b.pdf")
+
+    message = FilterResponses.filter_set(search_filter)
+
+    assert "&lt;b&gt;fire&lt;/b&gt;" in message and "<b>fire" not in message
+    assert "a&amp;b.pdf" in message
+    assert message.startswith("\U0001F50E <b>Search filter set</b>")
+
+
+def test_bitmap_round_trip():
+    bitmap = bitmap_of_positions([0, 7, 8, 12], 13)
+
+    assert bitmap_positions(bitmap, 13).tolist() == [0, 7, 8, 12]
+
+
+def test_filter_bitmap_combines_metadata_values(published_store):
+    def allowed_sources(search_filter):
+        positions = bitmap_positions(filter_bitmap(published_store, search_filter), published_store.index.ntotal)
+        return {published_store.docstore.search(published_store.index_to_docstore_id[int(position)]).metadata["source"]
+                for position in positions}
+
+    assert allowed_sources(SearchFilter(document_types=["code"])) == set(DESCRIPTIONS)
+    assert allowed_sources(SearchFilter(document_types=["practice"], languages=["russian"])) == {"loads.pdf"}
+    assert allowed_sources(SearchFilter(languages=["Russian"], sources=["sni.pdf", "fire.pdf"])) == {"fire.pdf"}
+    assert filter_bitmap(published_store, SearchFilter(languages=["russian"])) is \
+        filter_bitmap(published_store, SearchFilter(languages=["Russian"]))
+
+
+def test_filtered_search_returns_a_full_k_of_allowed_chunks(published_store):
+    embeddings = published_store.embedding_function
+
+    chunks, _ = hybrid_search(
+        published_store, "fire safety chunk", embeddings.embed_query, k=6, search_filter=SearchFilter(languages=["indonesian"])
+    )
+
+    assert len(chunks) == 6
+    assert {chunk.document.metadata["source"] for chunk in chunks} == {"sni.pdf"}
+
+
+def test_short_approximate_results_fall_back_to_an_exact_scan():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((400, 8)).astype(np.float32)
+    embeddings = DeterministicFakeEmbedding(size=8)
+    store = create_vector_store(
+        [(f"chunk {i}", vector) for i, vector in enumerate(vectors)], embeddings,
+        metadatas=[{"source": "a.pdf", "page": i} for i in range(len(vectors))],
+        ids=[f"id-{i}" for i in range(len(vectors))], spec=IndexSpec("ivf", nlist=8, nprobe=1),
+    )
+    allowed = bitmap_of_positions(range(0, 400, 40), 400)
+
+    chunks = search_with_vectors(store, vectors[5], k=5, allowed=allowed)
+
+    assert len(chunks) == 5
+    assert all(chunk.position % 40 == 0 for chunk in chunks)
+
+
+def test_hidden_documents_are_never_retrieved(published_store):
+    embeddings = published_store.embedding_function
+    search_filter = SearchFilter().hiding(["fire.pdf", "loads.pdf"])
+
+    chunks, _ = hybrid_search(published_store, "fire.pdf chunk", embeddings.embed_query, k=6, search_filter=search_filter)
+
+    assert len(chunks) == 6
+    assert {chunk.document.metadata["source"] for chunk in chunks} == {"sni.pdf"}
+
+
+def test_source_filters_work_on_stores_without_a_published_docstore():
+    embeddings = DeterministicFakeEmbedding(size=8)
+    texts = [f"{source} chunk" for source in ("a.pdf", "b.pdf", "a.pdf", "c.pdf")]
+    store = create_vector_store(
+        list(zip(texts, embeddings.embed_documents(texts))), embeddings,
+        metadatas=[{"source": text.split()[0]} for text in texts], ids=[f"id-{i}" for i in range(4)],
+    )
+
+    assert bitmap_positions(filter_bitmap(store, SearchFilter(sources=["a.pdf"])), 4).tolist() == [0, 2]
+    assert bitmap_positions(filter_bitmap(store, SearchFilter().hiding(["a.pdf", "c.pdf"])), 4).tolist() == [1]
+
+
+def test_type_and_language_filters_need_document_descriptions(published_store):
+    assert has_filter_metadata(published_store, SearchFilter(document_types=["code"], languages=["russian"]))
+    assert has_filter_metadata(published_store, None)
+
+    published_store.document_index = None
+    assert not has_filter_metadata(published_store, SearchFilter(document_types=["code"]))
+    assert not has_filter_metadata(published_store, SearchFilter(languages=["russian"], sources=["fire.pdf"]))
+    assert has_filter_metadata(published_store, SearchFilter(sources=["fire.pdf"]).hiding(["loads.pdf"]))
+
+
+def test_response_explains_a_filter_the_knowledge_base_cannot_apply(published_store):
+    published_store.document_index = None
+    handle = SimpleNamespace(vector_store=published_store, language="English", folder_path="kb")
+    llm_service = LLMService.__new__(LLMService)
+    llm_service.detect_language = lambda text: "English"
+
+    answer, sources, _ = llm_service.generate_response(
+        "snow loads", SimpleNamespace(handles=[handle], language="English"), search_filter=SearchFilter(["code"])
+    )
+
+    assert "need document descriptions" in answer and sources is None
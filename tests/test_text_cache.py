@@ -0,0 +1,55 @@
+import shutil
+
+import fitz
+import text_cache
+from index_manifest import file_fingerprint
+from text_cache import TextCache, extract_pdfs_cached
+
+
+def write_pdf(path, texts):
+    doc = fitz.open()
+    for text in texts:
+        doc.new_page().insert_text((72, 72), text, fontsize=10)
+    doc.save(path)
+
+
+def fingerprints(folder, filenames):
+    return {filename: file_fingerprint(folder / filename) for filename in filenames}
+
+
+def test_cached_text_is_served_without_parsing_again(tmp_path, monkeypatch):
+    write_pdf(tmp_path / "sp.pdf", ["5.1 Snow loads", "5.2 Wind loads"])
+    cache = TextCache(tmp_path / "cache")
+    [first] = extract_pdfs_cached(tmp_path, fingerprints(tmp_path, ["sp.pdf"]), cache=cache)
+
+    def parse(folder_path, filenames, **kwargs):
+        assert not list(filenames), "a cached PDF was parsed again"
+        return iter(())
+
+    monkeypatch.setattr(text_cache, "extract_pdfs", parse)
+    shutil.copy(tmp_path / "sp.pdf", tmp_path / "copy.pdf")
+
+    [cached] = extract_pdfs_cached(tmp_path, fingerprints(tmp_path, ["copy.pdf"]), cache=cache)
+
+    assert cached.ok and cached.filename == "copy.pdf"
+    assert [(page.source, page.page, page.text, page.blocks) for page in cached.pages] == [
+        ("copy.pdf", page.page, page.text, page.blocks) for page in first.pages
+    ]
+
+
+def test_unreadable_entries_are_extracted_again_and_old_entries_evicted(tmp_path):
+    for name in ("a.pdf", "b.pdf"):
+        write_pdf(tmp_path / name, [f"Text of {name} " * 50])
+    cache = TextCache(tmp_path / "cache")
+    prints = fingerprints(tmp_path, ["a.pdf", "b.pdf"])
+    list(extract_pdfs_cached(tmp_path, prints, cache=cache))
+    cache._entry_path(prints["a.pdf"]["sha256"]).write_bytes(b"not gzip")
+
+    results = list(extract_pdfs_cached(tmp_path, prints, cache=cache))
+
+    assert [result.pages[0].text[:10] for result in results] == ["Text of a.", "Text of b."]
+    assert cache.get(prints["a.pdf"]["sha256"], "a.pdf") is not None
+
+    cache.max_bytes = 1
+    assert cache.prune() == 2
+    assert not cache.contains(prints["b.pdf"]["sha256"])
@@ -0,0 +1,229 @@
+import pytest
+
+import vector_store_registry
+from vector_store_registry import KnowledgeBaseGroup, VectorStoreRegistry
+
+
+class FakeIndex:
+    def __init__(self, ntotal, d=4):
+        self.ntotal = ntotal
+        self.d = d
+
+
+class FakeVectorStore:
+    def __init__(self, ntotal):
+        self.index = FakeIndex(ntotal)
+        self.docstore = None
+        self.closed = False
+
+
+@pytest.fixture(autouse=True)
+def record_closes(monkeypatch):
+    def close_vector_store(vector_store):
+        vector_store.closed = True
+
+    monkeypatch.setattr(vector_store_registry, "close_vector_store", close_vector_store)
+
+
+def make_loader(calls, ntotal=10):
+    def loader(folder_path):
+        calls.append(folder_path)
+        return FakeVectorStore(ntotal)
+    return loader
+
+
+def test_index_is_loaded_once_and_shared(tmp_path):
+    registry = VectorStoreRegistry(memory_budget_bytes=10_000)
+    calls = []
+
+    first = registry.acquire(tmp_path, "Russian", make_loader(calls))
+    second = registry.acquire(tmp_path, "Russian", make_loader(calls))
+
+    assert calls == [tmp_path]
+    assert first.vector_store is second.vector_store
+    assert registry.stats()[0]["refcount"] == 2
+
+
+def test_released_handle_no_longer_sees_store(tmp_path):
+    registry = VectorStoreRegistry(memory_budget_bytes=10_000)
+    handle = registry.acquire(tmp_path, "English", make_loader([]))
+
+    handle.release()
+    handle.release()  # Releasing twice is a no-op
+
+    assert handle.vector_store is None
+    assert registry.stats()[0]["refcount"] == 0
+
+
+def test_idle_entries_evicted_over_budget(tmp_path):
+    # Each fake store is 10 vectors * 4 dims * 4 bytes = 160 bytes
+    registry = VectorStoreRegistry(memory_budget_bytes=500)
+    kb_paths = [tmp_path / name for name in ("a", "b", "c")]
+    handles = [registry.acquire(path, "English", make_loader([])) for path in kb_paths]
+
+    handles[0].release()
+    assert len(registry.stats()) == 3  # Still under budget
+
+    registry.acquire(tmp_path / "d", "English", make_loader([]))
+
+    keys = [entry["key"] for entry in registry.stats()]
+    assert VectorStoreRegistry.make_key(kb_paths[0]) not in keys
+    assert handles[1].vector_store is not None
+
+
+def test_held_entries_are_never_evicted(tmp_path):
+    registry = VectorStoreRegistry(memory_budget_bytes=100)
+    first = registry.acquire(tmp_path / "a", "English", make_loader([]))
+    registry.acquire(tmp_path / "b", "English", make_loader([]))
+
+    assert first.vector_store is not None
+    assert len(registry.stats()) == 2
+
+
+def test_loader_failure_propagates(tmp_path):
+    registry = VectorStoreRegistry(memory_budget_bytes=100)
+
+    def failing_loader(folder_path):
+        raise ValueError("No valid files found in the folder.")
+
+    with pytest.raises(ValueError):
+        registry.acquire(tmp_path, "English", failing_loader)
+    assert registry.stats() == []
+
+
+def test_published_version_is_swapped_in(tmp_path):
+    registry = VectorStoreRegistry(memory_budget_bytes=10_000, version_check_seconds=0)
+    published = {"version": "v1"}
+    reloads = []
+
+    def reloader(folder_path):
+        reloads.append(published["version"])
+        return FakeVectorStore(20)
+
+    handle = registry.acquire(
+        tmp_path, "English", make_loader([]),
+        version_probe=lambda: published["version"], reloader=reloader,
+    )
+    first_store = handle.vector_store
+    assert reloads == []
+
+    published["version"] = "v2"
+    assert handle.vector_store is not first_store
+    assert handle.vector_store.index.ntotal == 20
+    assert reloads == ["v2"]
+    assert registry.stats()[0]["version"] == "v2"
+
+
+def test_group_attaches_each_knowledge_base_once(tmp_path):
+    registry = VectorStoreRegistry(memory_budget_bytes=10_000)
+    (tmp_path / "ru").mkdir()
+    (tmp_path / "iso").mkdir()
+    primary = registry.acquire(tmp_path / "ru", "Russian", make_loader([]))
+    group = KnowledgeBaseGroup(primary.handles).add(registry.acquire(tmp_path / "iso", "English", make_loader([])))
+
+    assert group.add(registry.acquire(tmp_path / "iso", "English", make_loader([]))) is group
+    assert [handle.language for handle in group.handles] == ["Russian", "English"]
+    assert group.language == "Russian"
+    assert sorted(entry["refcount"] for entry in registry.stats()) == [1, 1]
+
+    group.release()
+    assert [entry["refcount"] for entry in registry.stats()] == [0, 0]
+
+
+def test_changed_folder_is_updated_on_acquire(tmp_path):
+    registry = VectorStoreRegistry(memory_budget_bytes=10_000)
+    calls = []
+    changed = {"value": False}
+    probe = lambda folder_path: changed["value"]
+
+    first = registry.acquire(tmp_path, "English", make_loader(calls), change_probe=probe)
+    store = first.vector_store
+    registry.acquire(tmp_path, "English", make_loader(calls), change_probe=probe)
+    assert calls == [tmp_path]
+
+    changed["value"] = True
+    registry.acquire(tmp_path, "English", make_loader(calls, ntotal=20), change_probe=probe)
+
+    assert calls == [tmp_path, tmp_path]
+    # Sessions already holding the knowledge base see the update too
+    assert first.vector_store is not store
+    assert first.vector_store.index.ntotal == 20
+
+
+def test_failed_update_keeps_serving_the_current_index(tmp_path):
+    registry = VectorStoreRegistry(memory_budget_bytes=10_000)
+    handle = registry.acquire(tmp_path, "English", make_loader([]))
+    store = handle.vector_store
+
+    def failing_loader(folder_path):
+        raise ValueError("No valid files found in the folder.")
+
+    registry.acquire(tmp_path, "English", failing_loader, change_probe=lambda folder_path: True)
+
+    assert handle.vector_store is store
+
+
+def test_discarded_folder_is_loaded_afresh(tmp_path):
+    registry = VectorStoreRegistry(memory_budget_bytes=10_000)
+    calls = []
+    handle = registry.acquire(tmp_path, "English", make_loader(calls))
+    handle.release()
+
+    registry.discard(tmp_path)
+    assert registry.stats() == []
+    registry.acquire(tmp_path, "English", make_loader(calls))
+
+    assert calls == [tmp_path, tmp_path]
+
+
+def test_evicted_stores_are_closed_with_their_key_locks(tmp_path):
+    registry = VectorStoreRegistry(memory_budget_bytes=200)
+    first = registry.acquire(tmp_path / "a", "English", make_loader([]))
+    store = first.vector_store
+    first.release()
+
+    registry.acquire(tmp_path / "b", "English", make_loader([]))
+
+    assert store.closed
+    assert list(registry._key_locks) == [VectorStoreRegistry.make_key(tmp_path / "b")]
+
+
+def test_replaced_store_is_closed_when_its_last_handle_is_released(tmp_path):
+    registry = VectorStoreRegistry(memory_budget_bytes=10_000, version_check_seconds=0)
+    published = {"version": "v1"}
+    handle = registry.acquire(
+        tmp_path, "English", make_loader([]),
+        version_probe=lambda: published["version"], reloader=lambda folder_path: FakeVectorStore(20),
+    )
+    old_store = handle.vector_store
+
+    published["version"] = "v2"
+    new_store = handle.vector_store
+    # A query may still be running on the old store
+    assert not old_store.closed
+
+    handle.release()
+    assert old_store.closed and not new_store.closed
+
+
+def test_discarded_store_is_closed_once_released(tmp_path):
+    registry = VectorStoreRegistry(memory_budget_bytes=10_000)
+    handle = registry.acquire(tmp_path, "English", make_loader([]))
+    store = handle.vector_store
+
+    registry.discard(tmp_path)
+    assert not store.closed and registry._key_locks == {}
+
+    handle.release()
+    assert store.closed
+
+
+def test_failed_load_leaves_no_key_lock(tmp_path):
+    registry = VectorStoreRegistry(memory_budget_bytes=100)
+
+    def failing_loader(folder_path):
+        raise ValueError("No valid files found in the folder.")
+
+    with pytest.raises(ValueError):
+        registry.acquire(tmp_path, "English", failing_loader)
+    assert registry._key_locks == {}
@@ -1,6 +1,7 @@
 # text.py
 
 from telegram import BotCommand
+import html
 import logging
 
 class CommandDescriptions:
@@ -1080,4 +1081,64 @@ class ContextErrors:
                 "\u2022 Mengunggah dokumen untuk saya analisis"
             ),
         }
-        return messages[language]
\ No newline at end of file
+        return messages[language]
+
+
+class FilterResponses:
+    @staticmethod
+    def filter_set(search_filter, language="English"):
+        labels = {
+            "English": ("Type", "Language", "Documents"),
+            "Russian": ("Тип", "Язык", "Документы"),
+            "Indonesian": ("Jenis", "Bahasa", "Dokumen"),
+        }
+        fields = zip(labels[language], (search_filter.document_types, search_filter.languages, search_filter.sources))
+        # Values are typed by the user; escape them for the HTML parse mode
+        details = "\n".join(
+            f"\u2022 {label}: {', '.join(html.escape(value) for value in values)}" for label, values in fields if values
+        )
+        messages = {
+            "English": (
+                "\U0001F50E <b>Search filter set</b>\n\n"
+                f"{details}\n\n"
+                "Send /filter without arguments to search all documents again."
+            ),
+            "Russian": (
+                "\U0001F50E <b>Фильтр поиска установлен</b>\n\n"
+                f"{details}\n\n"
+                "Отправьте /filter без параметров, чтобы снова искать по всем документам."
+            ),
+            "Indonesian": (
+                "\U0001F50E <b>Filter pencarian diatur</b>\n\n"
+                f"{details}\n\n"
+                "Kirim /filter tanpa argumen untuk mencari di semua dokumen lagi."
+            ),
+        }
+        return messages[language]
+
+    @staticmethod
+    def filter_cleared(language="English"):
+        messages = {
+            "English": "\U0001F50E Search filter cleared. All documents are searched.",
+            "Russian": "\U0001F50E Фильтр поиска сброшен. Поиск идет по всем документам.",
+            "Indonesian": "\U0001F50E Filter pencarian dihapus. Semua dokumen dicari.",
+        }
+        return messages[language]
+
+    @staticmethod
+    def invalid_filter(language="English"):
+        messages = {
+            "English": (
+                "\u26A0\uFE0F <b>Unknown filter</b>\n\n"
+                "Usage: /filter type=fire safety; language=Russian; documents=a.pdf, b.pdf"
+            ),
+            "Russian": (
+                "\u26A0\uFE0F <b>Неизвестный фильтр</b>\n\n"
+                "Формат: /filter type=пожарная безопасность; language=Russian; documents=a.pdf, b.pdf"
+            ),
+            "Indonesian": (
+                "\u26A0\uFE0F <b>Filter tidak dikenal</b>\n\n"
+                "Format: /filter type=keselamatan kebakaran; language=Indonesian; documents=a.pdf, b.pdf"
+            ),
+        }
+        return messages[language]
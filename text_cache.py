@@ -0,0 +1,139 @@
+# text_cache.py
+
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from pdf_extraction import EXTRACTOR_VERSION, ExtractionResult, PageRecord, extract_pdf, extract_pdfs
+from settings import TEXT_CACHE_MAX_MB, TEXT_CACHE_PATH
+
+logger = logging.getLogger(__name__)
+
+
+class TextCache:
+    """
+    Persistent content-addressed store of extracted PDFs: the text and blocks of
+    every page and the outline, as gzipped JSON files keyed by the PDF's sha256 and
+    EXTRACTOR_VERSION. Identical PDFs in different knowledge bases share an entry.
+    The least recently used entries are evicted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, path=TEXT_CACHE_PATH, max_bytes=TEXT_CACHE_MAX_MB * 1024 * 1024):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _entry_path(self, sha256):
+        return self.path / sha256[:2] / f"{sha256}-v{EXTRACTOR_VERSION}.json.gz"
+
+    def contains(self, sha256):
+        return self._entry_path(sha256).exists()
+
+    def get(self, sha256, filename):
+        """
+        The cached ExtractionResult of the PDF with content hash sha256, with its
+        pages attributed to filename, or None.
+        """
+        entry_path = self._entry_path(sha256)
+        try:
+            with gzip.open(entry_path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            # Touch the entry so eviction sees it as recently used
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Failed to read cached text '{entry_path}': {e}")
+            return None
+        pages = [
+            PageRecord(filename, page, text, None if blocks is None else [tuple(block) for block in blocks])
+            for page, text, blocks in data["pages"]
+        ]
+        return ExtractionResult(filename, pages, toc=data["toc"])
+
+    def put(self, sha256, extraction):
+        """
+        Store a complete extraction (all pages, with blocks) under its content hash.
+        """
+        entry_path = self._entry_path(sha256)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "pages": [[page.page, page.text, page.blocks] for page in extraction.pages],
+            "toc": extraction.toc,
+        }
+        tmp_path = entry_path.with_suffix(f".tmp{threading.get_ident()}")
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, entry_path)
+
+    def prune(self):
+        """
+        Evict the least recently used entries down to 90% of max_bytes, if the cache
+        is over it. Returns the number of entries evicted.
+        """
+        entries = [(entry.stat(), entry) for entry in self.path.glob("*/*.json.gz")]
+        total = sum(stat.st_size for stat, _ in entries)
+        if total <= self.max_bytes:
+            return 0
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        for stat, entry in sorted(entries, key=lambda item: item[0].st_mtime):
+            if total <= target:
+                break
+            entry.unlink(missing_ok=True)
+            total -= stat.st_size
+            evicted += 1
+        logger.info(f"Evicted {evicted} extracted texts from cache {self.path}")
+        return evicted
+
+
+_text_cache = None
+_text_cache_lock = threading.Lock()
+
+
+def get_text_cache():
+    """
+    Return the process-wide TextCache, opening it on first use.
+    """
+    global _text_cache
+    with _text_cache_lock:
+        if _text_cache is None:
+            _text_cache = TextCache()
+        return _text_cache
+
+
+def extract_pdfs_cached(folder_path, fingerprints, cache=None):
+    """
+    Extract the PDFs of fingerprints ({filename: {"sha256", ...}}) with blocks, as
+    extract_pdfs does, serving those whose content was extracted before from the
+    text cache. Only the misses are parsed, in parallel, and then cached. Cached
+    files are read one at a time as they are yielded.
+    Yields one ExtractionResult per filename, in the order of fingerprints.
+    """
+    cache = cache or get_text_cache()
+    started = time.monotonic()
+    misses = [filename for filename, fingerprint in fingerprints.items() if not cache.contains(fingerprint["sha256"])]
+    extracted = extract_pdfs(folder_path, misses, with_blocks=True)
+    pending = set(misses)
+    for filename, fingerprint in fingerprints.items():
+        result = None if filename in pending else cache.get(fingerprint["sha256"], filename)
+        if result is None:
+            # A miss, or an entry that could not be read
+            result = next(extracted) if filename in pending else extract_pdf(folder_path, filename, with_blocks=True)
+            if result.ok:
+                try:
+                    cache.put(fingerprint["sha256"], result)
+                except Exception as e:
+                    logger.error(f"Failed to cache the text of '{filename}': {e}")
+        yield result
+    if fingerprints:
+        logger.info(
+            f"Extracted {len(fingerprints)} PDFs of '{folder_path}' ({len(fingerprints) - len(misses)} from the "
+            f"text cache) in {time.monotonic() - started:.1f}s"
+        )
+    if misses:
+        cache.prune()
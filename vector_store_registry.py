@@ -0,0 +1,354 @@
+# vector_store_registry.py
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+from faiss_index import close_vector_store, index_memory_bytes
+from settings import VECTOR_STORE_MEMORY_BUDGET_MB, INDEX_VERSION_CHECK_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_vector_store_size(vector_store):
+    """
+    Estimate the resident size in bytes of a LangChain FAISS vector store:
+    the index (compressed size for quantized indexes) plus the text held in its
+    docstore. Memory-mapped indexes and exact vectors live in the shared page
+    cache and are not counted.
+    """
+    size = 0
+    try:
+        if not getattr(vector_store, "memory_mapped", False):
+            size += index_memory_bytes(vector_store.index)
+    except AttributeError:
+        pass
+    try:
+        for doc in vector_store.docstore._dict.values():
+            size += len(doc.page_content.encode("utf-8"))
+    except AttributeError:
+        pass
+    return size
+
+
+class _RegistryEntry:
+    def __init__(self, key, folder_path, vector_store, language, reloader, version_probe, version):
+        self.key = key
+        self.folder_path = folder_path
+        self.vector_store = vector_store
+        self.language = language
+        self.reloader = reloader
+        self.version_probe = version_probe
+        self.version = version
+        self.version_checked_at = time.monotonic()
+        self.refcount = 0
+        self.last_used = time.monotonic()
+        self.size_bytes = estimate_vector_store_size(vector_store)
+        # Replaced stores that sessions holding the entry may still be searching
+        self.retired = []
+
+    def close(self, retired_only=False):
+        stores = self.retired if retired_only else self.retired + [self.vector_store]
+        self.retired = []
+        for vector_store in stores:
+            try:
+                close_vector_store(vector_store)
+            except Exception as e:
+                logger.error(f"Failed to close a vector store of '{self.folder_path}': {e}")
+
+
+class KnowledgeBaseHandle:
+    """
+    Read-only reference to a knowledge base index held by the registry.
+    One handle is held per user session; release it when the session
+    switches to another knowledge base or clears its context.
+    """
+
+    def __init__(self, registry, key, folder_path, language, entry=None):
+        self._registry = registry
+        self._entry = entry
+        self.key = key
+        self.folder_path = folder_path
+        self.language = language
+        self.released = False
+
+    @property
+    def vector_store(self):
+        if self.released:
+            return None
+        return self._registry.get_vector_store(self.key)
+
+    @property
+    def handles(self):
+        return [self]
+
+    def release(self):
+        if not self.released:
+            self._registry.release(self)
+
+    def __repr__(self):
+        return f"KnowledgeBaseHandle(folder_path='{self.folder_path}', language='{self.language}')"
+
+
+class KnowledgeBaseGroup:
+    """
+    Several knowledge bases attached to one session and searched together. The
+    first handle is the primary one: answers are written in its language.
+    Releasing the group releases every handle.
+    """
+
+    def __init__(self, handles):
+        self.handles = list(handles)
+
+    @property
+    def language(self):
+        return self.handles[0].language
+
+    @property
+    def folder_path(self):
+        return self.handles[0].folder_path
+
+    def add(self, handle):
+        """
+        Return a group with handle attached as well; a knowledge base that is
+        already attached keeps its existing handle and the new one is released.
+        """
+        if any(existing.key == handle.key for existing in self.handles):
+            handle.release()
+            return self
+        return KnowledgeBaseGroup(self.handles + [handle])
+
+    def release(self):
+        for handle in self.handles:
+            handle.release()
+
+    def __repr__(self):
+        return f"KnowledgeBaseGroup({self.handles})"
+
+
+class VectorStoreRegistry:
+    """
+    Process-wide registry of loaded vector stores keyed by knowledge base path.
+
+    Each index is loaded once and shared read-only by every session that
+    acquires it. Entries are reference counted; entries nobody holds stay
+    warm until the memory budget is exceeded, then they are evicted in
+    least-recently-used order. A store is closed when it is evicted, or, once
+    replaced or discarded, when the last handle on its entry is released.
+
+    When acquired with a version_probe, an entry periodically checks whether a
+    newer index version was published and swaps it in on the next query, so
+    running sessions follow rebuilds without a restart. When acquired with a
+    change_probe, an entry that is already loaded is updated first if the files
+    of its folder changed.
+    """
+
+    def __init__(self, memory_budget_bytes, version_check_seconds=INDEX_VERSION_CHECK_SECONDS):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.version_check_seconds = version_check_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        # key -> [lock, number of threads using it]; dropped with the entry
+        self._key_locks = {}
+
+    @staticmethod
+    def make_key(folder_path):
+        return str(Path(folder_path).resolve())
+
+    @contextmanager
+    def _key_lock(self, key, blocking=True):
+        """
+        Hold the lock serializing loads of one knowledge base; yields whether it was
+        acquired (always, when blocking).
+        """
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+        acquired = key_lock[0].acquire(blocking)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                key_lock[0].release()
+            with self._lock:
+                key_lock[1] -= 1
+                self._drop_key_lock(key)
+
+    def _drop_key_lock(self, key):
+        key_lock = self._key_locks.get(key)
+        if key_lock is not None and key_lock[1] == 0 and key not in self._entries:
+            del self._key_locks[key]
+
+    def acquire(self, folder_path, language, loader, version_probe=None, reloader=None, change_probe=None):
+        """
+        Return a handle for the knowledge base at folder_path, loading it with
+        loader(folder_path) if it is not in memory yet. loader must return a
+        vector store or raise. version_probe() returns the currently published
+        index version; when it changes the entry is reloaded with
+        reloader(folder_path), which defaults to loader. change_probe(folder_path)
+        tells whether the folder's files changed since its index was built; a
+        loaded entry is then updated with loader before the handle is returned.
+        """
+        key = self.make_key(folder_path)
+
+        # Serialize loads per knowledge base so concurrent sessions don't
+        # load the same index twice.
+        with self._key_lock(key):
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None:
+                started = time.monotonic()
+                vector_store = loader(folder_path)
+                if vector_store is None:
+                    raise ValueError(f"Loader returned no vector store for '{folder_path}'")
+                version = version_probe() if version_probe else None
+                entry = _RegistryEntry(
+                    key, folder_path, vector_store, language, reloader or loader, version_probe, version
+                )
+                logger.info(
+                    f"Vector store for '{folder_path}' (version {version}) loaded into registry in "
+                    f"{time.monotonic() - started:.2f}s (~{entry.size_bytes / 1024 / 1024:.1f} MB)"
+                )
+                with self._lock:
+                    self._entries[key] = entry
+            elif change_probe is not None:
+                self._update_if_changed(entry, loader, change_probe)
+
+            with self._lock:
+                entry.refcount += 1
+                entry.last_used = time.monotonic()
+                self._entries.move_to_end(key)
+                self._evict_idle()
+
+        logger.debug(f"Acquired '{folder_path}' (refcount={entry.refcount})")
+        return KnowledgeBaseHandle(self, key, folder_path, language, entry)
+
+    def get_vector_store(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry.last_used = time.monotonic()
+            self._entries.move_to_end(key)
+        self._refresh_version(entry)
+        return entry.vector_store
+
+    def _refresh_version(self, entry):
+        """
+        Swap in a newly published index version. Only one caller reloads; the
+        others keep answering from the current version in the meantime.
+        """
+        if entry.version_probe is None:
+            return
+        now = time.monotonic()
+        if now - entry.version_checked_at < self.version_check_seconds:
+            return
+        entry.version_checked_at = now
+        try:
+            published = entry.version_probe()
+        except Exception as e:
+            logger.error(f"Failed to check index version for '{entry.folder_path}': {e}")
+            return
+        if published == entry.version:
+            return
+
+        with self._key_lock(entry.key, blocking=False) as acquired:
+            if not acquired:
+                return
+            try:
+                logger.info(f"Index version of '{entry.folder_path}' changed: {entry.version} -> {published}")
+                self._swap(entry, entry.reloader(entry.folder_path))
+            except Exception as e:
+                # Keep serving the previous version; retry after the next check interval
+                logger.exception(f"Failed to switch '{entry.folder_path}' to index version {published}: {e}")
+
+    def _update_if_changed(self, entry, loader, change_probe):
+        """
+        Re-run loader on a loaded entry whose folder changed, so added, changed and
+        removed files are indexed before the entry is handed out again. Call with
+        the entry's key lock held. On failure the entry keeps its current index.
+        """
+        try:
+            if not change_probe(entry.folder_path):
+                return
+            logger.info(f"Files of '{entry.folder_path}' changed; updating its index")
+            vector_store = loader(entry.folder_path)
+            if vector_store is None:
+                raise ValueError(f"Loader returned no vector store for '{entry.folder_path}'")
+            self._swap(entry, vector_store)
+        except Exception as e:
+            logger.exception(f"Failed to update '{entry.folder_path}'; serving its current index: {e}")
+
+    def _swap(self, entry, vector_store):
+        with self._lock:
+            if entry.vector_store is not vector_store:
+                entry.retired.append(entry.vector_store)
+                if entry.refcount == 0:
+                    entry.close(retired_only=True)
+            entry.vector_store = vector_store
+            entry.version = entry.version_probe() if entry.version_probe else None
+            entry.version_checked_at = time.monotonic()
+            entry.size_bytes = estimate_vector_store_size(vector_store)
+            self._evict_idle()
+
+    def discard(self, folder_path):
+        """
+        Drop the entry of folder_path, e.g. after its files were deleted, so the next
+        acquire loads it afresh. Handles still held on it no longer see a vector store.
+        """
+        key = self.make_key(folder_path)
+        with self._key_lock(key):
+            with self._lock:
+                entry = self._entries.pop(key, None)
+                if entry is not None and entry.refcount == 0:
+                    entry.close()
+        if entry is not None:
+            logger.info(f"Discarded vector store '{key}' from registry")
+
+    def release(self, handle):
+        with self._lock:
+            handle.released = True
+            entry = handle._entry or self._entries.get(handle.key)
+            if entry is None:
+                return
+            entry.refcount = max(0, entry.refcount - 1)
+            logger.debug(f"Released '{handle.folder_path}' (refcount={entry.refcount})")
+            if entry.refcount == 0:
+                # Nobody searches replaced stores, or a discarded entry, anymore
+                entry.close(retired_only=self._entries.get(handle.key) is entry)
+            self._evict_idle()
+
+    def _evict_idle(self):
+        total = sum(entry.size_bytes for entry in self._entries.values())
+        if total <= self.memory_budget_bytes:
+            return
+        for key in list(self._entries.keys()):
+            if total <= self.memory_budget_bytes:
+                break
+            entry = self._entries[key]
+            if entry.refcount > 0:
+                continue
+            del self._entries[key]
+            self._drop_key_lock(key)
+            entry.close()
+            total -= entry.size_bytes
+            logger.info(f"Evicted idle vector store '{key}' ({entry.size_bytes / 1024 / 1024:.1f} MB)")
+
+    def stats(self):
+        with self._lock:
+            return [
+                {
+                    "key": entry.key,
+                    "version": entry.version,
+                    "refcount": entry.refcount,
+                    "size_bytes": entry.size_bytes,
+                    "idle_seconds": round(time.monotonic() - entry.last_used, 1),
+                }
+                for entry in self._entries.values()
+            ]
+
+
+vector_store_registry = VectorStoreRegistry(VECTOR_STORE_MEMORY_BUDGET_MB * 1024 * 1024)